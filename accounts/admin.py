@@ -1,5 +1,18 @@
 from django.contrib import admin
 from accounts.models import Account
+from strader.utils.admin import EstimatedCountPaginator
 
 
-admin.site.register(Account)
+@admin.register(Account)
+class AccountAdmin(admin.ModelAdmin):
+    list_display = ('user', 'available_bp', 'alloted_bp')
+    list_select_related = ('user', )
+    search_fields = ('=user__username', )
+    raw_id_fields = ('user', )
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def save_model(self, request, obj, form, change):
+        # cached risk snapshots of the account are reloaded
+        obj.version += 1
+        super().save_model(request, obj, form, change)
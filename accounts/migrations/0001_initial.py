@@ -0,0 +1,29 @@
+# Generated by Django 3.1.2 on 2026-10-19 17:52
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Account',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('available_bp', models.FloatField(default=0.0, max_length=6)),
+                ('alloted_bp', models.FloatField(default=0.0, max_length=6)),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='account', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'db_table': 'account_account',
+            },
+        ),
+    ]
@@ -9,6 +9,8 @@ class Account(models.Model):
     alloted_bp = models.FloatField(max_length=6, default=0.0)
     user = models.OneToOneField(User, on_delete=models.CASCADE,
                                 related_name='account')
+    # bumped by every write to the balance or shares, see trades.risk
+    version = models.PositiveIntegerField(default=0, editable=False)
 
     class Meta:
         db_table = 'account_account'
@@ -1,5 +1,4 @@
 pip install -r requirements.txt
-python manage.py makemigrations
 python manage.py migrate
 python manage.py loaddata user
 python manage.py loaddata orders
@@ -2,6 +2,8 @@
 ASGI config for strader project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Requests to ``ORDER_EVENTS_PATH`` are served by the order event stream, every
+other request goes to Django.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/3.1/howto/deployment/asgi/
@@ -13,4 +15,15 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'strader.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from django.conf import settings  # noqa: E402
+from trades.streaming import order_events  # noqa: E402
+
+
+async def application(scope, receive, send):
+    if scope['type'] in ('http', 'websocket') and \
+            scope['path'] == settings.ORDER_EVENTS_PATH:
+        await order_events(scope, receive, send)
+    else:
+        await django_application(scope, receive, send)
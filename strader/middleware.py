@@ -0,0 +1,43 @@
+import threading
+from django.conf import settings
+from django.http import JsonResponse
+from strader.utils.metrics import metrics
+
+
+class AdmissionControlMiddleware:
+    """
+    Shed load once too many requests are in flight in this worker.
+
+    Django has no connection pool to inspect, but each in-flight request
+    holds (or waits for) a DB connection, so the in-flight count is the
+    depth of the DB queue. Past `ADMISSION_MAX_INFLIGHT` new requests get a
+    503 with `Retry-After` right away instead of queueing behind the others.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.lock = threading.Lock()
+        self.inflight = 0
+
+    def __call__(self, request):
+        limit = getattr(settings, 'ADMISSION_MAX_INFLIGHT', None)
+        with self.lock:
+            if limit is not None and self.inflight >= limit:
+                admitted = False
+            else:
+                admitted = True
+                self.inflight += 1
+
+        if not admitted:
+            metrics.incr('admission.rejected')
+            response = JsonResponse({'detail': 'Server is busy, retry later.',
+                                     'status_code': 503}, status=503)
+            response['Retry-After'] = '1'
+            return response
+
+        metrics.incr('admission.accepted')
+        try:
+            return self.get_response(request)
+        finally:
+            with self.lock:
+                self.inflight -= 1
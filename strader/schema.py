@@ -0,0 +1,117 @@
+import hashlib
+import json
+import logging
+import threading
+from functools import lru_cache
+from pathlib import Path
+from django.apps import apps
+from django.conf import settings
+from django.http import Http404, HttpResponse
+from django.views.decorators.http import condition
+
+
+VERSION_KEY = 'x-code-version'
+
+logger = logging.getLogger(__name__)
+
+
+@lru_cache(maxsize=None)
+def code_version():
+    """
+    Hash of the project sources the schema is introspected from, hashed
+    once per process since the loaded code doesn't change.
+    """
+
+    digest = hashlib.sha256()
+    for app in ['strader'] + settings.PROJECT_APPS:
+        for path in sorted((Path(settings.BASE_DIR) / app).rglob('*.py')):
+            digest.update(str(path.relative_to(settings.BASE_DIR)).encode())
+            digest.update(path.read_bytes())
+    return digest.hexdigest()[:16]
+
+
+def render_schema(version):
+    """Introspect the API with drf-yasg and render it as JSON"""
+
+    from drf_yasg.codecs import OpenAPICodecJson
+    from drf_yasg.generators import OpenAPISchemaGenerator
+    from strader.docs import api_info
+
+    schema = OpenAPISchemaGenerator(api_info).get_schema(request=None,
+                                                         public=True)
+    schema[VERSION_KEY] = version
+    return OpenAPICodecJson(validators=[]).encode(schema)
+
+
+def build_schema(path=None):
+    """Render the schema and write it to `OPENAPI_SCHEMA_PATH`"""
+
+    path = Path(path or settings.OPENAPI_SCHEMA_PATH)
+    content = render_schema(code_version())
+    path.write_bytes(content)
+    return path
+
+
+class SchemaCache:
+    """
+    The OpenAPI schema, rendered once per process.
+
+    The artifact written by `build_schema` is used as long as it was built
+    from the current sources. A missing or stale artifact is rendered again
+    once where the docs are enabled. Lean workers never import drf-yasg,
+    they serve a stale artifact with a warning and a 404 without one.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.content = None
+        self.etag = None
+
+    def load(self):
+        version = code_version()
+        try:
+            content = Path(settings.OPENAPI_SCHEMA_PATH).read_bytes()
+        except FileNotFoundError:
+            content = None
+
+        if content is None or \
+                json.loads(content).get(VERSION_KEY) != version:
+            if apps.is_installed('drf_yasg'):
+                content = render_schema(version)
+            elif content is not None:
+                logger.warning('Serving an OpenAPI schema built from other '
+                               'sources, run build_schema.')
+        if content is None:
+            raise Http404('OpenAPI schema was not built.')
+
+        self.etag = hashlib.sha256(content).hexdigest()[:32]
+        self.content = content
+
+    def get(self):
+        if self.content is None:
+            with self._lock:
+                if self.content is None:
+                    self.load()
+        return self.content
+
+    def clear(self):
+        with self._lock:
+            self.content = self.etag = None
+
+
+schema_cache = SchemaCache()
+
+
+def _etag(request):
+    schema_cache.get()
+    return schema_cache.etag
+
+
+@condition(etag_func=_etag)
+def static_schema(request):
+    """
+    Serve the OpenAPI schema from memory, with an ETag so that clients can
+    revalidate with a 304 instead of downloading it again.
+    """
+
+    return HttpResponse(schema_cache.get(), content_type='application/json')
@@ -57,6 +57,7 @@ PROJECT_APPS = [
 INSTALLED_APPS += THIRD_PARTY_APPS + PROJECT_APPS
 
 MIDDLEWARE = [
+    'strader.middleware.AdmissionControlMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -80,6 +81,9 @@ REST_FRAMEWORK = {
     ],
     'TEST_REQUEST_DEFAULT_FORMAT': 'json',
     'EXCEPTION_HANDLER': 'strader.exception_handler.custom_exception_handler',
+    'DEFAULT_THROTTLE_CLASSES': (
+        'trades.throttling.TokenBucketThrottle',
+    ),
     'DEFAULT_SCHEMA_CLASS': 'rest_framework.schemas.coreapi.AutoSchema'
 }
 
@@ -88,6 +92,111 @@ SIMPLE_JWT = {
     'REFRESH_TOKEN_LIFETIME': timedelta(days=1)
 }
 
+# Seconds before the in-memory stock search index is rebuilt even without
+# a local Stock change, so that workers pick up changes made elsewhere.
+STOCK_SEARCH_INDEX_TTL = 300
+
+# Stocks matching a `stock_name` filter above which orders are filtered with
+# a join on the stock name instead of an `IN` list of stock ids.
+STOCK_NAME_FILTER_MAX_IDS = 500
+
+# Seconds a response stored for an Idempotency-Key can be replayed and the
+# number of keys kept in the per-process LRU in front of the table.
+IDEMPOTENCY_KEY_TTL = 24 * 60 * 60
+IDEMPOTENCY_CACHE_SIZE = 10000
+
+# Token buckets per account and endpoint, keyed by the view's
+# `throttle_scope`. `rate` is the refill rate and `burst` the bucket size.
+THROTTLE_BUCKETS = {
+    'orders.create': {'rate': '10/s', 'burst': 20},
+    'orders': {'rate': '50/s', 'burst': 100},
+    'summary': {'rate': '50/s', 'burst': 100},
+    'shares': {'rate': '50/s', 'burst': 100},
+    'stock-search': {'rate': '50/s', 'burst': 100},
+    'portfolio-history': {'rate': '5/s', 'burst': 10},
+}
+# Use 'trades.throttling.CacheBucketBackend' to share buckets between
+# workers through the default cache, which must then be a shared one
+# (Redis, Memcached or the database), not the per-process LocMemCache.
+THROTTLE_BACKEND = 'trades.throttling.LocalBucketBackend'
+
+# Requests in flight per worker before new ones are shed with a 503.
+ADMISSION_MAX_INFLIGHT = 64
+
+# Order event stream served by the ASGI app (SSE or WebSocket). Events are
+# published in-process by default, use 'trades.events.RedisBackend' with
+# ORDER_EVENTS_REDIS_URL to relay them between workers.
+ORDER_EVENTS_PATH = '/trade/events/'
+ORDER_EVENTS_BACKEND = 'trades.events.InProcessBackend'
+ORDER_EVENTS_REDIS_URL = 'redis://127.0.0.1:6379/0'
+# events kept per account for resuming, and per subscriber before a slow
+# subscriber is disconnected
+ORDER_EVENTS_BUFFER = 256
+ORDER_EVENTS_QUEUE_SIZE = 1024
+# accounts without subscribers whose buffer is kept, most recent first
+ORDER_EVENTS_MAX_ACCOUNTS = 10000
+ORDER_EVENTS_HEARTBEAT = 15
+
+# Positions of an account are snapshotted every N orders (0 disables) and by
+# the daily `take_portfolio_snapshots` job, so that point-in-time queries
+# only replay the orders placed since the nearest snapshot.
+PORTFOLIO_SNAPSHOT_EVERY = 500
+PORTFOLIO_HISTORY_MAX_POINTS = 366
+
+# Admin changelists count rows exactly up to this limit, then estimate, and
+# bulk actions update this many rows per query.
+ADMIN_EXACT_COUNT_LIMIT = 10000
+ADMIN_BATCH_SIZE = 1000
+
+# How the cost basis of sold shares is computed: 'FIFO' or 'AVERAGE'
+COST_BASIS_METHOD = 'FIFO'
+
+# Optional batched order intake: validated orders are queued and committed by
+# one thread per worker in a single transaction, once ORDER_INTAKE_MAX_BATCH
+# orders are queued or ORDER_INTAKE_MAX_DELAY seconds after the first one.
+ORDER_INTAKE_BATCHED = False
+ORDER_INTAKE_MAX_BATCH = 500
+ORDER_INTAKE_MAX_DELAY = 0.005
+# seconds a request waits for its batch to start before the order is
+# withdrawn from the queue and committed directly
+ORDER_INTAKE_TIMEOUT = 5
+
+# Audit trail of orders, balance changes and admin changes, see trades.audit.
+# Events are buffered and bulk inserted every AUDIT_FLUSH_INTERVAL seconds or
+# AUDIT_BATCH_SIZE events. At most AUDIT_MAX_BUFFER events are kept while the
+# inserts fail, older ones are dropped.
+AUDIT_BUFFERED = True
+AUDIT_BATCH_SIZE = 500
+AUDIT_FLUSH_INTERVAL = 0.5
+AUDIT_MAX_BUFFER = 50000
+
+# Pre-trade checks run in order on every new order, see `trades.risk`. A
+# check is a `check(snapshot, order)` callable returning an error message.
+RISK_CHECKS = [
+    'trades.risk.buying_power',
+    'trades.risk.available_shares',
+    'trades.risk.max_order_value',
+    'trades.risk.position_concentration',
+    'trades.risk.stock_limits',
+    'trades.risk.daily_loss',
+]
+# limits of the checks above, None disables a check
+RISK_MAX_ORDER_VALUE = None
+# largest share of the account's equity one position can reach with a buy
+RISK_MAX_POSITION_SHARE = None
+# per stock code, e.g. {'AAPL': {'max_quantity': 1000,
+# 'max_order_value': 50000}}
+RISK_STOCK_LIMITS = {}
+# realized losses of the day after which buys are rejected
+RISK_MAX_DAILY_LOSS = None
+# accounts whose risk snapshot is cached per worker, see trades.risk
+ACCOUNT_STATE_CACHE_SIZE = 10000
+
+# Times every test and seeds the test databases once with these fixtures,
+# before `--parallel` clones them, see strader.testing
+TEST_RUNNER = 'strader.testing.TimedTestRunner'
+TEST_SEED_FIXTURES = ['orders', 'status', 'stocks']
+
 ROOT_URLCONF = 'strader.urls'
 
 TEMPLATES = [
@@ -158,3 +267,16 @@ USE_TZ = True
 
 STATIC_URL = '/static/'
 STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
+
+# OpenAPI schema built by `manage.py build_schema`, served from memory on
+# /openapi.json and rendered once per process if missing or stale
+OPENAPI_SCHEMA_PATH = BASE_DIR / 'openapi.json'
+
+SWAGGER_SETTINGS = {
+    'DEFAULT_INFO': 'strader.docs.api_info',
+    'SPEC_URL': 'schema-json',
+}
+
+REDOC_SETTINGS = {
+    'SPEC_URL': 'schema-json',
+}
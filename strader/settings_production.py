@@ -0,0 +1,60 @@
+"""
+Production settings for strader project.
+
+A lean profile for API workers, use it with
+``DJANGO_SETTINGS_MODULE=strader.settings_production``. Only the apps the API
+needs are loaded, the browsable API is disabled and the admin and drf-yasg
+docs are only loaded when enabled with ``STRADER_ADMIN=1`` and
+``STRADER_DOCS=1``. Without the docs the OpenAPI schema prebuilt at build time
+is served from ``/openapi.json``. ``DJANGO_SECRET_KEY`` is required.
+"""
+
+import os
+
+from django.core.exceptions import ImproperlyConfigured
+
+from strader.settings import *  # noqa: F401,F403
+from strader.settings import INSTALLED_APPS, PROJECT_APPS, REST_FRAMEWORK
+
+DEBUG = False
+
+SECRET_KEY = os.environ.get('DJANGO_SECRET_KEY')
+if not SECRET_KEY:
+    # never fall back to the development key committed to the repo
+    raise ImproperlyConfigured('Set DJANGO_SECRET_KEY.')
+
+ALLOWED_HOSTS = os.environ.get('DJANGO_ALLOWED_HOSTS', '127.0.0.1').split(',')
+
+ENABLE_ADMIN = os.environ.get('STRADER_ADMIN') == '1'
+ENABLE_DOCS = os.environ.get('STRADER_DOCS') == '1'
+
+API_APPS = [
+    'django.contrib.auth',
+    'django.contrib.contenttypes',
+    'rest_framework',
+    'django_filters',
+] + PROJECT_APPS
+
+API_MIDDLEWARE = [
+    'strader.middleware.AdmissionControlMiddleware',
+    'corsheaders.middleware.CorsMiddleware',
+    'django.middleware.security.SecurityMiddleware',
+    'django.middleware.common.CommonMiddleware',
+]
+
+if ENABLE_ADMIN or ENABLE_DOCS:
+    # the admin and the docs UIs need the full middleware and apps
+    INSTALLED_APPS = [
+        app for app in INSTALLED_APPS
+        if (ENABLE_ADMIN or app != 'django.contrib.admin') and
+        (ENABLE_DOCS or app != 'drf_yasg')
+    ]
+else:
+    MIDDLEWARE = API_MIDDLEWARE
+    INSTALLED_APPS = API_APPS
+
+REST_FRAMEWORK = dict(REST_FRAMEWORK, DEFAULT_RENDERER_CLASSES=[
+    'rest_framework.renderers.JSONRenderer',
+])
+
+ROOT_URLCONF = 'strader.urls_production'
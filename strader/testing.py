@@ -0,0 +1,216 @@
+import json
+import sys
+import time
+import unittest
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import override_settings
+from django.test.runner import (
+    DiscoverRunner,
+    ParallelTestSuite,
+    RemoteTestResult,
+    RemoteTestRunner,
+)
+from rest_framework.test import APITestCase
+from rest_framework_simplejwt.tokens import AccessToken
+
+
+def seed_fixtures():
+    return list(getattr(settings, 'TEST_SEED_FIXTURES', []))
+
+
+def seed_database(alias='default'):
+    """Load the seed fixtures into a test database"""
+
+    call_command('loaddata', *seed_fixtures(), database=alias, verbosity=0)
+
+
+def create_user(username='test-user', password=None, available_bp=None):
+    """
+    Create a user and its account. Passwords are hashed with the fast
+    hasher the test runner installs.
+    """
+
+    user = User(username=username)
+    if password is None:
+        user.set_unusable_password()
+    else:
+        user.set_password(password)
+    user.save()
+    if available_bp is not None:
+        user.account.available_bp = available_bp
+        user.account.save()
+    return user
+
+
+def token_for(user):
+    """Access token of a user, as `/api/token/` would return it"""
+
+    return str(AccessToken.for_user(user))
+
+
+class SeededTestCase(APITestCase):
+    """
+    Test case running against the seed fixtures.
+
+    `TimedTestRunner` loads them once into the test database before it is
+    cloned for the parallel workers, and each test rolls back to it. Under
+    another runner they are loaded once per class instead of once per test.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        from trades.models import OrderType
+
+        if not OrderType.objects.exists():
+            # inside the class transaction, rolled back after the class
+            for alias in cls._databases_names(include_mirrors=False):
+                seed_database(alias)
+
+    def setUp(self):
+        from trades.risk import snapshot_cache
+        from trades.throttling import get_backend
+
+        # account ids and versions repeat between tests
+        snapshot_cache.clear()
+        get_backend().reset()
+
+    def authenticate(self, user):
+        token = token_for(user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        return user
+
+
+class TimedTextTestResult(unittest.TextTestResult):
+    """Text result recording the duration of every test"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.durations = {}
+        self._started = None
+
+    def startTest(self, test):
+        self._started = time.perf_counter()
+        super().startTest(test)
+
+    def addDuration(self, test, elapsed):
+        self.durations[test.id()] = elapsed
+
+    def stopTest(self, test):
+        # tests run by a parallel worker report their own duration
+        self.durations.setdefault(test.id(),
+                                  time.perf_counter() - self._started)
+        super().stopTest(test)
+
+
+class TimedRemoteTestResult(RemoteTestResult):
+    """Sends the duration of each test back from the parallel workers"""
+
+    def startTest(self, test):
+        self._started = time.perf_counter()
+        super().startTest(test)
+
+    def stopTest(self, test):
+        self.events.append(('addDuration', self.test_index,
+                            time.perf_counter() - self._started))
+        super().stopTest(test)
+
+
+class TimedRemoteTestRunner(RemoteTestRunner):
+    resultclass = TimedRemoteTestResult
+
+
+class TimedParallelTestSuite(ParallelTestSuite):
+    runner_class = TimedRemoteTestRunner
+
+
+class TimedTestRunner(DiscoverRunner):
+    """
+    Test runner for the project:
+
+    - passwords are hashed with MD5 and the audit log isn't buffered
+    - the test databases are seeded with `TEST_SEED_FIXTURES` once, before
+      `--parallel` clones them for the workers
+    - the slowest tests are reported, and `--timing-report` writes the
+      duration of every test as JSON
+    """
+
+    parallel_test_suite = TimedParallelTestSuite
+
+    def __init__(self, slowest=10, timing_report=None, **kwargs):
+        super().__init__(**kwargs)
+        self.slowest = slowest
+        self.timing_report = timing_report
+        self._overrides = None
+
+    @classmethod
+    def add_arguments(cls, parser):
+        super().add_arguments(parser)
+        # Django 3.2 adds its own --timing
+        parser.add_argument('--slowest', type=int, default=10, metavar='N',
+                            help='Number of slowest tests to report, 0 to '
+                                 'disable')
+        parser.add_argument('--timing-report', metavar='PATH',
+                            help='Write the duration of every test to PATH '
+                                 'as JSON')
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._overrides = override_settings(
+            PASSWORD_HASHERS=[
+                'django.contrib.auth.hashers.MD5PasswordHasher',
+            ],
+            AUDIT_BUFFERED=False,
+        )
+        self._overrides.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self._overrides.disable()
+        super().teardown_test_environment(**kwargs)
+
+    def setup_databases(self, **kwargs):
+        # seed the databases before they are cloned for the workers
+        parallel, self.parallel = self.parallel, 1
+        try:
+            old_config = super().setup_databases(**kwargs)
+        finally:
+            self.parallel = parallel
+
+        for connection, _, _ in old_config:
+            if seed_fixtures():
+                seed_database(connection.alias)
+                # what TransactionTestCase.serialized_rollback restores
+                if connection.settings_dict['TEST'].get('SERIALIZE', True):
+                    connection._test_serialized_contents = \
+                        connection.creation.serialize_db_to_string()
+            if parallel > 1:
+                for index in range(parallel):
+                    connection.creation.clone_test_db(
+                        suffix=str(index + 1), verbosity=self.verbosity,
+                        keepdb=self.keepdb)
+        return old_config
+
+    def get_resultclass(self):
+        return super().get_resultclass() or TimedTextTestResult
+
+    def run_suite(self, suite, **kwargs):
+        result = super().run_suite(suite, **kwargs)
+        durations = getattr(result, 'durations', None)
+        if durations:
+            self.report_timing(durations)
+        return result
+
+    def report_timing(self, durations):
+        slowest = sorted(durations.items(), key=lambda item: -item[1])
+        if self.timing_report:
+            with open(self.timing_report, 'w') as report:
+                json.dump(dict(slowest), report, indent=2)
+        if self.slowest > 0:
+            lines = [f'{elapsed:8.3f}s  {test}'
+                     for test, elapsed in slowest[:self.slowest]]
+            sys.stderr.write(
+                f'\nSlowest {len(lines)} of {len(durations)} tests '
+                f'({sum(durations.values()):.1f}s in total):\n' +
+                '\n'.join(lines) + '\n')
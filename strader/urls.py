@@ -20,40 +20,19 @@ from rest_framework_simplejwt.views import (
     TokenObtainPairView,
     TokenRefreshView,
 )
-from rest_framework import permissions
-from drf_yasg.views import get_schema_view
-from drf_yasg import openapi
 from strader import settings
+from strader.schema import static_schema
+from strader.views import MetricsView
 
 
-schema_view = get_schema_view(
-   openapi.Info(
-      title='Strader API',
-      default_version='v1',
-      description='API documentation for the Strader project.',
-      terms_of_service='',
-      contact=openapi.Contact(email=''),
-      license=openapi.License(name=''),
-   ),
-   public=True,
-   permission_classes=(permissions.AllowAny,),
-)
-
-docs = [
-    # path(r'swagger(?P<format>\.json|\.yaml)$',
-    #      schema_view.without_ui(cache_timeout=0), name='schema-json'),
-    path('docs/', schema_view.with_ui('swagger', cache_timeout=0),
-         name='schema-swagger-ui'),
-    path('redoc/', schema_view.with_ui('redoc', cache_timeout=0),
-         name='schema-redoc'),
-]
-
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('api/token/refresh/', TokenRefreshView.as_view(),
           name='token_refresh'),
     path('trade/', include('trades.urls')),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
+    path('openapi.json', static_schema, name='schema-json'),
 ] + static(settings.STATIC_URL)
 
-urlpatterns += docs
+urlpatterns += [path('', include('strader.docs'))]
@@ -0,0 +1,30 @@
+"""strader URL Configuration for production workers
+
+Only the API is routed by default. The admin and the drf-yasg docs are
+imported only when enabled in `strader.settings_production`.
+"""
+from django.conf import settings
+from django.urls import path, include
+from rest_framework_simplejwt.views import (
+    TokenObtainPairView,
+    TokenRefreshView,
+)
+from strader.schema import static_schema
+from strader.views import MetricsView
+
+
+urlpatterns = [
+    path('api/token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
+    path('api/token/refresh/', TokenRefreshView.as_view(),
+         name='token_refresh'),
+    path('trade/', include('trades.urls')),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
+    path('openapi.json', static_schema, name='schema-json'),
+]
+
+if getattr(settings, 'ENABLE_ADMIN', False):
+    from django.contrib import admin
+    urlpatterns.append(path('admin/', admin.site.urls))
+
+if getattr(settings, 'ENABLE_DOCS', False):
+    urlpatterns.append(path('', include('strader.docs')))
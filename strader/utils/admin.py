@@ -0,0 +1,58 @@
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator for the admin changelists of huge tables.
+
+    Rows are counted exactly up to `ADMIN_EXACT_COUNT_LIMIT`. Past that,
+    unfiltered PostgreSQL tables use the planner's row estimate and other
+    querysets report the limit, so that no `COUNT(*)` scans the table.
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        limit = getattr(settings, 'ADMIN_EXACT_COUNT_LIMIT', 10000)
+        count = queryset.values('pk')[:limit + 1].count()
+        if count <= limit:
+            return count
+        if not queryset.query.where:
+            return max(self.estimate(queryset) or 0, limit)
+        return limit
+
+    @staticmethod
+    def estimate(queryset):
+        connection = connections[queryset.db]
+        if connection.vendor != 'postgresql':
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT reltuples FROM pg_class WHERE relname = %s',
+                           [queryset.model._meta.db_table])
+            row = cursor.fetchone()
+        return int(row[0]) if row else None
+
+
+def update_in_batches(queryset, batch_size=1000, **values):
+    """
+    `queryset.update(**values)` one batch of primary keys at a time, so that
+    each UPDATE locks a bounded number of rows.
+
+    Return:
+        number of updated rows
+    """
+
+    model = queryset.model
+    updated, last_pk = 0, None
+    while True:
+        batch = queryset.order_by('pk')
+        if last_pk is not None:
+            batch = batch.filter(pk__gt=last_pk)
+        pks = list(batch.values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            return updated
+        updated += model._default_manager.filter(pk__in=pks).update(**values)
+        last_pk = pks[-1]
@@ -0,0 +1,19 @@
+from rest_framework import status
+from rest_framework.permissions import IsAdminUser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+from rest_framework.views import APIView
+from strader.utils.metrics import metrics
+
+
+class MetricsView(APIView):
+    """
+        API for the in-process counters of this worker (staff only).
+    """
+
+    permission_classes = [IsAdminUser]
+    renderer_classes = [JSONRenderer]
+    swagger_schema = None
+
+    def get(self, request):
+        return Response(metrics.snapshot(), status=status.HTTP_200_OK)
@@ -0,0 +1,207 @@
+from base64 import b64decode, b64encode
+from bisect import bisect_right
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+from accounts.models import Account
+from trades import audit, costbasis
+from trades.models import (AuditEvent, CorporateAction, CorporateActionBatch,
+                           Order, PortfolioSnapshot, Stock, StockShare)
+
+
+def parse_ratio(value):
+    """
+    Parse a split ratio written `new:old`, `2:1` for a 2-for-1 split.
+
+    Return:
+        new shares per old share
+    """
+
+    new, _, old = value.partition(':')
+    new, old = float(new), float(old or 1)
+    if new <= 0 or old <= 0:
+        raise ValueError(value)
+    return new / old
+
+
+def check_code(stock, code):
+    """Stock codes are looked up with get(), they must stay unique"""
+
+    if Stock.objects.filter(code=code).exclude(pk=stock.pk).exists():
+        raise ValueError(f'Stock code {code} is taken.')
+
+
+def create_action(stock, kind, ratio=None, new_code='', new_name=''):
+    if kind == CorporateAction.SPLIT and not (ratio and ratio > 1):
+        raise ValueError('A split takes more than one new share per share.')
+    if kind == CorporateAction.REVERSE_SPLIT and not (ratio and ratio < 1):
+        raise ValueError('A reverse split takes less than one new share '
+                         'per share.')
+    if kind == CorporateAction.RENAME:
+        if not new_code:
+            raise ValueError('A rename needs the new code.')
+        check_code(stock, new_code)
+    return CorporateAction.objects.create(
+        stock=stock, kind=kind, ratio=ratio, old_code=stock.code,
+        new_code=new_code, new_name=new_name)
+
+
+def affected_accounts(stock_id):
+    """Ids of the accounts holding or having traded a stock, ascending"""
+
+    ids = set(StockShare.objects.filter(stock_id=stock_id)
+              .values_list('account_id', flat=True).iterator())
+    ids.update(Order.objects.filter(stock_id=stock_id)
+               .values_list('account_id', flat=True).distinct().iterator())
+    return sorted(ids)
+
+
+def batches(action, batch_size):
+    """
+    `account_ids` batches of an action, without the accounts of the batches
+    applied already. Trading in the stock is halted, so an account is
+    applied iff it is within the id range of an applied batch, whatever the
+    batch size of the earlier runs.
+    """
+
+    ranges = sorted(action.batches.values_list('first_account_id',
+                                               'last_account_id'))
+    firsts = [first for first, _ in ranges]
+
+    def applied(pk):
+        i = bisect_right(firsts, pk)
+        return i > 0 and pk <= ranges[i - 1][1]
+
+    ids = [pk for pk in affected_accounts(action.stock_id) if not applied(pk)]
+    for start in range(0, len(ids), batch_size):
+        yield ids[start:start + batch_size]
+
+
+def split_positions(positions, stock_id, ratio):
+    """Apply a split to the JSON positions of a portfolio snapshot"""
+
+    quantity, cost, lots = positions[str(stock_id)]
+    basis = costbasis.load(b64decode(lots), quantity, cost)
+    basis.split(ratio)
+    positions[str(stock_id)] = [basis.quantity, basis.cost,
+                                b64encode(basis.pack()).decode()]
+
+
+def split_batch(action_id, account_ids, chunk_size=1000):
+    """
+    Apply a split to the shares, orders and portfolio snapshots of
+    `account_ids` in one transaction. Positions keep their cost for `ratio`
+    times as many shares, and past orders are adjusted to the new share
+    count so that replaying them gives the same positions.
+
+    Return:
+        dict of counters, None if the batch was applied already
+    """
+
+    action = CorporateAction.objects.select_related('stock').get(pk=action_id)
+    ratio, stock_id = action.ratio, action.stock_id
+    quantities = {}
+
+    try:
+        with transaction.atomic():
+            # fails if another run applied the batch already
+            batch = CorporateActionBatch.objects.create(
+                action=action, first_account_id=account_ids[0],
+                last_account_id=account_ids[-1])
+            accounts = Account.objects.filter(id__in=account_ids)
+            list(accounts.select_for_update().values_list('id', flat=True))
+            # or a batch of another size overlapping this one
+            if action.batches.exclude(pk=batch.pk).filter(
+                    first_account_id__lte=account_ids[-1],
+                    last_account_id__gte=account_ids[0]).exists():
+                raise IntegrityError('Batch applied already.')
+
+            held = StockShare.objects.filter(stock_id=stock_id,
+                                             account_id__in=account_ids)
+            shares = list(held.only('id', 'account_id', 'quantity',
+                                    'total_value', 'lots', 'sold_qty',
+                                    'sold_cost'))
+            bases = []
+            for share in shares:
+                basis = costbasis.load_share(share)
+                basis.split(ratio)
+                quantities[share.account_id] = (share.quantity,
+                                                basis.quantity)
+                costbasis.store(share, basis)
+                bases.append(basis)
+            StockShare.objects.bulk_update(shares, ['quantity', 'lots',
+                                                    'sold_qty'],
+                                           batch_size=chunk_size)
+            costbasis.split_lots(held, ratio)
+            costbasis.write_lots(bases)
+
+            batch.orders = (Order.objects
+                            .filter(stock_id=stock_id,
+                                    account_id__in=account_ids)
+                            .update(quantity=F('quantity') * ratio,
+                                    price=F('price') / ratio))
+
+            # has_key takes numeric keys for array indexes, filter here
+            snapshots = [snapshot for snapshot in
+                         PortfolioSnapshot.objects
+                         .filter(account_id__in=account_ids)
+                         .only('id', 'positions')
+                         .iterator(chunk_size=chunk_size)
+                         if str(stock_id) in snapshot.positions]
+            for snapshot in snapshots:
+                split_positions(snapshot.positions, stock_id, ratio)
+            PortfolioSnapshot.objects.bulk_update(snapshots, ['positions'],
+                                                  batch_size=chunk_size)
+
+            # drop the cached risk snapshots of every worker
+            accounts.update(version=F('version') + 1)
+            batch.shares = len(shares)
+            batch.save(update_fields=['shares', 'orders'])
+    except IntegrityError:
+        if action.batches.filter(first_account_id__lte=account_ids[-1],
+                                 last_account_id__gte=account_ids[0]).exists():
+            return None
+        raise
+
+    for account_id, (before, after) in quantities.items():
+        audit.audit_log.record(AuditEvent.CORPORATE_ACTION, account_id, {
+            'action': action.get_kind_display(),
+            'stock': action.old_code,
+            'ratio': ratio,
+            'quantity': [before, after],
+        })
+    # worker processes exit without running atexit hooks
+    audit.audit_log.flush()
+    return {'accounts': len(account_ids), 'shares': batch.shares,
+            'orders': batch.orders, 'snapshots': len(snapshots)}
+
+
+def rename(action):
+    """Change the code and name of the stock, orders refer to it by id"""
+
+    stock = action.stock
+    check_code(stock, action.new_code)
+    stock.code = action.new_code
+    if action.new_name:
+        stock.name = action.new_name
+    # through save() to rebuild the stock search index
+    stock.save(update_fields=['code', 'name'])
+    audit.audit_log.record(AuditEvent.CORPORATE_ACTION, None, {
+        'action': action.get_kind_display(),
+        'stock': action.old_code,
+        'new_code': stock.code,
+        'new_name': stock.name,
+    })
+
+
+def halt(stock_id, halted=True):
+    Stock.objects.filter(pk=stock_id).update(halted=halted)
+
+
+def finish(action):
+    """Mark an action applied and resume trading in the stock"""
+
+    with transaction.atomic():
+        action.applied = timezone.now()
+        action.save(update_fields=['applied'])
+        Stock.objects.filter(pk=action.stock_id).update(halted=False)
@@ -1,9 +1,159 @@
+from functools import reduce
+from operator import or_
+from django.conf import settings
 from django.contrib import admin
-from trades.models import Stock, Order, OrderType, OrderStatus, StockShare
+from django.contrib.admin.views.main import PAGE_VAR
+from django.db.models import F, Min, Q
+from accounts.models import Account
+from trades import audit
+from trades.models import (AuditEvent, Order, OrderStatus, OrderType,
+                           PortfolioSnapshot, Stock, StockShare)
+from trades.portfolio import recompute_batch
+from strader.utils import constants
+from strader.utils.admin import EstimatedCountPaginator, update_in_batches
+
+
+def get_batch_size():
+    return getattr(settings, 'ADMIN_BATCH_SIZE', 1000)
+
+
+def recompute_accounts(ids):
+    """
+    Rebuild the shares and balances of accounts `ids`, sorted, a batch at a
+    time. Their versions are bumped so the cached risk snapshots reload.
+
+    Return:
+        number of shares and balances fixed
+    """
+
+    batch_size, fixed = get_batch_size(), 0
+    for start in range(0, len(ids), batch_size):
+        chunk = ids[start:start + batch_size]
+        stats = recompute_batch(chunk[0], chunk[-1], batch_size, False,
+                                account_ids=chunk)
+        fixed += stats['shares'] + stats['balances']
+    return fixed
+
+
+def drop_snapshots(firsts):
+    """Delete the snapshots of `{account id: order id}` from that order on"""
+
+    items, batch_size = list(firsts.items()), get_batch_size()
+    for start in range(0, len(items), batch_size):
+        PortfolioSnapshot.objects.filter(reduce(or_, (
+            Q(account_id=account_id, last_order_id__gte=first)
+            for account_id, first in items[start:start + batch_size]
+        ))).delete()
+
+
+class StockCodeFilter(admin.SimpleListFilter):
+    """Filter on a typed in stock code rather than a list of every stock"""
+
+    title = 'stock code'
+    parameter_name = 'stock'
+    template = 'admin/input_filter.html'
+
+    def lookups(self, request, model_admin):
+        # the filter is only shown if it has lookups
+        return (('', ''),)
+
+    def choices(self, changelist):
+        yield {'query_parts': [
+            (key, value) for key, value in changelist.params.items()
+            if key not in (self.parameter_name, PAGE_VAR)]}
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(stock__code=self.value().strip().upper())
+        return queryset
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """Changelist without a full COUNT(*) of the table"""
+
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+
+@admin.register(Stock)
+class StockAdmin(LargeTableAdmin):
+    list_display = ('code', 'name', 'halted')
+    list_filter = ('halted', )
+    search_fields = ('code', 'name')
+
+
+@admin.register(Order)
+class OrderAdmin(LargeTableAdmin):
+    list_display = ('id', 'account', 'stock', 'order_type', 'status',
+                    'quantity', 'price', 'total_value', 'date')
+    list_select_related = ('account__user', 'stock', 'order_type', 'status')
+    list_filter = (StockCodeFilter, 'status', 'order_type')
+    raw_id_fields = ('account', 'stock')
+    actions = ('mark_filled', 'mark_failed')
+
+    def set_status(self, request, queryset, code):
+        """
+        Rewrite the status of the selected orders, then rebuild the shares,
+        balances and snapshots of their accounts from the order history.
+        """
+
+        status = OrderStatus.objects.get(code=code)
+        # snapshots after the first changed order replayed its old status
+        firsts = dict(queryset.order_by().values('account_id')
+                      .annotate(first=Min('id'))
+                      .values_list('account_id', 'first'))
+        updated = update_in_batches(queryset, get_batch_size(), status=status)
+        audit.audit_log.record(AuditEvent.ADMIN, None, {
+            'model': Order._meta.label_lower,
+            'action': f'mark {code}',
+            'message': f'{updated} orders',
+        }, actor_id=request.user.pk)
+        fixed = recompute_accounts(sorted(firsts))
+        drop_snapshots(firsts)
+        self.message_user(request, f'{updated} orders marked as {code}, '
+                                   f'fixed {fixed} shares and balances.')
+
+    def mark_filled(self, request, queryset):
+        self.set_status(request, queryset, constants.FILLED)
+    mark_filled.short_description = 'Mark selected orders as FILLED'
+
+    def mark_failed(self, request, queryset):
+        self.set_status(request, queryset, constants.FAILED)
+    mark_failed.short_description = 'Mark selected orders as FAILED'
+
+
+@admin.register(StockShare)
+class StockShareAdmin(LargeTableAdmin):
+    list_display = ('id', 'account', 'stock', 'quantity', 'total_value',
+                    'realized_pnl')
+    list_select_related = ('account__user', 'stock')
+    list_filter = (StockCodeFilter, )
+    raw_id_fields = ('account', 'stock')
+    actions = ('recompute_accounts', )
+
+    def bump_version(self, share):
+        # cached risk snapshots of the account are reloaded
+        Account.objects.filter(pk=share.account_id).update(
+            version=F('version') + 1)
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        self.bump_version(obj)
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        self.bump_version(obj)
+
+    def recompute_accounts(self, request, queryset):
+        ids = sorted(queryset.order_by().values_list('account_id', flat=True)
+                     .distinct())
+        fixed = recompute_accounts(ids)
+        self.message_user(request, f'Recomputed {len(ids)} accounts, fixed '
+                                   f'{fixed} shares and balances.')
+    recompute_accounts.short_description = ('Recompute the accounts of the '
+                                            'selected shares from their '
+                                            'orders')
 
 
-admin.site.register(Stock)
-admin.site.register(Order)
 admin.site.register(OrderType)
 admin.site.register(OrderStatus)
-admin.site.register(StockShare)
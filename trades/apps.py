@@ -1,4 +1,5 @@
-from django.apps import AppConfig
+from django.apps import AppConfig, apps
+from django.db.models.signals import post_save
 
 
 class TradeConfig(AppConfig):
@@ -6,3 +7,10 @@ class TradeConfig(AppConfig):
 
     def ready(self):
         import trades.signals
+
+        # lean production workers run without the admin
+        if apps.is_installed('django.contrib.admin'):
+            from django.contrib.admin.models import LogEntry
+            from trades.audit import record_admin_change
+            post_save.connect(record_admin_change, sender=LogEntry,
+                              dispatch_uid='audit_admin_change')
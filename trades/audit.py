@@ -0,0 +1,218 @@
+import atexit
+import json
+import logging
+import threading
+import zlib
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from trades.models import AuditEvent
+
+
+logger = logging.getLogger(__name__)
+
+# Preset dictionary of the keys and values found in most payloads. Events
+# are a few hundred bytes, too small for zlib to find repetitions on its
+# own; with the dictionary they compress to about a third of their size.
+ZDICT = (b'{"order": , "stock": "", "order_type": "BUY", '
+         b'"order_type": "SELL", "quantity": , "price": , "total_value": , "status": "FILLED", '
+         b'"realized_pnl": null, "available_bp": [, ], "reason": "order", '
+         b'"reason": "recompute", "model": "", "object_id": "", '
+         b'"action": "change", "action": "addition", "action": "deletion", '
+         b'"message": "", "fields": {')
+
+
+def compress(payload):
+    compressor = zlib.compressobj(zdict=ZDICT)
+    data = json.dumps(payload, cls=DjangoJSONEncoder,
+                      separators=(', ', ': ')).encode()
+    return compressor.compress(data) + compressor.flush()
+
+
+def decompress(data):
+    decompressor = zlib.decompressobj(zdict=ZDICT)
+    return json.loads(decompressor.decompress(bytes(data)) +
+                      decompressor.flush())
+
+
+class AuditLog:
+    """
+    Buffered writer of the audit trail.
+
+    `record` only appends to an in-process buffer, which a background thread
+    compresses and bulk inserts every `AUDIT_FLUSH_INTERVAL` seconds or
+    once `AUDIT_BATCH_SIZE` events piled up, so auditing adds no query to
+    the request. Events are recorded after the writes they describe commit.
+    With `AUDIT_BUFFERED` off they are inserted right away.
+
+    Buffered events are lost if the worker dies before the next flush, and
+    while the database is unreachable at most `AUDIT_MAX_BUFFER` events are
+    kept, the oldest ones are dropped and logged.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buffer = []
+        self._wake = threading.Event()
+        self._thread = None
+
+    @property
+    def batch_size(self):
+        return getattr(settings, 'AUDIT_BATCH_SIZE', 500)
+
+    @property
+    def max_buffer(self):
+        return getattr(settings, 'AUDIT_MAX_BUFFER', 50000)
+
+    @property
+    def flush_interval(self):
+        return getattr(settings, 'AUDIT_FLUSH_INTERVAL', 0.5)
+
+    def record(self, kind, account_id, payload, actor_id=None):
+        event = (kind, account_id, actor_id, timezone.now(), payload)
+        if not getattr(settings, 'AUDIT_BUFFERED', True):
+            self.write([event])
+            return
+
+        with self._lock:
+            self._buffer.append(event)
+            dropped = self._trim()
+            pending = len(self._buffer)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self.run,
+                                                name='audit-log',
+                                                daemon=True)
+                self._thread.start()
+        self._log_dropped(dropped)
+        if pending >= self.batch_size:
+            self._wake.set()
+
+    def _trim(self):
+        """Drop the oldest events over `max_buffer`, with the lock held"""
+
+        dropped = self._buffer[:-self.max_buffer or None]
+        if dropped:
+            del self._buffer[:len(dropped)]
+        return dropped
+
+    @staticmethod
+    def _log_dropped(dropped):
+        if dropped:
+            logger.error('Dropped %d audit events, the oldest of %s',
+                         len(dropped), dropped[0][3].isoformat())
+
+    def write(self, events):
+        AuditEvent.objects.bulk_create(
+            [AuditEvent(kind=kind, account_id=account_id, actor_id=actor_id,
+                        date=date, payload=compress(payload))
+             for kind, account_id, actor_id, date, payload in events],
+            batch_size=self.batch_size)
+
+    def flush(self):
+        """Write the buffered events. Return how many were written"""
+
+        with self._lock:
+            events, self._buffer = self._buffer, []
+        if events:
+            try:
+                self.write(events)
+            except Exception:
+                # keep them for the next flush
+                with self._lock:
+                    self._buffer[:0] = events
+                    dropped = self._trim()
+                self._log_dropped(dropped)
+                raise
+        return len(events)
+
+    def run(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            close_old_connections()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Could not write the audit log')
+
+
+audit_log = AuditLog()
+atexit.register(audit_log.flush)
+
+
+def record_order(order, available_bp_before):
+    """Record a committed order and the balance change it caused"""
+
+    account = order.account
+    audit_log.record(AuditEvent.ORDER, account.pk, {
+        'order': order.pk,
+        'stock': order.stock.code,
+        'order_type': order.order_type.code,
+        'quantity': order.quantity,
+        'price': order.price,
+        'total_value': order.total_value,
+        'status': order.status.code,
+        'realized_pnl': order.realized_pnl,
+        'available_bp': [available_bp_before, account.available_bp],
+        'reason': 'order',
+    }, actor_id=account.user_id)
+
+
+def record_balance(account_id, before, after, reason, actor_id=None):
+    audit_log.record(AuditEvent.BALANCE, account_id, {
+        'available_bp': [before, after],
+        'reason': reason,
+    }, actor_id=actor_id)
+
+
+def history(account_id, kinds=None, after_id=0, limit=100):
+    """
+    Events of an account after event `after_id`, oldest first, read from
+    the (account, id) index. Pass the last id back to read the next page.
+
+    Return:
+        list of `(id, kind, date, actor_id, payload)`
+    """
+
+    events = AuditEvent.objects.filter(account_id=account_id,
+                                       id__gt=after_id)
+    if kinds:
+        events = events.filter(kind__in=kinds)
+    return [(pk, kind, date, actor_id, decompress(payload))
+            for pk, kind, date, actor_id, payload in
+            events.order_by('id').values_list('id', 'kind', 'date',
+                                              'actor_id', 'payload')[:limit]]
+
+
+ADMIN_ACTIONS = {1: 'addition', 2: 'change', 3: 'deletion'}
+
+
+def record_admin_change(sender, instance, created, **kwargs):
+    """
+    Record the admin `LogEntry` of a change along with the field values of
+    the object, connected only when the admin is installed.
+    """
+
+    if not created:
+        return
+    # the admin logs deletions before deleting
+    obj = instance.get_edited_object()
+    fields = {field.attname: getattr(obj, field.attname)
+              for field in obj._meta.concrete_fields
+              if field.get_internal_type() != 'BinaryField' and
+              field.name != 'password'}
+    if obj._meta.label == 'accounts.Account':
+        account_id = obj.pk
+    else:
+        account_id = getattr(obj, 'account_id', None)
+
+    payload = {
+        'model': obj._meta.label_lower,
+        'object_id': instance.object_id,
+        'action': ADMIN_ACTIONS.get(instance.action_flag),
+        'message': instance.get_change_message(),
+        'fields': fields,
+    }
+    transaction.on_commit(lambda: audit_log.record(
+        AuditEvent.ADMIN, account_id, payload, actor_id=instance.user_id))
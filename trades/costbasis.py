@@ -0,0 +1,353 @@
+import struct
+import sys
+from array import array
+from bisect import bisect_left, bisect_right
+from functools import reduce
+from operator import or_
+from django.conf import settings
+from django.db.models import F, Q
+from trades.models import Lot
+
+
+FIFO = 'FIFO'
+AVERAGE = 'AVERAGE'
+EPSILON = 1e-9
+HEADER = struct.Struct('<c2d')
+
+
+def _array(data=b''):
+    values = array('d')
+    values.frombytes(data)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+
+def _bytes(values):
+    if sys.byteorder == 'big':
+        values = array('d', values)
+        values.byteswap()
+    return values.tobytes()
+
+
+class AverageCost:
+    """Average cost basis, sold shares are valued at the average cost"""
+
+    method = AVERAGE
+    __slots__ = ('quantity', 'cost')
+
+    def __init__(self, quantity=0.0, cost=0.0):
+        self.quantity = quantity
+        self.cost = cost
+
+    def buy(self, quantity, value):
+        self.quantity += quantity
+        self.cost += value
+
+    def sell(self, quantity):
+        """Remove sold shares. Return their cost basis"""
+
+        if self.quantity <= EPSILON:
+            return 0.0
+        quantity = min(quantity, self.quantity)
+        cost = self.cost * quantity / self.quantity
+        self.quantity -= quantity
+        self.cost -= cost
+        return cost
+
+    def split(self, ratio):
+        """Apply a stock split of `ratio` new shares per share"""
+
+        self.quantity *= ratio
+
+    def pack(self):
+        return HEADER.pack(b'A', self.quantity, self.cost)
+
+
+class FifoLots:
+    """
+    FIFO cost basis over the lots of a position.
+
+    Lots are stored as running totals in two `array('d')`: `qty_sum[i]` and
+    `cost_sum[i]` are the quantity and cost of lots 0..i together, and
+    `sold_qty`/`sold_cost` how much of that was sold. A buy appends in O(1),
+    a sell finds the lot it ends in with a bisect in O(log n) without
+    rewriting any lot. Fully sold lots are dropped once they make up half of
+    the arrays, which keeps that amortized O(1).
+
+    Replays and portfolio snapshots use it in memory, the lots of a
+    `StockShare` are kept as `Lot` rows by `StoredLots`.
+    """
+
+    method = FIFO
+    __slots__ = ('qty_sum', 'cost_sum', 'sold_qty', 'sold_cost')
+
+    def __init__(self, qty_sum=None, cost_sum=None, sold_qty=0.0,
+                 sold_cost=0.0):
+        self.qty_sum = qty_sum if qty_sum is not None else array('d')
+        self.cost_sum = cost_sum if cost_sum is not None else array('d')
+        self.sold_qty = sold_qty
+        self.sold_cost = sold_cost
+
+    @staticmethod
+    def _last(values):
+        return values[-1] if values else 0.0
+
+    @property
+    def quantity(self):
+        return self._last(self.qty_sum) - self.sold_qty
+
+    @property
+    def cost(self):
+        return self._last(self.cost_sum) - self.sold_cost
+
+    def buy(self, quantity, value):
+        self.qty_sum.append(self._last(self.qty_sum) + quantity)
+        self.cost_sum.append(self._last(self.cost_sum) + value)
+
+    def _cost_at(self, target):
+        """Running cost at running quantity `target`"""
+
+        qty, cost = self.qty_sum, self.cost_sum
+        i = bisect_left(qty, target)
+        if i >= len(qty):
+            return self._last(cost)
+        prev_qty = qty[i - 1] if i else 0.0
+        prev_cost = cost[i - 1] if i else 0.0
+        lot_qty = qty[i] - prev_qty
+        if lot_qty <= EPSILON:
+            return cost[i]
+        price = (cost[i] - prev_cost) / lot_qty
+        return prev_cost + (target - prev_qty) * price
+
+    def sell(self, quantity):
+        """Remove sold shares, oldest lots first. Return their cost basis"""
+
+        target = min(self.sold_qty + quantity, self._last(self.qty_sum))
+        sold_cost = self._cost_at(target)
+        cost = sold_cost - self.sold_cost
+        self.sold_qty, self.sold_cost = target, sold_cost
+        self._compact()
+        return cost
+
+    def split(self, ratio):
+        """
+        Apply a stock split of `ratio` new shares per share: every lot keeps
+        its cost for `ratio` times its quantity.
+        """
+
+        self.qty_sum = array('d', (value * ratio for value in self.qty_sum))
+        self.sold_qty *= ratio
+
+    def _compact(self):
+        qty, cost = self.qty_sum, self.cost_sum
+        done = bisect_right(qty, self.sold_qty + EPSILON)
+        if done and done * 2 >= len(qty):
+            base_qty, base_cost = qty[done - 1], cost[done - 1]
+            self.qty_sum = array('d', (value - base_qty
+                                       for value in qty[done:]))
+            self.cost_sum = array('d', (value - base_cost
+                                        for value in cost[done:]))
+            self.sold_qty = max(self.sold_qty - base_qty, 0.0)
+            self.sold_cost -= base_cost
+
+    def pack(self):
+        return (HEADER.pack(b'F', self.sold_qty, self.sold_cost) +
+                _bytes(self.qty_sum) + _bytes(self.cost_sum))
+
+
+class StoredLots:
+    """
+    FIFO cost basis over the `Lot` rows of a share.
+
+    Rows hold the same running totals as `FifoLots`, and the share the end
+    of the last lot (its quantity and cost plus what was sold) and
+    `sold_qty`/`sold_cost`. A buy queues one row; a sell reads the two rows
+    around the quantity it ends at with indexed range queries. `write_lots`
+    inserts the queued rows and deletes the fully sold ones, so an order
+    touches O(log n) rows rather than the whole position. Shares without
+    rows, or packed with another method, start from a single lot of their
+    current quantity and cost.
+    """
+
+    method = FIFO
+    __slots__ = ('share', 'sold_qty', 'sold_cost', 'end', 'stored_end',
+                 'stored_sold', 'new_lots', 'reset')
+
+    def __init__(self, share):
+        self.share = share
+        # lots packed with the average method don't match the rows
+        self.reset = bool(share.lots) and bytes(share.lots)[:1] != b'F'
+        if self.reset:
+            self.sold_qty = self.sold_cost = 0.0
+        else:
+            self.sold_qty, self.sold_cost = share.sold_qty, share.sold_cost
+        self.end = self.stored_end = (share.quantity + self.sold_qty,
+                                      share.total_value + self.sold_cost)
+        self.stored_sold = self.sold_qty
+        # (running quantity, running cost) of the lots bought since loading
+        self.new_lots = []
+
+    @property
+    def quantity(self):
+        return self.end[0] - self.sold_qty
+
+    @property
+    def cost(self):
+        return self.end[1] - self.sold_cost
+
+    def buy(self, quantity, value):
+        self.end = (self.end[0] + quantity, self.end[1] + value)
+        self.new_lots.append(self.end)
+
+    def _stored_around(self, target):
+        """Stored lot ending at or after `target` and the one before it"""
+
+        if self.share.pk is None or self.reset:
+            return None, None
+        lots = self.share.fifo_lots.values_list('qty_sum', 'cost_sum')
+        after = lots.filter(qty_sum__gte=target).order_by('qty_sum').first()
+        before = lots.filter(qty_sum__lt=target).order_by('-qty_sum').first()
+        return after, before
+
+    def _cost_at(self, target):
+        """Running cost at running quantity `target`"""
+
+        if self.new_lots and target > self.stored_end[0]:
+            quantities = [qty for qty, _ in self.new_lots]
+            i = bisect_left(quantities, target)
+            after = self.new_lots[i] if i < len(self.new_lots) else self.end
+            before = self.new_lots[i - 1] if i else self.stored_end
+        else:
+            after, before = self._stored_around(target)
+            # rows not written yet end the stored lots
+            after = after or self.stored_end
+        # lots before the sold quantity are sold, and the lot it falls in
+        # is valued at the same price from there
+        sold = (self.sold_qty, self.sold_cost)
+        if before is None or before[0] < sold[0]:
+            before = sold
+        lot_qty = after[0] - before[0]
+        if lot_qty <= EPSILON:
+            return after[1]
+        price = (after[1] - before[1]) / lot_qty
+        return before[1] + (target - before[0]) * price
+
+    def sell(self, quantity):
+        """Remove sold shares, oldest lots first. Return their cost basis"""
+
+        target = min(self.sold_qty + quantity, self.end[0])
+        sold_cost = self._cost_at(target)
+        cost = sold_cost - self.sold_cost
+        self.sold_qty, self.sold_cost = target, sold_cost
+        return cost
+
+    def split(self, ratio):
+        """
+        Apply a stock split of `ratio` new shares per share, see
+        `split_lots` for the stored rows.
+        """
+
+        self.end = (self.end[0] * ratio, self.end[1])
+        self.stored_end = (self.stored_end[0] * ratio, self.stored_end[1])
+        self.new_lots = [(qty * ratio, cost) for qty, cost in self.new_lots]
+        self.sold_qty *= ratio
+
+
+def get_method():
+    return getattr(settings, 'COST_BASIS_METHOD', FIFO)
+
+
+def new_basis(method=None):
+    return FifoLots() if (method or get_method()) == FIFO else AverageCost()
+
+
+def load(lots, quantity=0.0, cost=0.0, method=None):
+    """
+    Load a packed cost basis. Positions without one, or packed with another
+    method, start from a single lot of their current quantity and cost.
+    """
+
+    method = method or get_method()
+    if lots:
+        lots = bytes(lots)
+        tag, first, second = HEADER.unpack_from(lots)
+        if tag == b'F' and method == FIFO:
+            values = _array(lots[HEADER.size:])
+            half = len(values) // 2
+            return FifoLots(values[:half], values[half:], first, second)
+        if tag == b'A' and method == AVERAGE:
+            return AverageCost(first, second)
+
+    basis = new_basis(method)
+    if quantity > EPSILON:
+        basis.buy(quantity, cost)
+    return basis
+
+
+def load_share(share, method=None):
+    """Cost basis of a `StockShare`, FIFO lots stay in the `Lot` table"""
+
+    method = method or get_method()
+    if method == FIFO:
+        return StoredLots(share)
+    return load(share.lots, share.quantity, share.total_value, method)
+
+
+def store(share, basis):
+    """Copy a basis from `load_share` back to the fields of its share"""
+
+    share.quantity, share.total_value = basis.quantity, basis.cost
+    if basis.method == FIFO:
+        share.sold_qty, share.sold_cost = basis.sold_qty, basis.sold_cost
+        share.lots = None
+    else:
+        share.lots = basis.pack()
+
+
+def write_lots(bases):
+    """
+    Insert the lots bought and delete the lots sold through the
+    `StoredLots` of saved shares.
+    """
+
+    sold, rows = [], []
+    for basis in bases:
+        if basis.method != FIFO:
+            continue
+        share = basis.share
+        if basis.reset:
+            sold.append(Q(share=share))
+        elif basis.sold_qty > basis.stored_sold + EPSILON:
+            sold.append(Q(share=share,
+                          qty_sum__lte=basis.sold_qty + EPSILON))
+        rows.extend(Lot(share=share, qty_sum=qty, cost_sum=cost)
+                    for qty, cost in basis.new_lots
+                    if qty > basis.sold_qty + EPSILON)
+        basis.reset = False
+        basis.stored_end, basis.new_lots = basis.end, []
+        basis.stored_sold = basis.sold_qty
+    if sold:
+        Lot.objects.filter(reduce(or_, sold)).delete()
+    if rows:
+        Lot.objects.bulk_create(rows)
+
+
+def split_lots(shares, ratio):
+    """Apply a stock split to the `Lot` rows of `shares`"""
+
+    Lot.objects.filter(share__in=shares).update(qty_sum=F('qty_sum') * ratio)
+
+
+def remaining(qty_sum, cost_sum, sold_qty, sold_cost):
+    """
+    Quantity and cost of each lot, or part of a lot, not sold yet, to
+    compare lots whatever their running totals start from.
+    """
+
+    lots, before = [], (sold_qty, sold_cost)
+    for qty, cost in zip(qty_sum, cost_sum):
+        if qty > before[0] + EPSILON:
+            lots.append((qty - before[0], cost - before[1]))
+            before = (qty, cost)
+    return lots
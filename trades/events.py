@@ -0,0 +1,264 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict, defaultdict, deque
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+
+ORDER_CREATED = 'order-created'
+ORDER_FILLED = 'order-filled'
+BALANCE_CHANGED = 'balance-changed'
+RESET = 'reset'
+
+logger = logging.getLogger(__name__)
+
+
+class Subscription:
+    """
+    Bounded event queue of a single subscriber.
+
+    Events are pushed from any thread through the subscriber's event loop.
+    A subscriber that falls `ORDER_EVENTS_QUEUE_SIZE` events behind is
+    closed instead of buffering without bound, it can reconnect and resume
+    from the last offset it received.
+    """
+
+    def __init__(self, broker, account_id, loop, maxsize):
+        self.broker = broker
+        self.account_id = account_id
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        self.closed = False
+
+    def push(self, item):
+        if self.closed:
+            return
+        try:
+            self.queue.put_nowait(item)
+        except asyncio.QueueFull:
+            # drop the slow consumer, it resumes from its last offset
+            self.close()
+            self.queue.get_nowait()
+            self.queue.put_nowait(None)
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.broker.unsubscribe(self)
+
+    async def get(self):
+        """Return the next `(offset, kind, data)` or None once closed"""
+
+        return await self.queue.get()
+
+
+class EventBroker:
+    """
+    In-process pub/sub of order events per account.
+
+    The last `ORDER_EVENTS_BUFFER` events of each account are kept in a ring
+    buffer so that reconnecting subscribers can resume from an offset. Only
+    the `ORDER_EVENTS_MAX_ACCOUNTS` accounts with the most recent events
+    keep their buffer and offset, unless they have subscribers. The offsets
+    of an account seen again start after every evicted offset, so a client
+    resuming from before the eviction gets a `reset`.
+    """
+
+    def __init__(self, buffer_size=None, queue_size=None, max_accounts=None):
+        self._lock = threading.Lock()
+        self._buffer_size = buffer_size
+        self._queue_size = queue_size
+        self._max_accounts = max_accounts
+        # account id: [last offset, buffer], least recently published first
+        self._streams = OrderedDict()
+        self._evicted_offset = 0
+        self._subscribers = defaultdict(set)
+
+    def _stream(self, account_id):
+        """Offset and buffer of an account, with the lock held"""
+
+        stream = self._streams.get(account_id)
+        if stream is not None:
+            self._streams.move_to_end(account_id)
+            return stream
+
+        size = self._buffer_size or getattr(settings, 'ORDER_EVENTS_BUFFER',
+                                            256)
+        stream = self._streams[account_id] = [self._evicted_offset,
+                                              deque(maxlen=size)]
+        limit = self._max_accounts or getattr(
+            settings, 'ORDER_EVENTS_MAX_ACCOUNTS', 10000)
+        for _ in range(len(self._streams)):
+            if len(self._streams) <= limit:
+                break
+            evicted, (offset, buffer) = self._streams.popitem(last=False)
+            if evicted in self._subscribers:
+                # still followed, keep its replay window
+                self._streams[evicted] = [offset, buffer]
+            else:
+                self._evicted_offset = max(self._evicted_offset, offset)
+        return stream
+
+    def next_offset(self, account_id):
+        with self._lock:
+            stream = self._stream(account_id)
+            stream[0] += 1
+            return stream[0]
+
+    def deliver(self, account_id, offset, kind, data):
+        """Buffer an event and fan it out to the account's subscribers"""
+
+        item = (offset, kind, data)
+        with self._lock:
+            stream = self._stream(account_id)
+            stream[0] = max(stream[0], offset)
+            stream[1].append(item)
+            subscribers = list(self._subscribers.get(account_id, ()))
+
+        for sub in subscribers:
+            self._push(sub, item)
+
+    @staticmethod
+    def _push(sub, item):
+        try:
+            sub.loop.call_soon_threadsafe(sub.push, item)
+        except RuntimeError:
+            # its event loop is closed, don't fail the publishing request
+            sub.close()
+
+    def reset_subscribers(self):
+        """Tell every subscriber that events may have been missed"""
+
+        with self._lock:
+            subscribers = [(sub, self._streams.get(sub.account_id)) for subs
+                           in self._subscribers.values() for sub in subs]
+        for sub, stream in subscribers:
+            self._push(sub, (stream[0] if stream else 0, RESET, {}))
+
+    def subscribe(self, account_id, loop, last_offset=None):
+        """
+        Subscribe to the events of an account. Buffered events after
+        `last_offset` are queued first; if some of them are no longer
+        buffered a `reset` event tells the client to reload its state.
+        """
+
+        size = self._queue_size or getattr(settings,
+                                           'ORDER_EVENTS_QUEUE_SIZE', 1024)
+        sub = Subscription(self, account_id, loop, size)
+        with self._lock:
+            self._subscribers[account_id].add(sub)
+            stream = self._streams.get(account_id)
+            buffered = list(stream[1]) if stream else []
+
+        if last_offset is not None:
+            newest = buffered[-1][0] if buffered else 0
+            if (last_offset > newest or
+                    (buffered and buffered[0][0] > last_offset + 1)):
+                sub.push((newest, RESET, {}))
+            else:
+                for item in buffered:
+                    if item[0] > last_offset:
+                        sub.push(item)
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            subscribers = self._subscribers.get(sub.account_id)
+            if subscribers is not None:
+                subscribers.discard(sub)
+                if not subscribers:
+                    del self._subscribers[sub.account_id]
+
+    def subscriber_count(self):
+        with self._lock:
+            return sum(len(subs) for subs in self._subscribers.values())
+
+
+class InProcessBackend:
+    """Publish events to subscribers of this worker only"""
+
+    def __init__(self, broker):
+        self.broker = broker
+
+    def publish(self, account_id, kind, data):
+        offset = self.broker.next_offset(account_id)
+        self.broker.deliver(account_id, offset, kind, data)
+
+    def start(self):
+        pass
+
+
+class RedisBackend:
+    """
+    Relay events between workers through Redis pub/sub.
+
+    Offsets come from a per-account Redis counter so that they agree across
+    workers. The listener reconnects with an exponential backoff, and sends
+    a `reset` to the subscribers as events were missed in between. Requires
+    the `redis` package and `ORDER_EVENTS_REDIS_URL`.
+    """
+
+    channel = 'strader:order-events'
+
+    def __init__(self, broker):
+        import redis
+        self.broker = broker
+        self.client = redis.Redis.from_url(settings.ORDER_EVENTS_REDIS_URL)
+        self._listener = None
+        self._lock = threading.Lock()
+
+    def publish(self, account_id, kind, data):
+        offset = self.client.incr(f'strader:order-events:{account_id}')
+        message = json.dumps([account_id, offset, kind, data], default=str)
+        self.client.publish(self.channel, message)
+
+    def listen(self):
+        import redis
+        delay, reconnect = 1, False
+        while True:
+            try:
+                pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                if reconnect:
+                    # events published meanwhile were missed
+                    self.broker.reset_subscribers()
+                delay, reconnect = 1, True
+                for message in pubsub.listen():
+                    account_id, offset, kind, data = json.loads(
+                        message['data'])
+                    self.broker.deliver(account_id, offset, kind, data)
+            except redis.RedisError:
+                reconnect = True
+                logger.warning('Order events listener lost Redis, '
+                               'reconnecting in %ds', delay, exc_info=True)
+                time.sleep(delay)
+                delay = min(delay * 2, 30)
+
+    def start(self):
+        with self._lock:
+            if self._listener is None or not self._listener.is_alive():
+                self._listener = threading.Thread(target=self.listen,
+                                                  daemon=True)
+                self._listener.start()
+
+
+broker = EventBroker()
+_backend = None
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        path = getattr(settings, 'ORDER_EVENTS_BACKEND',
+                       'trades.events.InProcessBackend')
+        _backend = import_string(path)(broker)
+    return _backend
+
+
+def publish(account_id, kind, data):
+    """Publish an order event of an account"""
+
+    get_backend().publish(account_id, kind, data)
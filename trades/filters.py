@@ -1,13 +1,14 @@
 import django_filters
+from django.conf import settings
 from trades.models import Order
+from trades.search import stock_index
 
 
 class OrderFilter(django_filters.FilterSet):
     stock = django_filters.CharFilter(field_name='stock__code',
                                       lookup_expr='iexact',
                                       help_text='Stock code')
-    stock_name = django_filters.CharFilter(field_name='stock__name',
-                                           lookup_expr='icontains',
+    stock_name = django_filters.CharFilter(method='filter_stock_name',
                                            help_text='Stock name')
     order_type = django_filters.CharFilter(field_name='order_type__code',
                                            lookup_expr='iexact',
@@ -16,3 +17,18 @@ class OrderFilter(django_filters.FilterSet):
     class Meta:
         model = Order
         fields = ('stock', 'order_type')
+
+    def filter_stock_name(self, queryset, name, value):
+        """
+        Resolve matching stock ids from the in-memory search index first,
+        then filter by the indexed `stock_id` column instead of joining
+        `trades_stock` with a leading-wildcard LIKE. Fragments matching more
+        than `STOCK_NAME_FILTER_MAX_IDS` stocks use the join, a longer
+        `IN` list would exceed SQLite's limit of query parameters.
+        """
+
+        stock_ids = stock_index.name_contains(value)
+        if len(stock_ids) > getattr(settings, 'STOCK_NAME_FILTER_MAX_IDS',
+                                    500):
+            return queryset.filter(stock__name__icontains=value)
+        return queryset.filter(stock_id__in=stock_ids)
@@ -0,0 +1,111 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from trades.models import IdempotencyKey
+
+
+def hash_request(data):
+    """Fingerprint of a request body, used to detect reused keys"""
+
+    payload = json.dumps(data, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class IdempotencyStore:
+    """
+    Store of responses keyed by (account, Idempotency-Key).
+
+    Lookups hit a bounded in-process LRU first and fall back to the
+    `trades_idempotency_key` table, so a retried request is answered without
+    running validation or any write. Entries older than
+    `IDEMPOTENCY_KEY_TTL` seconds are ignored and replaced.
+    """
+
+    def __init__(self, max_entries=None, ttl=None):
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    @property
+    def ttl(self):
+        if self._ttl is not None:
+            return self._ttl
+        return getattr(settings, 'IDEMPOTENCY_KEY_TTL', 24 * 60 * 60)
+
+    @property
+    def max_entries(self):
+        if self._max_entries is not None:
+            return self._max_entries
+        return getattr(settings, 'IDEMPOTENCY_CACHE_SIZE', 10000)
+
+    def cutoff(self):
+        return timezone.now() - timedelta(seconds=self.ttl)
+
+    def _remember(self, cache_key, entry):
+        with self._lock:
+            self._entries[cache_key] = entry
+            self._entries.move_to_end(cache_key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get(self, account_id, key):
+        """
+        Return the stored `(request_hash, status_code, data)` for the key or
+        None if the key is unknown or expired.
+        """
+
+        cache_key = (account_id, key)
+        with self._lock:
+            entry = self._entries.get(cache_key)
+            if entry is not None:
+                self._entries.move_to_end(cache_key)
+
+        if entry is None:
+            entry = (IdempotencyKey.objects
+                     .filter(account_id=account_id, key=key)
+                     .values_list('date', 'request_hash', 'status_code',
+                                  'response')
+                     .first())
+            if entry is None:
+                return None
+            self._remember(cache_key, entry)
+
+        date, request_hash, status_code, data = entry
+        if date < self.cutoff():
+            return None
+        return request_hash, status_code, data
+
+    def save(self, account_id, key, request_hash, status_code, data):
+        """
+        Store a response. Must run in the same transaction as the writes it
+        describes, a concurrent request with the same key then fails on the
+        unique constraint instead of writing twice.
+        """
+
+        IdempotencyKey.objects.filter(account_id=account_id, key=key,
+                                      date__lt=self.cutoff()).delete()
+        stored = IdempotencyKey.objects.create(
+            account_id=account_id, key=key, request_hash=request_hash,
+            status_code=status_code, response=data
+        )
+        entry = (stored.date, request_hash, status_code, stored.response)
+        transaction.on_commit(
+            lambda: self._remember((account_id, key), entry))
+
+    def purge(self):
+        """Delete expired keys. Return the number of deleted rows"""
+
+        with self._lock:
+            self._entries.clear()
+        deleted, _ = IdempotencyKey.objects.filter(
+            date__lt=self.cutoff()).delete()
+        return deleted
+
+
+idempotency_store = IdempotencyStore()
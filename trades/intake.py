@@ -0,0 +1,300 @@
+import logging
+import queue
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import Future, TimeoutError
+from django.conf import settings
+from django.db import (close_old_connections, connection, connections,
+                       transaction)
+from accounts.models import Account
+from trades import audit, costbasis, portfolio
+from trades.models import Order, Stock, StockShare
+from trades.risk import snapshot_cache
+from strader.utils import constants
+from strader.utils.metrics import metrics
+
+
+logger = logging.getLogger(__name__)
+
+
+class OrderRejected(Exception):
+    """The order failed the checks run again under the account lock"""
+
+
+class IntakeTimeout(Exception):
+    """The intake didn't take the order in time, it was withdrawn"""
+
+
+def enabled():
+    return getattr(settings, 'ORDER_INTAKE_BATCHED', False)
+
+
+def insert_orders(orders):
+    """Insert orders without sending post_save and set their ids"""
+
+    if connection.features.can_return_rows_from_bulk_insert:
+        Order.objects.bulk_create(orders)
+    elif connection.vendor == 'sqlite':
+        Order.objects.bulk_create(orders)
+        # SQLite can't return the inserted ids, but the transaction holds
+        # its only write lock so they are the latest ones
+        last = Order.objects.order_by('-pk').values_list('pk', flat=True)[0]
+        for pk, order in enumerate(orders, last - len(orders) + 1):
+            order.pk = pk
+    else:
+        # elsewhere (MySQL) the ids of concurrent inserts can interleave,
+        # only the id of a single row insert is known
+        fields = [field for field in Order._meta.concrete_fields
+                  if not field.primary_key]
+        for order in orders:
+            (order.pk, ), = Order.objects._insert(
+                [order], fields=fields,
+                returning_fields=Order._meta.db_returning_fields)
+
+
+def commit_batch(orders):
+    """
+    Commit validated orders in one transaction: one bulk insert and one
+    bulk update of the shares and balances they touch. The accounts are
+    locked and the halt, buying power and share checks are run again
+    against the running balances, as orders of the same account can share a
+    batch.
+
+    Return:
+        list of the error message of each order, None if it was committed,
+        and the buying power before each committed order
+    """
+
+    account_ids = {order.account_id for order in orders}
+    stock_ids = {order.stock_id for order in orders}
+    errors, accepted, balances = [], [], []
+
+    with transaction.atomic():
+        accounts = Account.objects.select_for_update().in_bulk(account_ids)
+        # a split batch may have committed since the orders were validated
+        halted = set(Stock.objects.filter(pk__in=stock_ids, halted=True)
+                     .values_list('pk', flat=True))
+        shares = {(share.account_id, share.stock_id): share for share in
+                  StockShare.objects.filter(account_id__in=account_ids,
+                                            stock_id__in=stock_ids)}
+        bases = {}
+
+        for order in orders:
+            order.account = account = accounts[order.account_id]
+            if order.status.code == constants.FAILED:
+                accepted.append(order)
+                balances.append(account.available_bp)
+                errors.append(None)
+                continue
+            if order.stock_id in halted:
+                errors.append(f'Trading in {order.stock.code} is halted.')
+                continue
+
+            key = (order.account_id, order.stock_id)
+            share = shares.get(key)
+            if share is None:
+                share = shares[key] = StockShare(account_id=order.account_id,
+                                                 stock_id=order.stock_id)
+            basis = bases.get(key)
+            if basis is None:
+                basis = bases[key] = costbasis.load_share(share)
+
+            value = order.total_value
+            available_bp = account.available_bp
+            if order.order_type.code == constants.BUY:
+                if value > account.available_bp:
+                    errors.append('Not enough buying power.')
+                    continue
+                account.available_bp -= value
+                basis.buy(order.quantity, value)
+            else:
+                if order.quantity > basis.quantity:
+                    errors.append('Not enough shares.')
+                    continue
+                account.available_bp += value
+                order.realized_pnl = value - basis.sell(order.quantity)
+                share.realized_pnl += order.realized_pnl
+            accepted.append(order)
+            balances.append(available_bp)
+            errors.append(None)
+
+        if accepted:
+            insert_orders(accepted)
+
+        for key, basis in bases.items():
+            costbasis.store(shares[key], basis)
+        touched = [shares[key] for key in bases]
+        StockShare.objects.bulk_update(
+            [share for share in touched if share.pk is not None],
+            ['quantity', 'total_value', 'realized_pnl', 'lots', 'sold_qty',
+             'sold_cost'])
+        # first positions one by one, their lots need the ids
+        for share in touched:
+            if share.pk is None:
+                share.save()
+        costbasis.write_lots(bases.values())
+        for account in accounts.values():
+            account.version += 1
+        Account.objects.bulk_update(accounts.values(),
+                                    ['available_bp', 'version'])
+
+    # write the new state through to this worker's risk snapshots
+    positions, realized = defaultdict(dict), defaultdict(float)
+    for (account_id, stock_id), basis in bases.items():
+        positions[account_id][stock_id] = (basis.quantity, basis.cost)
+    for order in accepted:
+        realized[order.account_id] += order.realized_pnl or 0.0
+    for account in accounts.values():
+        snapshot_cache.update(account.pk, account.version,
+                              account.available_bp, positions[account.pk],
+                              realized[account.pk])
+    return errors, balances
+
+
+class OrderIntake:
+    """
+    Queue of validated orders committed in micro-batches by one thread.
+
+    A batch is committed once `max_batch` orders are queued or `max_delay`
+    seconds after its first order, whichever comes first: a larger delay
+    gives bigger batches and fewer commits for a higher latency. `submit`
+    blocks until the batch of its order is committed.
+    """
+
+    def __init__(self, max_batch=None, max_delay=None):
+        self._max_batch = max_batch
+        self._max_delay = max_delay
+        self.queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def max_batch(self):
+        if self._max_batch is not None:
+            return self._max_batch
+        return getattr(settings, 'ORDER_INTAKE_MAX_BATCH', 500)
+
+    @property
+    def timeout(self):
+        return getattr(settings, 'ORDER_INTAKE_TIMEOUT', 5)
+
+    @property
+    def max_delay(self):
+        if self._max_delay is not None:
+            return self._max_delay
+        return getattr(settings, 'ORDER_INTAKE_MAX_DELAY', 0.005)
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self.run,
+                                                name='order-intake',
+                                                daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        with self._lock:
+            if self._thread is not None:
+                self.queue.put(None)
+                self._thread.join()
+                self._thread = None
+
+    def submit(self, order):
+        """
+        Queue an order and wait for its batch to commit.
+
+        Return:
+            the saved order
+
+        Raise:
+            OrderRejected if the order failed the checks against its batch
+            IntakeTimeout if its batch didn't start within `timeout`
+            seconds, the order is then not committed
+        """
+
+        self.start()
+        future = Future()
+        self.queue.put((order, future))
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            # only an order whose batch didn't start can be withdrawn
+            if not future.cancel():
+                return future.result()
+            metrics.incr('intake.timeouts')
+            raise IntakeTimeout()
+
+    def next_batch(self):
+        """Wait for the next batch, None once stopped"""
+
+        item = self.queue.get()
+        if item is None:
+            return None
+        batch = [item]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch:
+            try:
+                item = self.queue.get(
+                    timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                break
+            if item is None:
+                # commit what was queued before stopping
+                self.queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def run(self):
+        try:
+            while True:
+                batch = self.next_batch()
+                if batch is None:
+                    return
+                self.commit(batch)
+        finally:
+            connections.close_all()
+
+    def commit(self, batch):
+        # withdrawn orders are left out, the others can't be withdrawn now
+        batch = [(order, future) for order, future in batch
+                 if future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        close_old_connections()
+        orders = [order for order, _ in batch]
+        try:
+            errors, balances = commit_batch(orders)
+        except Exception as exc:
+            for _, future in batch:
+                future.set_exception(exc)
+            return
+
+        metrics.incr('intake.batches')
+        metrics.incr('intake.orders', len(batch))
+        for (order, future), error in zip(batch, errors):
+            if error:
+                metrics.incr('intake.rejected')
+                future.set_exception(OrderRejected(error))
+            else:
+                future.set_result(order)
+        try:
+            self.after_commit([order for order, error in zip(orders, errors)
+                               if not error], balances)
+        except Exception:
+            # the orders are committed, don't stop the intake for this
+            logger.exception('Order intake post-commit hooks failed')
+
+    @staticmethod
+    def after_commit(orders, balances):
+        from trades.signals import publish_order_events
+
+        for order, available_bp in zip(orders, balances):
+            publish_order_events(order)
+            audit.record_order(order, available_bp)
+        for account_id in {order.account_id for order in orders}:
+            portfolio.snapshot_if_due(account_id)
+
+
+order_intake = OrderIntake()
@@ -0,0 +1,41 @@
+import json
+from django.core.management.base import BaseCommand
+from django.core.serializers.json import DjangoJSONEncoder
+from trades.audit import history
+from trades.models import AuditEvent
+
+
+KINDS = {name: kind for kind, name in AuditEvent.KIND_CHOICES}
+
+
+class Command(BaseCommand):
+    help = ('Print the audit trail of an account as JSON lines, oldest '
+            'first.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('account', type=int, help='Account id')
+        parser.add_argument('--kind', choices=KINDS, action='append',
+                            help='Only these kinds of events')
+        parser.add_argument('--after', type=int, default=0,
+                            help='Start after this event id')
+        parser.add_argument('--limit', type=int, default=None,
+                            help='Print at most this many events')
+        parser.add_argument('--page-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        kinds = [KINDS[kind] for kind in options['kind'] or ()]
+        after_id, left = options['after'], options['limit']
+        names = dict(AuditEvent.KIND_CHOICES)
+        while left is None or left > 0:
+            size = options['page_size'] if left is None else \
+                min(left, options['page_size'])
+            events = history(options['account'], kinds, after_id, size)
+            for pk, kind, date, actor_id, payload in events:
+                self.stdout.write(json.dumps(
+                    {'id': pk, 'kind': names[kind], 'date': date,
+                     'actor': actor_id, **payload}, cls=DjangoJSONEncoder))
+            if len(events) < size:
+                break
+            after_id = events[-1][0]
+            if left is not None:
+                left -= len(events)
@@ -0,0 +1,111 @@
+import statistics
+import threading
+import time
+from functools import partial
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from trades.intake import OrderIntake
+from trades.models import Order, OrderStatus, OrderType, Stock, StockShare
+from strader.utils import constants
+from strader.utils.metrics import metrics
+
+
+class Command(BaseCommand):
+    help = ('Benchmark order commits: one transaction per order against the '
+            'batched intake with several batch sizes and delays.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=2000)
+        parser.add_argument('--threads', type=int, default=32,
+                            help='Concurrent clients placing orders')
+        parser.add_argument('--configs', nargs='+',
+                            default=['direct', '50:0.001', '500:0.005',
+                                     '500:0.02'],
+                            help='`direct` or max_batch:max_delay pairs')
+
+    def run_clients(self, place, orders, threads):
+        """Place `orders` from `threads` threads, return the latencies"""
+
+        latencies = []
+        lock = threading.Lock()
+
+        def client(count):
+            try:
+                for _ in range(count):
+                    started = time.perf_counter()
+                    place()
+                    elapsed = time.perf_counter() - started
+                    with lock:
+                        latencies.append(elapsed)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=client,
+                                    args=(orders // threads, ))
+                   for _ in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        return latencies
+
+    def handle(self, *args, **options):
+        try:
+            stock = Stock.objects.order_by('id')[0]
+            buy = OrderType.objects.get(code=constants.BUY)
+            filled = OrderStatus.objects.get(code=constants.FILLED)
+        except (IndexError, OrderType.DoesNotExist, OrderStatus.DoesNotExist):
+            raise CommandError('Load the stocks, orders and status fixtures '
+                               'first.')
+
+        user = User.objects.create(username=f'bench-intake-{time.time()}')
+        account = user.account
+        account.available_bp = 1e12
+        account.save()
+        # concurrent get_or_create in the order signal could duplicate it
+        StockShare.objects.create(account=account, stock=stock)
+
+        def new_order():
+            return Order(account=account, stock=stock, order_type=buy,
+                         status=filled, quantity=1, price=1, total_value=1)
+
+        def place_direct():
+            new_order().save()
+
+        def place_batched(intake):
+            intake.submit(new_order())
+
+        self.stdout.write(f'{"config":<12}{"orders/s":>10}{"p50 ms":>10}'
+                          f'{"p99 ms":>10}{"batch":>8}')
+        try:
+            for config in options['configs']:
+                intake = None
+                if config == 'direct':
+                    place = place_direct
+                else:
+                    max_batch, _, max_delay = config.partition(':')
+                    intake = OrderIntake(int(max_batch), float(max_delay))
+                    place = partial(place_batched, intake)
+
+                batches = metrics.snapshot().get('intake.batches', 0)
+                started = time.perf_counter()
+                latencies = sorted(self.run_clients(place, options['orders'],
+                                                    options['threads']))
+                elapsed = time.perf_counter() - started
+                if intake is not None:
+                    intake.stop()
+                    batches = metrics.snapshot()['intake.batches'] - batches
+                    batch = f'{len(latencies) / batches:>8.1f}'
+                else:
+                    batch = f'{1:>8}'
+
+                self.stdout.write(
+                    f'{config:<12}{len(latencies) / elapsed:>10.0f}'
+                    f'{statistics.median(latencies) * 1000:>10.2f}'
+                    f'{latencies[int(len(latencies) * 0.99)] * 1000:>10.2f}'
+                    f'{batch}')
+        finally:
+            Order.objects.filter(account=account).delete()
+            StockShare.objects.filter(account=account).delete()
+            user.delete()
@@ -0,0 +1,57 @@
+import statistics
+import subprocess
+import sys
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+
+# Boots a fresh worker and serves one unauthenticated request through WSGI,
+# printing the boot time and the time to the first response.
+SCRIPT = '''
+import io, os, sys, time
+start = time.perf_counter()
+os.environ['DJANGO_SETTINGS_MODULE'] = sys.argv[1]
+os.environ.setdefault('DJANGO_SECRET_KEY', 'bench-startup')
+from strader.wsgi import application
+booted = time.perf_counter()
+environ = {
+    'REQUEST_METHOD': 'GET', 'PATH_INFO': sys.argv[2], 'QUERY_STRING': '',
+    'SERVER_NAME': '127.0.0.1', 'SERVER_PORT': '8000',
+    'HTTP_HOST': '127.0.0.1', 'wsgi.url_scheme': 'http',
+    'wsgi.input': io.BytesIO(), 'wsgi.errors': sys.stderr,
+}
+statuses = []
+b''.join(application(environ, lambda status, headers, exc_info=None:
+                     statuses.append(status)))
+done = time.perf_counter()
+print(booted - start, done - start, statuses[0])
+'''
+
+
+class Command(BaseCommand):
+    help = ('Measure worker boot and time-to-first-request for each '
+            'settings profile, in fresh interpreters.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=5)
+        parser.add_argument('--path', default='/trade/orders/')
+        parser.add_argument('--profiles', nargs='+',
+                            default=['strader.settings',
+                                     'strader.settings_production'])
+
+    def handle(self, *args, **options):
+        for profile in options['profiles']:
+            boots, firsts = [], []
+            for _ in range(options['runs']):
+                output = subprocess.run(
+                    [sys.executable, '-c', SCRIPT, profile, options['path']],
+                    cwd=settings.BASE_DIR, check=True, capture_output=True,
+                    text=True).stdout.split()
+                boots.append(float(output[0]))
+                firsts.append(float(output[1]))
+                status = ' '.join(output[2:])
+
+            self.stdout.write(
+                f'{profile}: boot {statistics.median(boots) * 1000:.0f} ms, '
+                f'first request {statistics.median(firsts) * 1000:.0f} ms '
+                f'({status}, median of {options["runs"]})')
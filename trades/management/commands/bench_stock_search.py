@@ -0,0 +1,67 @@
+import random
+import string
+import time
+from django.core.management.base import BaseCommand
+from trades.search import StockSearchIndex
+
+
+WORDS = ('alpha', 'global', 'holdings', 'systems', 'energy', 'capital',
+         'pharma', 'motors', 'bank', 'foods', 'tech', 'mining', 'realty',
+         'networks', 'airlines', 'retail', 'media', 'biotech', 'insurance')
+SUFFIXES = ('Inc.', 'Corp.', 'Ltd', 'plc', 'Group', 'N.V.')
+SYLLABLES = ('ka', 'ro', 'mi', 'ten', 'vor', 'ax', 'lu', 'ze', 'qua', 'nis',
+             'bel', 'dor', 'fi', 'gan', 'hel', 'jo', 'pra', 'sul', 'tri', 'wy')
+
+
+class Command(BaseCommand):
+    help = ('Benchmark the in-memory stock search index against a linear '
+            'icontains scan over synthetic symbols.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--symbols', type=int, default=100000)
+        parser.add_argument('--queries', type=int, default=1000)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def make_rows(self, rnd, count):
+        for pk in range(1, count + 1):
+            code = ''.join(rnd.choices(string.ascii_uppercase,
+                                       k=rnd.randint(2, 5)))
+            brand = ''.join(rnd.choices(SYLLABLES, k=rnd.randint(2, 4)))
+            words = [brand] + rnd.sample(WORDS, rnd.randint(0, 2))
+            name = ' '.join(word.capitalize() for word in words)
+            yield pk, f'{code}{pk}', f'{name} {rnd.choice(SUFFIXES)}'
+
+    def timed(self, func, queries):
+        start = time.perf_counter()
+        for query in queries:
+            func(query)
+        return (time.perf_counter() - start) / len(queries) * 1e6
+
+    def handle(self, *args, **options):
+        rnd = random.Random(options['seed'])
+        rows = list(self.make_rows(rnd, options['symbols']))
+
+        index = StockSearchIndex(loader=lambda: rows, ttl=float('inf'))
+        start = time.perf_counter()
+        index.build(rows)
+        build_ms = (time.perf_counter() - start) * 1000
+
+        names = [name for _, _, name in rows]
+        queries = []
+        for _ in range(options['queries']):
+            name = rnd.choice(names)
+            offset = rnd.randint(0, max(len(name) - 6, 0))
+            queries.append(name[offset:offset + rnd.randint(3, 6)])
+
+        def scan(query):
+            query = query.lower()
+            return [pk for pk, _, name in rows if query in name.lower()]
+
+        self.stdout.write(f'symbols: {len(rows)}')
+        self.stdout.write(f'index build: {build_ms:.1f} ms')
+        self.stdout.write('name_contains: %.1f us/query'
+                          % self.timed(index.name_contains, queries))
+        self.stdout.write('search (limit 20): %.1f us/query'
+                          % self.timed(index.search, queries))
+        self.stdout.write('linear scan: %.1f us/query'
+                          % self.timed(scan, queries[:100]))
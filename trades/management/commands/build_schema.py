@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from strader.schema import build_schema, code_version
+
+
+class Command(BaseCommand):
+    help = ('Render the OpenAPI schema into OPENAPI_SCHEMA_PATH, versioned by '
+            'the hash of the project sources.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', help='Write the schema to this path '
+                                             'instead')
+
+    def handle(self, *args, **options):
+        path = build_schema(options['output'])
+        self.stdout.write(f'Wrote schema {code_version()} to {path}.')
@@ -0,0 +1,123 @@
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from trades import actions
+from trades.models import CorporateAction, Stock
+
+
+KINDS = {name: kind for kind, name in CorporateAction.KIND_CHOICES}
+
+
+def close_connections():
+    """Forked workers must not reuse the parent's DB connections"""
+
+    connections.close_all()
+
+
+class Command(BaseCommand):
+    help = ('Apply a split, reverse split or symbol change to a stock. '
+            'Splits rescale the shares, orders and portfolio snapshots of '
+            'every account in batches, with trading in the stock halted; '
+            'an interrupted split is finished with --resume.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', nargs='?', choices=KINDS)
+        parser.add_argument('stock', nargs='?', help='Stock code')
+        parser.add_argument('--ratio', type=actions.parse_ratio,
+                            help='New shares for old shares, e.g. 2:1 for a '
+                                 '2-for-1 split or 1:10 for a reverse split')
+        parser.add_argument('--code', default='', help='New stock code')
+        parser.add_argument('--name', default='', help='New stock name')
+        parser.add_argument('--resume', type=int, metavar='ACTION_ID',
+                            help='Finish an interrupted corporate action')
+        parser.add_argument('--workers', type=int, default=4,
+                            help='Worker processes, 1 runs in-process')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Accounts per batch and transaction')
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help='Rows per bulk update')
+        parser.add_argument('--grace', type=float, default=1.0,
+                            help='Seconds to wait after halting trading for '
+                                 'orders in flight to commit')
+
+    def get_action(self, options):
+        if options['resume']:
+            try:
+                action = CorporateAction.objects.get(pk=options['resume'])
+            except CorporateAction.DoesNotExist:
+                raise CommandError(f"No corporate action {options['resume']}.")
+            if action.applied:
+                raise CommandError(f'{action} was applied on '
+                                   f'{action.applied:%Y-%m-%d %H:%M}.')
+            return action
+
+        if not options['kind'] or not options['stock']:
+            raise CommandError('Give the kind of action and the stock code, '
+                               'or --resume.')
+        try:
+            stock = Stock.objects.get(code=options['stock'])
+        except Stock.DoesNotExist:
+            raise CommandError(f"No stock {options['stock']}.")
+        try:
+            return actions.create_action(stock, KINDS[options['kind']],
+                                         options['ratio'], options['code'],
+                                         options['name'])
+        except ValueError as exc:
+            raise CommandError(str(exc))
+
+    def handle(self, *args, **options):
+        action = self.get_action(options)
+        if action.kind == CorporateAction.RENAME:
+            try:
+                actions.rename(action)
+            except ValueError as exc:
+                raise CommandError(str(exc))
+            actions.finish(action)
+            self.stdout.write(f'Renamed {action.old_code} to '
+                              f'{action.new_code}.')
+            return
+
+        actions.halt(action.stock_id)
+        time.sleep(options['grace'])
+        jobs = [(action.pk, account_ids, options['chunk_size'])
+                for account_ids in actions.batches(action,
+                                                   options['batch_size'])]
+
+        workers = options['workers']
+        if connections['default'].vendor == 'sqlite':
+            # SQLite has a single writer, parallel batches only deadlock
+            workers = 1
+
+        totals = defaultdict(int)
+        started = time.monotonic()
+
+        def report(stats):
+            totals['batches'] += 1
+            for key, value in (stats or {}).items():
+                totals[key] += value
+            elapsed = max(time.monotonic() - started, 1e-9)
+            self.stderr.write(
+                f"[{totals['batches']}/{len(jobs)}] "
+                f"{totals['accounts']} accounts, {totals['shares']} shares, "
+                f"{totals['orders']} orders "
+                f"({totals['accounts'] / elapsed:.0f} accounts/s)")
+
+        if workers <= 1:
+            for job in jobs:
+                report(actions.split_batch(*job))
+        else:
+            close_connections()
+            with ProcessPoolExecutor(workers,
+                                     initializer=close_connections) as pool:
+                futures = [pool.submit(actions.split_batch, *job)
+                           for job in jobs]
+                for future in as_completed(futures):
+                    report(future.result())
+
+        actions.finish(action)
+        self.stdout.write(
+            f'Applied {action} to {totals["accounts"]} accounts, '
+            f'{totals["shares"]} shares and {totals["orders"]} orders in '
+            f'{time.monotonic() - started:.1f}s.')
@@ -0,0 +1,333 @@
+import asyncio
+import json
+import math
+import random
+import time
+from array import array
+from collections import Counter, defaultdict
+from itertools import accumulate
+from urllib.parse import urlsplit
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from accounts.models import Account
+from trades.models import Stock
+
+
+ENDPOINTS = {
+    'order': ('POST', '/trade/orders/'),
+    'orders': ('GET', '/trade/orders/'),
+    'summary': ('GET', '/trade/summary/'),
+    'shares': ('GET', '/trade/shares/all/'),
+}
+
+
+class HttpClient:
+    """
+    Minimal HTTP/1.1 JSON client sharing a bounded pool of keep-alive
+    connections between all the virtual users.
+    """
+
+    def __init__(self, url, connections):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.idle = []
+        self.slots = asyncio.Semaphore(connections)
+
+    async def request(self, method, path, body=None, token=None):
+        """
+        Return:
+            `(status, parsed JSON body or None)`
+        """
+
+        async with self.slots:
+            while self.idle:
+                conn = self.idle.pop()
+                try:
+                    return await self.send(conn, method, path, body, token)
+                except (OSError, asyncio.IncompleteReadError):
+                    # the server closed the idle connection, try the next
+                    conn[1].close()
+            conn = await asyncio.open_connection(self.host, self.port)
+            try:
+                return await self.send(conn, method, path, body, token)
+            except (OSError, asyncio.IncompleteReadError):
+                conn[1].close()
+                raise
+
+    async def send(self, conn, method, path, body, token):
+        reader, writer = conn
+        payload = json.dumps(body).encode() if body is not None else b''
+        lines = [f'{method} {path} HTTP/1.1',
+                 f'Host: {self.host}:{self.port}',
+                 'Accept: application/json',
+                 f'Content-Length: {len(payload)}']
+        if body is not None:
+            lines.append('Content-Type: application/json')
+        if token:
+            lines.append(f'Authorization: Bearer {token}')
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode() + payload)
+        await writer.drain()
+
+        status_line = await reader.readuntil(b'\r\n')
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = await reader.readuntil(b'\r\n')
+            if line == b'\r\n':
+                break
+            key, _, value = line.decode('latin-1').partition(':')
+            headers[key.strip().lower()] = value.strip()
+
+        keep_alive = (status_line.startswith(b'HTTP/1.1') and
+                      headers.get('connection', '').lower() != 'close')
+        if 'content-length' in headers:
+            data = await reader.readexactly(int(headers['content-length']))
+        elif headers.get('transfer-encoding', '').lower() == 'chunked':
+            data = await self.read_chunked(reader)
+        else:
+            data, keep_alive = await reader.read(), False
+
+        if keep_alive:
+            self.idle.append(conn)
+        else:
+            writer.close()
+        try:
+            return status, json.loads(data) if data else None
+        except ValueError:
+            return status, None
+
+    @staticmethod
+    async def read_chunked(reader):
+        chunks = []
+        while True:
+            size = int((await reader.readuntil(b'\r\n')).split(b';')[0], 16)
+            chunk = await reader.readexactly(size + 2)
+            if not size:
+                return b''.join(chunks)
+            chunks.append(chunk[:-2])
+
+
+class Market:
+    """
+    Simulated market: prices follow a random walk and symbols are picked
+    with a Zipf skew, so that a few stocks get most of the orders.
+    """
+
+    def __init__(self, codes, skew, rng, volatility=0.002):
+        self.codes = codes
+        self.rng = rng
+        self.volatility = volatility
+        self.prices = {code: rng.uniform(5, 500) for code in codes}
+        self.cum_weights = list(accumulate(1 / (rank + 1) ** skew
+                                           for rank in range(len(codes))))
+
+    def pick(self):
+        return self.rng.choices(self.codes, cum_weights=self.cum_weights)[0]
+
+    def price(self, code):
+        return round(self.prices[code], 2)
+
+    async def run(self, interval=1.0):
+        while True:
+            await asyncio.sleep(interval)
+            for code in self.codes:
+                self.prices[code] *= math.exp(
+                    self.rng.gauss(0, self.volatility))
+
+
+class Stats:
+    """Latencies and statuses per endpoint"""
+
+    def __init__(self):
+        self.latencies = defaultdict(lambda: array('d'))
+        self.statuses = defaultdict(Counter)
+
+    def record(self, endpoint, seconds, status):
+        self.latencies[endpoint].append(seconds)
+        self.statuses[endpoint][status] += 1
+
+    @staticmethod
+    def percentile(values, q):
+        return values[min(int(len(values) * q), len(values) - 1)]
+
+    def report(self, elapsed):
+        rows = [f'{"endpoint":<10}{"requests":>10}{"req/s":>10}'
+                f'{"errors":>9}{"p50 ms":>10}{"p90 ms":>10}{"p99 ms":>10}'
+                f'{"max ms":>10}  statuses']
+        for endpoint in sorted(self.latencies):
+            values = sorted(self.latencies[endpoint])
+            statuses = self.statuses[endpoint]
+            errors = sum(count for status, count in statuses.items()
+                         if status == 'error' or status >= 400)
+            rows.append(
+                f'{endpoint:<10}{len(values):>10}'
+                f'{len(values) / elapsed:>10.1f}'
+                f'{errors / len(values):>9.1%}' +
+                ''.join(f'{self.percentile(values, q) * 1000:>10.1f}'
+                        for q in (0.5, 0.9, 0.99, 1)) +
+                '  ' + ' '.join(f'{status}:{count}' for status, count in
+                                sorted(statuses.items(), key=str)))
+        return '\n'.join(rows)
+
+
+class LoadTest:
+
+    def __init__(self, options, usernames, codes):
+        self.options = options
+        self.usernames = usernames
+        self.rng = random.Random(options['seed'])
+        self.market = Market(codes, options['skew'], self.rng)
+        self.stats = Stats()
+        names, weights = zip(*options['mix'].items())
+        self.actions, self.cum_weights = names, list(accumulate(weights))
+        self.client = None
+
+    async def call(self, endpoint, method, path, body=None, token=None):
+        started = time.perf_counter()
+        try:
+            status, data = await self.client.request(method, path, body,
+                                                     token)
+        except (OSError, asyncio.IncompleteReadError, ValueError):
+            status, data = 'error', None
+        self.stats.record(endpoint, time.perf_counter() - started, status)
+        return status, data
+
+    async def login(self, username):
+        status, data = await self.call(
+            'token', 'POST', '/api/token/',
+            {'username': username, 'password': self.options['password']})
+        return data['access'] if status == 200 else None
+
+    def order(self, holdings):
+        """Buy a skewed symbol, or sell part of a position"""
+
+        if holdings and self.rng.random() < 0.3:
+            code = self.rng.choice(list(holdings))
+            quantity = self.rng.randint(1, int(holdings[code]))
+            order_type = 'SELL'
+        else:
+            code, quantity = self.market.pick(), self.rng.randint(1, 10)
+            order_type = 'BUY'
+        return {'stock': code, 'quantity': quantity, 'order_type': order_type,
+                'price': self.market.price(code)}
+
+    async def user(self, username, delay, deadline):
+        await asyncio.sleep(delay)
+        token = await self.login(username)
+        holdings = defaultdict(int)
+        think = self.options['think']
+        while token and time.monotonic() < deadline:
+            await asyncio.sleep(self.rng.expovariate(1 / think)
+                                if think else 0)
+            action = self.rng.choices(self.actions,
+                                      cum_weights=self.cum_weights)[0]
+            method, path = ENDPOINTS[action]
+            body = None
+            if action == 'order':
+                body = self.order(holdings)
+            elif action == 'orders' and self.rng.random() < 0.5:
+                path += f'?stock={self.market.pick()}'
+
+            status, _ = await self.call(action, method, path, body, token)
+            if status == 401:
+                token = await self.login(username)
+            elif action == 'order' and status == 201:
+                sign = 1 if body['order_type'] == 'BUY' else -1
+                holdings[body['stock']] += sign * body['quantity']
+                if not holdings[body['stock']]:
+                    del holdings[body['stock']]
+
+    async def run(self):
+        options = self.options
+        self.client = HttpClient(options['url'], options['connections'])
+        market = asyncio.ensure_future(self.market.run())
+        started = time.monotonic()
+        deadline = started + options['ramp'] + options['duration']
+        step = options['ramp'] / max(len(self.usernames), 1)
+        await asyncio.gather(*(self.user(username, i * step, deadline)
+                               for i, username in enumerate(self.usernames)))
+        market.cancel()
+        return time.monotonic() - started
+
+
+def parse_mix(value):
+    mix = {}
+    for item in value.split(','):
+        name, _, weight = item.partition('=')
+        if name not in ENDPOINTS:
+            raise CommandError(f'Unknown endpoint {name!r}, use one of '
+                               f'{", ".join(ENDPOINTS)}.')
+        mix[name] = float(weight or 1)
+    return mix
+
+
+class Command(BaseCommand):
+    help = ('Drive virtual users against a running server: each logs in '
+            'through /api/token/, then places orders and reads its orders, '
+            'summary and shares with random think time. Reports throughput, '
+            'error rate and latency percentiles per endpoint.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000')
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--duration', type=float, default=60,
+                            help='Seconds to run once all users started')
+        parser.add_argument('--ramp', type=float, default=10,
+                            help='Seconds over which the users start')
+        parser.add_argument('--think', type=float, default=1.0,
+                            help='Mean think time between requests, seconds')
+        parser.add_argument('--mix', type=parse_mix,
+                            default='order=3,orders=4,summary=2,shares=1',
+                            help='Weights of the endpoints hit by users')
+        parser.add_argument('--symbols', type=int, default=500,
+                            help='Stocks traded, picked by Zipf skew')
+        parser.add_argument('--skew', type=float, default=1.1)
+        parser.add_argument('--connections', type=int, default=256,
+                            help='Open connections shared by all users')
+        parser.add_argument('--prefix', default='loadtest-',
+                            help='Username prefix of the virtual users')
+        parser.add_argument('--password', default='loadtest-password')
+        parser.add_argument('--create-users', action='store_true',
+                            help='Create the missing virtual users in the '
+                                 'database the server runs on')
+        parser.add_argument('--buying-power', type=float, default=1e9)
+        parser.add_argument('--seed', type=int, default=None)
+
+    def create_users(self, usernames, password, buying_power):
+        existing = set(User.objects.filter(username__in=usernames)
+                       .values_list('username', flat=True))
+        # hash once, hashing per user would take minutes
+        password = make_password(password)
+        User.objects.bulk_create(
+            [User(username=username, password=password)
+             for username in usernames if username not in existing],
+            batch_size=1000)
+        users = User.objects.filter(username__in=usernames,
+                                    account__isnull=True)
+        Account.objects.bulk_create(
+            [Account(user_id=pk) for pk in users.values_list('id', flat=True)],
+            batch_size=1000)
+        Account.objects.filter(user__username__in=usernames).update(
+            available_bp=buying_power, alloted_bp=buying_power)
+
+    def handle(self, *args, **options):
+        if isinstance(options['mix'], str):
+            options['mix'] = parse_mix(options['mix'])
+        usernames = [f'{options["prefix"]}{i}'
+                     for i in range(options['users'])]
+        if options['create_users']:
+            self.create_users(usernames, options['password'],
+                              options['buying_power'])
+
+        codes = list(Stock.objects.order_by('id')
+                     .values_list('code', flat=True)[:options['symbols']])
+        if not codes:
+            raise CommandError('No stocks to trade, load the stocks fixture.')
+
+        test = LoadTest(options, usernames, codes)
+        self.stderr.write(f'{len(usernames)} users against {options["url"]} '
+                          f'for {options["ramp"] + options["duration"]:.0f}s')
+        elapsed = asyncio.run(test.run())
+        self.stdout.write(test.stats.report(elapsed))
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from trades.idempotency import idempotency_store
+
+
+class Command(BaseCommand):
+    help = 'Delete stored Idempotency-Key responses older than the TTL.'
+
+    def handle(self, *args, **options):
+        deleted = idempotency_store.purge()
+        self.stdout.write(f'Deleted {deleted} expired idempotency keys.')
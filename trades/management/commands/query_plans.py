@@ -0,0 +1,339 @@
+import json
+import random
+import re
+from collections import defaultdict
+from datetime import timedelta
+from pathlib import Path
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+from accounts.models import Account
+from trades.models import Order, OrderStatus, OrderType, Stock, StockShare
+from trades.portfolio import take_snapshot
+from trades.search import stock_index
+from strader.utils import constants
+
+
+# name: (method, url name, url args, query string or body, headers)
+ENDPOINTS = {
+    'orders': ('GET', 'orders-list', (), {}, {}),
+    'orders-by-stock': ('GET', 'orders-list', (), {'stock': '{stock}'}, {}),
+    'orders-by-stock-name': ('GET', 'orders-list', (),
+                             {'stock_name': '{name}'}, {}),
+    'orders-by-type': ('GET', 'orders-list', (), {'order_type': 'SELL'}, {}),
+    'order-create': ('POST', 'orders-list', (),
+                     {'stock': '{stock}', 'quantity': 1, 'price': 1,
+                      'order_type': 'BUY'}, {}),
+    'order-create-idempotent': ('POST', 'orders-list', (),
+                                {'stock': '{stock}', 'quantity': 1,
+                                 'price': 1, 'order_type': 'BUY'},
+                                {'HTTP_IDEMPOTENCY_KEY': '{key}'}),
+    'summary': ('GET', 'order-summary-list', (), {}, {}),
+    'summary-by-stock': ('GET', 'order-summary-list', (),
+                         {'stock': '{stock}'}, {}),
+    'shares-summary': ('GET', 'shares-list', ('summary', ), {}, {}),
+    'shares-all': ('GET', 'shares-list', ('all', ), {}, {}),
+    'stock-search': ('GET', 'stock-search-list', (), {'q': '{prefix}'}, {}),
+    'portfolio-at': ('GET', 'portfolio-history-list', (),
+                     {'at': '{today}'}, {}),
+    'portfolio-range': ('GET', 'portfolio-history-list', (),
+                        {'start': '{week_ago}', 'end': '{today}'}, {}),
+}
+
+EXPLAINED = ('SELECT', 'UPDATE', 'DELETE')
+IN_LIST = re.compile(r'IN \(%s(?:, %s)+\)')
+# savepoint names hold the thread id
+SAVEPOINT = re.compile(r'"s\d+_x(\d+)"')
+# "SCAN trades_order", "SCAN TABLE trades_order AS U0" on older SQLite
+SQLITE_SCAN = re.compile(r'^SCAN (?:TABLE )?(\w+)(?: AS (\w+))?$')
+SQL_ALIAS = re.compile(r'"(\w+)" (U\d+)\b')
+
+
+def normalize(sql):
+    """Statement without the lengths of its IN lists or thread ids"""
+
+    return SAVEPOINT.sub(r'"s_x\1"', IN_LIST.sub('IN (%s, ...)', sql))
+
+
+def explain_sqlite(cursor, sql, params):
+    cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+    aliases = dict((alias, table) for table, alias in SQL_ALIAS.findall(sql))
+    plan, scans = [], []
+    for *_, detail in cursor.fetchall():
+        plan.append(detail)
+        match = SQLITE_SCAN.match(detail)
+        if match:
+            scans.append(aliases.get(match.group(1), match.group(1)))
+    return plan, scans
+
+
+def explain_postgresql(cursor, sql, params):
+    cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+    data = cursor.fetchone()[0]
+    if isinstance(data, str):
+        data = json.loads(data)
+    plan, scans = [], []
+    nodes = [(data[0]['Plan'], 0)]
+    while nodes:
+        node, depth = nodes.pop()
+        plan.append(' ' * depth + ' '.join(
+            str(node[key]) for key in ('Node Type', 'Relation Name',
+                                       'Index Name') if key in node))
+        if node['Node Type'] == 'Seq Scan':
+            scans.append(node['Relation Name'])
+        nodes.extend((child, depth + 2)
+                     for child in reversed(node.get('Plans', [])))
+    return plan, scans
+
+
+def explain_mysql(cursor, sql, params):
+    cursor.execute('EXPLAIN ' + sql, params)
+    columns = [column[0] for column in cursor.description]
+    plan, scans = [], []
+    for row in cursor.fetchall():
+        row = dict(zip(columns, row))
+        plan.append(f"{row['table']} {row['type']} {row['key']}")
+        if row['type'] == 'ALL':
+            scans.append(row['table'])
+    return plan, scans
+
+
+EXPLAIN = {
+    'sqlite': explain_sqlite,
+    'postgresql': explain_postgresql,
+    'mysql': explain_mysql,
+}
+
+
+class QueryRecorder:
+    """Execute wrapper keeping the statements a request runs"""
+
+    def __init__(self):
+        self.statements = []
+
+    def __call__(self, execute, sql, params, many, context):
+        self.statements.append((sql, params))
+        return execute(sql, params, many, context)
+
+
+class Command(BaseCommand):
+    help = ('Capture the SQL and EXPLAIN plans of every trade endpoint '
+            'against seeded data, and compare them with the golden file: '
+            'new full table scans and endpoints running more queries are '
+            'reported as regressions. The seeded data is rolled back.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--golden', type=Path,
+                            help='Golden file, by default '
+                                 'queryplans/<database vendor>.json')
+        parser.add_argument('--update', action='store_true',
+                            help='Write the captured plans to the golden '
+                                 'file instead of comparing')
+        parser.add_argument('--endpoint', action='append', choices=ENDPOINTS,
+                            help='Only these endpoints')
+        parser.add_argument('--accounts', type=int, default=200)
+        parser.add_argument('--orders', type=int, default=50,
+                            help='Orders per account')
+        parser.add_argument('--stocks', type=int, default=100)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def seed(self, options):
+        """Create the accounts, stocks, orders and shares to query"""
+
+        if not OrderType.objects.exists():
+            call_command('loaddata', 'orders', verbosity=0)
+        if not OrderStatus.objects.exists():
+            call_command('loaddata', 'status', verbosity=0)
+        rng = random.Random(options['seed'])
+        types = dict(OrderType.objects.values_list('code', 'id'))
+        filled = OrderStatus.objects.get(code=constants.FILLED).pk
+
+        prefix = 'queryplans-'
+        Stock.objects.bulk_create(
+            [Stock(code=f'QP{i}', name=f'Query Plan Stock {i}')
+             for i in range(options['stocks'])], batch_size=1000)
+        stock_ids = list(Stock.objects.filter(code__startswith='QP')
+                         .values_list('id', flat=True))
+        stock_index.invalidate()
+
+        User.objects.bulk_create(
+            [User(username=f'{prefix}{i}', password='!')
+             for i in range(options['accounts'])],
+            batch_size=1000, ignore_conflicts=True)
+        users = User.objects.filter(username__startswith=prefix)
+        Account.objects.bulk_create(
+            [Account(user_id=pk, available_bp=1e9, alloted_bp=1e9)
+             for pk in users.filter(account__isnull=True)
+             .values_list('id', flat=True)], batch_size=1000)
+        account_ids = list(Account.objects
+                           .filter(user__username__startswith=prefix)
+                           .values_list('id', flat=True))
+
+        orders, positions = [], defaultdict(lambda: [0.0, 0.0])
+        for account_id in account_ids:
+            for _ in range(options['orders']):
+                stock_id = rng.choice(stock_ids)
+                quantity, price = rng.randint(1, 10), rng.uniform(5, 500)
+                position = positions[account_id, stock_id]
+                if position[0] >= quantity and rng.random() < 0.3:
+                    order_type = types[constants.SELL]
+                    cost = position[1] * quantity / position[0]
+                    position[0] -= quantity
+                    position[1] -= cost
+                else:
+                    order_type = types[constants.BUY]
+                    position[0] += quantity
+                    position[1] += quantity * price
+                orders.append(Order(account_id=account_id, stock_id=stock_id,
+                                    order_type_id=order_type,
+                                    status_id=filled, quantity=quantity,
+                                    price=price,
+                                    total_value=quantity * price))
+        Order.objects.bulk_create(orders, batch_size=1000)
+        StockShare.objects.bulk_create(
+            [StockShare(account_id=account_id, stock_id=stock_id,
+                        quantity=quantity, total_value=cost)
+             for (account_id, stock_id), (quantity, cost) in
+             positions.items()], batch_size=1000)
+
+        if connection.vendor in ('sqlite', 'postgresql'):
+            # plan with statistics of the seeded data
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+        user = User.objects.get(pk=Account.objects.get(
+            pk=account_ids[0]).user_id)
+        take_snapshot(user.account.pk)
+        return user
+
+    def request(self, client, method, url_name, args, data, headers,
+                values):
+        url = reverse(url_name, args=args)
+        data = {key: value.format(**values) if isinstance(value, str)
+                else value for key, value in data.items()}
+        headers = {key: value.format(**values)
+                   for key, value in headers.items()}
+        if method == 'POST':
+            return client.post(url, data=data, **headers)
+        return client.get(url, data=data, **headers)
+
+    def capture(self, options):
+        """
+        Return:
+            {endpoint: {'queries', 'statements', 'full_scans'}}
+        """
+
+        user = self.seed(options)
+        client = APIClient()
+        client.credentials(
+            HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(user)}')
+        order = Order.objects.filter(account=user.account) \
+            .select_related('stock').first()
+        today = timezone.localdate()
+        values = {'stock': order.stock.code, 'name': order.stock.name,
+                  'prefix': order.stock.code[:3], 'today': today,
+                  'week_ago': today - timedelta(days=7)}
+        explain = EXPLAIN.get(connection.vendor)
+
+        captured = {}
+        for name in options['endpoint'] or ENDPOINTS:
+            method, url_name, args, data, headers = ENDPOINTS[name]
+            # once to warm the per-process caches, as a running worker has
+            values['key'] = f'{name}-warm'
+            self.request(client, method, url_name, args, data, headers,
+                         values)
+            recorder = QueryRecorder()
+            values['key'] = name
+            with connection.execute_wrapper(recorder):
+                response = self.request(client, method, url_name, args,
+                                        data, headers, values)
+            if response.status_code >= 400:
+                raise CommandError(f'{name} returned '
+                                   f'{response.status_code}: '
+                                   f'{response.content[:200]!r}')
+
+            statements, scans = [], set()
+            with connection.cursor() as cursor:
+                for sql, params in recorder.statements:
+                    plan, tables = [], []
+                    if explain and sql.lstrip().upper().startswith(EXPLAINED):
+                        plan, tables = explain(cursor, sql, params)
+                    statements.append({'sql': normalize(sql), 'plan': plan})
+                    scans.update(tables)
+            captured[name] = {'queries': len(statements),
+                              'statements': statements,
+                              'full_scans': sorted(scans)}
+        return captured
+
+    def compare(self, golden, captured):
+        """
+        Return:
+            list of regressions and list of other changes
+        """
+
+        regressions, changes = [], []
+        for name, current in captured.items():
+            expected = golden.get(name)
+            if expected is None:
+                changes.append(f'{name}: not in the golden file')
+                continue
+            if current['queries'] > expected['queries']:
+                regressions.append(f"{name}: {expected['queries']} -> "
+                                   f"{current['queries']} queries")
+            for table in sorted(set(current['full_scans']) -
+                                set(expected['full_scans'])):
+                regressions.append(f'{name}: new full scan of {table}')
+            if current['queries'] < expected['queries']:
+                changes.append(f"{name}: {expected['queries']} -> "
+                               f"{current['queries']} queries")
+            elif current['statements'] != expected['statements']:
+                changes.append(f'{name}: SQL or plans changed')
+        return regressions, changes
+
+    def handle(self, *args, **options):
+        path = options['golden'] or (Path(settings.BASE_DIR) / 'queryplans' /
+                                     f'{connection.vendor}.json')
+        if connection.vendor not in EXPLAIN:
+            self.stderr.write(f'No EXPLAIN support for {connection.vendor}, '
+                              f'comparing query counts only.')
+
+        # everything the requests write is rolled back with the seed, and
+        # the throttle buckets of the live accounts are left alone
+        with override_settings(ALLOWED_HOSTS=['*'], AUDIT_BUFFERED=False,
+                               THROTTLE_BUCKETS={}), transaction.atomic():
+            captured = self.capture(options)
+            transaction.set_rollback(True)
+
+        for name, current in captured.items():
+            scans = ', '.join(current['full_scans']) or '-'
+            self.stdout.write(f"{name:<25}{current['queries']:>3} queries  "
+                              f'full scans: {scans}')
+
+        if options['update']:
+            golden = {}
+            if options['endpoint'] and path.exists():
+                golden = json.loads(path.read_text())
+            golden.update(captured)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(json.dumps(golden, indent=2, sort_keys=True) +
+                            '\n')
+            self.stdout.write(f'Wrote {path}.')
+            return
+
+        if not path.exists():
+            raise CommandError(f'No golden file at {path}, create it with '
+                               f'--update.')
+        regressions, changes = self.compare(json.loads(path.read_text()),
+                                            captured)
+        for line in changes:
+            self.stdout.write(line)
+        if regressions:
+            raise CommandError('Query plan regressions:\n' +
+                               '\n'.join(regressions))
+        self.stdout.write('No query plan regressions.')
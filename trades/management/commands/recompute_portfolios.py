@@ -0,0 +1,79 @@
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from django.core.management.base import BaseCommand
+from django.db import connections
+from accounts.models import Account
+from trades.portfolio import recompute_batch
+
+
+def close_connections():
+    """Forked workers must not reuse the parent's DB connections"""
+
+    connections.close_all()
+
+
+class Command(BaseCommand):
+    help = ('Recompute StockShare quantity, cost basis and realized P&L and '
+            'Account available_bp (alloted_bp plus net order cash flow) of '
+            'every account from its order history.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Print the corrections without saving')
+        parser.add_argument('--workers', type=int, default=4,
+                            help='Worker processes, 1 runs in-process')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Accounts per worker batch')
+        parser.add_argument('--chunk-size', type=int, default=20000,
+                            help='Rows per order read and bulk write')
+
+    def batches(self, batch_size):
+        ids = list(Account.objects.order_by('id')
+                   .values_list('id', flat=True))
+        for start in range(0, len(ids), batch_size):
+            chunk = ids[start:start + batch_size]
+            yield chunk[0], chunk[-1]
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        batches = list(self.batches(options['batch_size']))
+        jobs = [(first, last, options['chunk_size'], dry_run)
+                for first, last in batches]
+
+        workers = options['workers']
+        if connections['default'].vendor == 'sqlite' and not dry_run:
+            # SQLite has a single writer, parallel batches only deadlock
+            workers = 1
+
+        totals = defaultdict(int)
+        started = time.monotonic()
+
+        def report(stats):
+            for key in ('orders', 'accounts', 'shares', 'balances'):
+                totals[key] += stats[key]
+            totals['batches'] += 1
+            if dry_run:
+                for line in stats['diff']:
+                    self.stdout.write(line)
+            elapsed = max(time.monotonic() - started, 1e-9)
+            self.stderr.write(
+                f"[{totals['batches']}/{len(jobs)}] "
+                f"{totals['accounts']} accounts, {totals['orders']} orders "
+                f"({totals['orders'] / elapsed:.0f} orders/s)")
+
+        if workers <= 1:
+            for job in jobs:
+                report(recompute_batch(*job))
+        else:
+            close_connections()
+            with ProcessPoolExecutor(workers,
+                                     initializer=close_connections) as pool:
+                futures = [pool.submit(recompute_batch, *job) for job in jobs]
+                for future in as_completed(futures):
+                    report(future.result())
+
+        verb = 'Would fix' if dry_run else 'Fixed'
+        self.stdout.write(f"{verb} {totals['shares']} stock shares and "
+                          f"{totals['balances']} account balances in "
+                          f"{time.monotonic() - started:.1f}s.")
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from accounts.models import Account
+from trades.portfolio import take_snapshot
+
+
+class Command(BaseCommand):
+    help = ('Snapshot the positions of every account that placed orders '
+            'since its latest snapshot. Meant to run daily.')
+
+    def handle(self, *args, **options):
+        taken = 0
+        ids = Account.objects.order_by('id').values_list('id', flat=True)
+        for account_id in ids.iterator():
+            if take_snapshot(account_id) is not None:
+                taken += 1
+        self.stdout.write(f'Took {taken} portfolio snapshots.')
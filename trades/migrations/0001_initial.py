@@ -0,0 +1,119 @@
+# Generated by Django 3.1.2 on 2026-10-19 17:52
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('accounts', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderStatus',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('code', models.CharField(max_length=12)),
+                ('description', models.TextField()),
+            ],
+            options={
+                'verbose_name_plural': 'Order Statuses',
+                'db_table': 'trades_order_status',
+            },
+        ),
+        migrations.CreateModel(
+            name='OrderType',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('action', models.CharField(max_length=12)),
+                ('code', models.CharField(max_length=8)),
+            ],
+            options={
+                'db_table': 'trades_order_type',
+            },
+        ),
+        migrations.CreateModel(
+            name='Stock',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50)),
+                ('code', models.CharField(max_length=10)),
+            ],
+            options={
+                'db_table': 'trades_stock',
+            },
+        ),
+        migrations.CreateModel(
+            name='StockShare',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.FloatField(default=0.0, max_length=3)),
+                ('total_value', models.FloatField(default=0.0, max_length=3)),
+                ('realized_pnl', models.FloatField(default=0.0)),
+                ('lots', models.BinaryField(null=True)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shares', to='accounts.account')),
+                ('stock', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='shares', to='trades.stock')),
+            ],
+            options={
+                'db_table': 'trades_stock_share',
+            },
+        ),
+        migrations.CreateModel(
+            name='PortfolioSnapshot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateTimeField()),
+                ('last_order_id', models.PositiveIntegerField(default=0)),
+                ('positions', models.JSONField(default=dict)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='snapshots', to='accounts.account')),
+            ],
+            options={
+                'db_table': 'trades_portfolio_snapshot',
+            },
+        ),
+        migrations.CreateModel(
+            name='Order',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.FloatField(max_length=3)),
+                ('price', models.FloatField(default=0.0, max_length=3)),
+                ('total_value', models.FloatField(default=0.0, max_length=3)),
+                ('realized_pnl', models.FloatField(blank=True, null=True)),
+                ('date', models.DateTimeField(auto_now_add=True)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='accounts.account')),
+                ('order_type', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='orders', to='trades.ordertype')),
+                ('status', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='orders', to='trades.orderstatus')),
+                ('stock', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='orders', to='trades.stock')),
+            ],
+            options={
+                'db_table': 'trades_order',
+            },
+        ),
+        migrations.CreateModel(
+            name='IdempotencyKey',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64)),
+                ('request_hash', models.CharField(max_length=64)),
+                ('status_code', models.PositiveSmallIntegerField()),
+                ('response', models.JSONField()),
+                ('date', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='accounts.account')),
+            ],
+            options={
+                'db_table': 'trades_idempotency_key',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='portfoliosnapshot',
+            index=models.Index(fields=['account', 'date'], name='trades_port_account_90d558_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='idempotencykey',
+            unique_together={('account', 'key')},
+        ),
+    ]
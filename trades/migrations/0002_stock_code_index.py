@@ -0,0 +1,18 @@
+# Generated by Django 3.1.2 on 2026-10-19 17:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trades', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='stock',
+            name='code',
+            field=models.CharField(db_index=True, max_length=10),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 3.1.2 on 2026-10-19 18:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trades', '0002_stock_code_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AuditEvent',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('account_id', models.IntegerField(null=True)),
+                ('actor_id', models.IntegerField(null=True)),
+                ('kind', models.PositiveSmallIntegerField(choices=[(1, 'order'), (2, 'balance'), (3, 'admin')])),
+                ('date', models.DateTimeField()),
+                ('payload', models.BinaryField()),
+            ],
+            options={
+                'db_table': 'trades_audit_event',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='auditevent',
+            index=models.Index(fields=['account_id', 'id'], name='trades_audi_account_f069f4_idx'),
+        ),
+    ]
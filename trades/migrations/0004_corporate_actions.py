@@ -0,0 +1,57 @@
+# Generated by Django 3.1.2 on 2026-10-19 18:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trades', '0003_audit_event'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stock',
+            name='halted',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AlterField(
+            model_name='auditevent',
+            name='kind',
+            field=models.PositiveSmallIntegerField(choices=[(1, 'order'), (2, 'balance'), (3, 'admin'), (4, 'corporate_action')]),
+        ),
+        migrations.CreateModel(
+            name='CorporateAction',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.PositiveSmallIntegerField(choices=[(1, 'split'), (2, 'reverse_split'), (3, 'rename')])),
+                ('ratio', models.FloatField(blank=True, null=True)),
+                ('old_code', models.CharField(max_length=10)),
+                ('new_code', models.CharField(blank=True, max_length=10)),
+                ('new_name', models.CharField(blank=True, max_length=50)),
+                ('date', models.DateTimeField(auto_now_add=True)),
+                ('applied', models.DateTimeField(blank=True, null=True)),
+                ('stock', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='actions', to='trades.stock')),
+            ],
+            options={
+                'db_table': 'trades_corporate_action',
+            },
+        ),
+        migrations.CreateModel(
+            name='CorporateActionBatch',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('first_account_id', models.IntegerField()),
+                ('last_account_id', models.IntegerField()),
+                ('shares', models.PositiveIntegerField(default=0)),
+                ('orders', models.PositiveIntegerField(default=0)),
+                ('date', models.DateTimeField(auto_now_add=True)),
+                ('action', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='batches', to='trades.corporateaction')),
+            ],
+            options={
+                'db_table': 'trades_corporate_action_batch',
+                'unique_together': {('action', 'first_account_id')},
+            },
+        ),
+    ]
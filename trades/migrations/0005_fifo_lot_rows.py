@@ -0,0 +1,70 @@
+# Generated by Django 3.1.2 on 2026-10-19 18:40
+
+import struct
+import sys
+from array import array
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def unpack_lots(apps, schema_editor):
+    """Move the FIFO lots packed in StockShare.lots to Lot rows"""
+
+    StockShare = apps.get_model('trades', 'StockShare')
+    Lot = apps.get_model('trades', 'Lot')
+    header = struct.Struct('<c2d')
+    shares = StockShare.objects.filter(lots__isnull=False).only('id', 'lots')
+    for share in shares.iterator():
+        lots = bytes(share.lots)
+        tag, sold_qty, sold_cost = header.unpack_from(lots)
+        if tag != b'F':
+            continue
+        values = array('d')
+        values.frombytes(lots[header.size:])
+        if sys.byteorder == 'big':
+            values.byteswap()
+        half = len(values) // 2
+        Lot.objects.bulk_create(
+            Lot(share_id=share.pk, qty_sum=qty, cost_sum=cost)
+            for qty, cost in zip(values[:half], values[half:])
+            if qty > sold_qty)
+        StockShare.objects.filter(pk=share.pk).update(
+            lots=None, sold_qty=sold_qty, sold_cost=sold_cost)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trades', '0004_corporate_actions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stockshare',
+            name='sold_cost',
+            field=models.FloatField(default=0.0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='stockshare',
+            name='sold_qty',
+            field=models.FloatField(default=0.0, editable=False),
+        ),
+        migrations.CreateModel(
+            name='Lot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('qty_sum', models.FloatField()),
+                ('cost_sum', models.FloatField()),
+                ('share', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='fifo_lots', to='trades.stockshare')),
+            ],
+            options={
+                'db_table': 'trades_lot',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='lot',
+            index=models.Index(fields=['share', 'qty_sum'], name='trades_lot_share_i_0c8c3a_idx'),
+        ),
+        migrations.RunPython(unpack_lots, migrations.RunPython.noop),
+    ]
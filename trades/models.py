@@ -6,7 +6,9 @@ class Stock(models.Model):
     """Class for tradeable stocks"""
 
     name = models.CharField(max_length=50)
-    code = models.CharField(max_length=10)
+    code = models.CharField(max_length=10, db_index=True)
+    # no orders are taken while a corporate action is applied
+    halted = models.BooleanField(default=False)
 
     class Meta:
         db_table = 'trades_stock'
@@ -51,6 +53,8 @@ class Order(models.Model):
     quantity = models.FloatField(max_length=3)
     price = models.FloatField(max_length=3, default=0.0)
     total_value = models.FloatField(max_length=3, default=0.0)
+    # sale value minus the cost basis of the sold shares, SELL orders only
+    realized_pnl = models.FloatField(null=True, blank=True)
 
     # audit fields
     date = models.DateTimeField(auto_now_add=True)
@@ -74,10 +78,149 @@ class StockShare(models.Model):
     account = models.ForeignKey(Account, on_delete=models.CASCADE,
                                 related_name='shares')
     quantity = models.FloatField(max_length=3, default=0.0)
+    # cost basis of the shares held
     total_value = models.FloatField(max_length=3, default=0.0)
+    realized_pnl = models.FloatField(default=0.0)
+    # packed average cost basis, FIFO lots are `Lot` rows
+    lots = models.BinaryField(null=True, editable=False)
+    # running quantity and cost of the FIFO lots sold so far
+    sold_qty = models.FloatField(default=0.0, editable=False)
+    sold_cost = models.FloatField(default=0.0, editable=False)
 
     class Meta:
         db_table = 'trades_stock_share'
 
     def __str__(self):
         return f'{self.stock.code}/{self.quantity}'
+
+
+class Lot(models.Model):
+    """
+    Class for a FIFO cost basis lot of a share, keyed by the running
+    quantity and cost of the share's lots up to and including it.
+    """
+
+    share = models.ForeignKey(StockShare, on_delete=models.CASCADE,
+                              related_name='fifo_lots')
+    qty_sum = models.FloatField()
+    cost_sum = models.FloatField()
+
+    class Meta:
+        db_table = 'trades_lot'
+        indexes = [models.Index(fields=['share', 'qty_sum'])]
+
+
+class IdempotencyKey(models.Model):
+    """Class for stored responses of requests sent with an Idempotency-Key"""
+
+    account = models.ForeignKey(Account, on_delete=models.CASCADE,
+                                related_name='+')
+    key = models.CharField(max_length=64)
+    request_hash = models.CharField(max_length=64)
+    status_code = models.PositiveSmallIntegerField()
+    response = models.JSONField()
+    date = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        db_table = 'trades_idempotency_key'
+        unique_together = ('account', 'key')
+
+    def __str__(self):
+        return self.key
+
+
+class PortfolioSnapshot(models.Model):
+    """Class for the positions of an account as of a given order"""
+
+    account = models.ForeignKey(Account, on_delete=models.CASCADE,
+                                related_name='snapshots')
+    date = models.DateTimeField()
+    last_order_id = models.PositiveIntegerField(default=0)
+    # {stock id: [quantity, cost basis, base64 packed lots]}
+    positions = models.JSONField(default=dict)
+
+    class Meta:
+        db_table = 'trades_portfolio_snapshot'
+        indexes = [models.Index(fields=['account', 'date'])]
+
+    def __str__(self):
+        return f'{self.account_id}/{self.date:%Y-%m-%d %H:%M}'
+
+
+class AuditEvent(models.Model):
+    """
+    Class for the append-only audit trail, see trades.audit. Rows are only
+    ever bulk inserted, the payload is zlib compressed JSON.
+    """
+
+    ORDER = 1
+    BALANCE = 2
+    ADMIN = 3
+    CORPORATE_ACTION = 4
+    KIND_CHOICES = ((ORDER, 'order'), (BALANCE, 'balance'), (ADMIN, 'admin'),
+                    (CORPORATE_ACTION, 'corporate_action'))
+
+    id = models.BigAutoField(primary_key=True)
+    # plain ids rather than foreign keys, events outlive what they describe
+    account_id = models.IntegerField(null=True)
+    actor_id = models.IntegerField(null=True)
+    kind = models.PositiveSmallIntegerField(choices=KIND_CHOICES)
+    date = models.DateTimeField()
+    payload = models.BinaryField()
+
+    class Meta:
+        db_table = 'trades_audit_event'
+        indexes = [models.Index(fields=['account_id', 'id'])]
+
+    def __str__(self):
+        return f'{self.get_kind_display()}/{self.account_id}/{self.id}'
+
+
+class CorporateAction(models.Model):
+    """Class for stock splits and symbol changes, see trades.actions"""
+
+    SPLIT = 1
+    REVERSE_SPLIT = 2
+    RENAME = 3
+    KIND_CHOICES = ((SPLIT, 'split'), (REVERSE_SPLIT, 'reverse_split'),
+                    (RENAME, 'rename'))
+
+    stock = models.ForeignKey(Stock, on_delete=models.PROTECT,
+                              related_name='actions')
+    kind = models.PositiveSmallIntegerField(choices=KIND_CHOICES)
+    # new shares per old share, 2 for a 2-for-1 split, 0.1 for 1-for-10
+    ratio = models.FloatField(null=True, blank=True)
+    old_code = models.CharField(max_length=10)
+    new_code = models.CharField(max_length=10, blank=True)
+    new_name = models.CharField(max_length=50, blank=True)
+    date = models.DateTimeField(auto_now_add=True)
+    applied = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'trades_corporate_action'
+
+    def __str__(self):
+        return f'{self.get_kind_display()}/{self.old_code}/{self.id}'
+
+
+class CorporateActionBatch(models.Model):
+    """
+    Class for the batches of accounts a corporate action was applied to,
+    written in the transaction of the batch so an interrupted action
+    resumes without applying a batch twice.
+    """
+
+    action = models.ForeignKey(CorporateAction, on_delete=models.CASCADE,
+                               related_name='batches')
+    first_account_id = models.IntegerField()
+    last_account_id = models.IntegerField()
+    shares = models.PositiveIntegerField(default=0)
+    orders = models.PositiveIntegerField(default=0)
+    date = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'trades_corporate_action_batch'
+        unique_together = ('action', 'first_account_id')
+
+    def __str__(self):
+        return f'{self.action_id}/{self.first_account_id}'
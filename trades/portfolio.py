@@ -0,0 +1,362 @@
+from base64 import b64decode, b64encode
+from collections import defaultdict
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from accounts.models import Account
+from trades import audit, costbasis
+from trades.models import (Lot, Order, OrderStatus, OrderType,
+                           PortfolioSnapshot, Stock, StockShare)
+from strader.utils import constants
+
+
+EPSILON = 1e-6
+
+
+class Positions:
+    """Cost basis per stock of an account, replayed from its orders"""
+
+    def __init__(self, positions=None, date=None, last_order_id=0):
+        self.positions = {}
+        for stock_id, (quantity, cost, lots) in (positions or {}).items():
+            self.positions[int(stock_id)] = costbasis.load(
+                b64decode(lots), quantity, cost)
+        self.date = date
+        self.last_order_id = last_order_id
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        if snapshot is None:
+            return cls()
+        return cls(snapshot.positions, snapshot.date, snapshot.last_order_id)
+
+    def copy(self):
+        return Positions(self.as_json(), self.date, self.last_order_id)
+
+    def apply(self, order_id, date, stock_id, order_type, quantity, value):
+        basis = self.positions.get(stock_id)
+        if basis is None:
+            basis = self.positions[stock_id] = costbasis.new_basis()
+        if order_type == constants.BUY:
+            basis.buy(quantity, value)
+        else:
+            basis.sell(quantity)
+        if basis.quantity <= costbasis.EPSILON:
+            del self.positions[stock_id]
+        self.date = date
+        self.last_order_id = order_id
+
+    def as_json(self):
+        return {str(stock_id): [basis.quantity, basis.cost,
+                                b64encode(basis.pack()).decode()]
+                for stock_id, basis in self.positions.items()}
+
+    def total_value(self):
+        return sum(basis.cost for basis in self.positions.values())
+
+
+def order_rows(account_id, after_id=0, until=None):
+    """
+    Filled orders of an account after order `after_id` and up to `until`,
+    in the order they were placed.
+    """
+
+    orders = (Order.objects
+              .filter(account_id=account_id, id__gt=after_id)
+              .exclude(status__code=constants.FAILED))
+    if until is not None:
+        orders = orders.filter(date__lte=until)
+    return (orders.order_by('id')
+            .values_list('id', 'date', 'stock_id', 'order_type__code',
+                         'quantity', 'total_value')
+            .iterator())
+
+
+def latest_snapshot(account_id, at=None):
+    snapshots = PortfolioSnapshot.objects.filter(account_id=account_id)
+    if at is not None:
+        snapshots = snapshots.filter(date__lte=at)
+    return snapshots.order_by('-date', '-last_order_id').first()
+
+
+def positions_at(account_id, at):
+    """
+    Positions of an account at `at`: the nearest snapshot before it plus the
+    orders placed since, so the replay is bounded by the snapshot interval.
+    """
+
+    positions = Positions.from_snapshot(latest_snapshot(account_id, at))
+    for row in order_rows(account_id, positions.last_order_id, at):
+        positions.apply(*row)
+    return positions
+
+
+def positions_between(account_id, start, end, step=timedelta(days=1)):
+    """
+    Positions of an account at `start` and then every `step` up to `end`.
+
+    Return:
+        list of `(date, Positions)`
+    """
+
+    positions = positions_at(account_id, start)
+    points, point = [], start
+    for row in order_rows(account_id, positions.last_order_id, end):
+        while row[1] > point:
+            points.append((point, positions.copy()))
+            point += step
+        positions.apply(*row)
+    while point <= end:
+        points.append((point, positions.copy()))
+        point += step
+    return points
+
+
+def take_snapshot(account_id, until=None):
+    """
+    Snapshot the positions of an account from its latest snapshot plus the
+    orders placed since. Return None if there was nothing new to snapshot.
+    """
+
+    latest = latest_snapshot(account_id)
+    positions = Positions.from_snapshot(latest)
+    last_order_id = positions.last_order_id
+    for row in order_rows(account_id, last_order_id, until):
+        positions.apply(*row)
+    if positions.last_order_id == last_order_id:
+        return None
+
+    return PortfolioSnapshot.objects.create(
+        account_id=account_id, date=positions.date or timezone.now(),
+        last_order_id=positions.last_order_id,
+        positions=positions.as_json())
+
+
+def snapshot_if_due(account_id):
+    """Snapshot an account once `PORTFOLIO_SNAPSHOT_EVERY` orders piled up"""
+
+    every = getattr(settings, 'PORTFOLIO_SNAPSHOT_EVERY', 0)
+    if not every:
+        return None
+
+    latest = latest_snapshot(account_id)
+    after_id = latest.last_order_id if latest else 0
+    pending = (Order.objects.filter(account_id=account_id, id__gt=after_id)
+               .values('id')[:every].count())
+    if pending >= every:
+        return take_snapshot(account_id)
+    return None
+
+
+def stock_codes(*positions):
+    """Map the stock ids held in the given positions to their codes"""
+
+    ids = set()
+    for item in positions:
+        ids.update(item.positions)
+    return dict(Stock.objects.filter(pk__in=ids).values_list('id', 'code'))
+
+
+def describe(date, positions, codes):
+    """API representation of the positions at a given date"""
+
+    return {
+        'date': date,
+        'total_value': positions.total_value(),
+        'positions': [
+            {'stock': codes.get(stock_id), 'quantity': basis.quantity,
+             'total_value': basis.cost}
+            for stock_id, basis in sorted(positions.positions.items())
+        ]
+    }
+
+
+def replay_orders(rows):
+    """
+    Replay `(account_id, stock_id, is_buy, quantity, total_value)` rows,
+    sorted by order within each account, into a cost basis and realized P&L
+    per (account, stock) and the net cash flow per account.
+    """
+
+    positions = {}
+    cash = defaultdict(float)
+    for account_id, stock_id, is_buy, quantity, value in rows:
+        position = positions.get((account_id, stock_id))
+        if position is None:
+            position = positions[account_id, stock_id] = \
+                [costbasis.new_basis(), 0.0]
+        if is_buy:
+            position[0].buy(quantity, value)
+            cash[account_id] -= value
+        else:
+            position[1] += value - position[0].sell(quantity)
+            cash[account_id] += value
+    return positions, cash
+
+
+def same_lots(share, rows, basis):
+    """
+    Whether a share stores the lots of a replayed basis, given its `Lot`
+    rows as `(qty_sum, cost_sum)`.
+    """
+
+    if basis.method != costbasis.FIFO:
+        return share.lots is not None and bytes(share.lots) == basis.pack()
+    if share.lots is not None:
+        # packed by the average method
+        return False
+    end = (share.quantity + share.sold_qty,
+           share.total_value + share.sold_cost)
+    qty_sum, cost_sum = zip(*rows, end)
+    stored = costbasis.remaining(qty_sum, cost_sum, share.sold_qty,
+                                 share.sold_cost)
+    replayed = costbasis.remaining(basis.qty_sum, basis.cost_sum,
+                                   basis.sold_qty, basis.sold_cost)
+    return len(stored) == len(replayed) and all(
+        abs(a - b) <= EPSILON
+        for lot, other in zip(stored, replayed) for a, b in zip(lot, other))
+
+
+def set_lots(share, basis, rewrites):
+    """Set a share to a replayed basis, its FIFO lots go to `rewrites`"""
+
+    share.quantity, share.total_value = basis.quantity, basis.cost
+    if basis.method == costbasis.FIFO:
+        share.sold_qty, share.sold_cost = basis.sold_qty, basis.sold_cost
+        share.lots = None
+        rewrites.append((share, basis))
+    else:
+        share.lots = basis.pack()
+
+
+def write_lots(rewrites, chunk_size):
+    """Replace the `Lot` rows of saved shares by those of their basis"""
+
+    ids = [share.pk for share, _ in rewrites]
+    # bounded IN lists, SQLite takes 999 parameters
+    for start in range(0, len(ids), 500):
+        Lot.objects.filter(share_id__in=ids[start:start + 500]).delete()
+    Lot.objects.bulk_create(
+        [Lot(share=share, qty_sum=qty, cost_sum=cost)
+         for share, basis in rewrites
+         for qty, cost in zip(basis.qty_sum, basis.cost_sum)
+         if qty > basis.sold_qty + costbasis.EPSILON],
+        batch_size=chunk_size)
+
+
+def recompute_batch(first, last, chunk_size, dry_run, account_ids=None):
+    """
+    Recompute the shares and buying power of accounts `first`..`last`, or
+    only of `account_ids` among them.
+
+    Return:
+        dict of counters and the list of diff lines
+    """
+
+    buy_id = OrderType.objects.get(code=constants.BUY).pk
+    failed_id = OrderStatus.objects.get(code=constants.FAILED).pk
+    scope = Q(account_id__gte=first, account_id__lte=last)
+    if account_ids is not None:
+        scope &= Q(account_id__in=account_ids)
+    accounts = Account.objects.filter(id__gte=first, id__lte=last)
+    if account_ids is not None:
+        accounts = accounts.filter(id__in=account_ids)
+
+    with transaction.atomic():
+        # lock the accounts so orders can't land while they are rebuilt
+        if not dry_run:
+            accounts = accounts.select_for_update()
+        balances = {pk: (alloted, available) for pk, alloted, available in
+                    accounts.values_list('id', 'alloted_bp', 'available_bp')}
+
+        orders = (Order.objects
+                  .filter(scope)
+                  .exclude(status_id=failed_id)
+                  .order_by('account_id', 'id')
+                  .values_list('account_id', 'stock_id', 'order_type_id',
+                               'quantity', 'total_value'))
+        stats = {'orders': 0}
+
+        def rows():
+            for account_id, stock_id, type_id, quantity, value in \
+                    orders.iterator(chunk_size=chunk_size):
+                stats['orders'] += 1
+                yield account_id, stock_id, type_id == buy_id, quantity, value
+
+        positions, cash = replay_orders(rows())
+
+        diff, share_updates, share_creates, account_updates = [], [], [], []
+        corrections, rewrites = [], []
+        shares = StockShare.objects.filter(scope)
+        stored = defaultdict(list)
+        for share_id, qty, cost in (Lot.objects.filter(share__in=shares)
+                                    .order_by('share_id', 'qty_sum')
+                                    .values_list('share_id', 'qty_sum',
+                                                 'cost_sum')
+                                    .iterator(chunk_size=chunk_size)):
+            stored[share_id].append((qty, cost))
+
+        for share in shares.only('id', 'account_id', 'stock_id', 'quantity',
+                                 'total_value', 'realized_pnl', 'lots',
+                                 'sold_qty', 'sold_cost'):
+            basis, realized = positions.pop(
+                (share.account_id, share.stock_id),
+                (costbasis.new_basis(), 0.0))
+            if (abs(share.quantity - basis.quantity) > EPSILON or
+                    abs(share.total_value - basis.cost) > EPSILON or
+                    abs(share.realized_pnl - realized) > EPSILON):
+                diff.append(f'share {share.pk} (account {share.account_id}, '
+                            f'stock {share.stock_id}): '
+                            f'{share.quantity}/{share.total_value}/'
+                            f'{share.realized_pnl} -> {basis.quantity}/'
+                            f'{basis.cost}/{realized}')
+            elif same_lots(share, stored[share.pk], basis):
+                continue
+            share.realized_pnl = realized
+            set_lots(share, basis, rewrites)
+            share_updates.append(share)
+
+        for (account_id, stock_id), (basis, realized) in positions.items():
+            diff.append(f'share (account {account_id}, stock {stock_id}): '
+                        f'missing -> {basis.quantity}/{basis.cost}/'
+                        f'{realized}')
+            share = StockShare(account_id=account_id, stock_id=stock_id,
+                               realized_pnl=realized)
+            set_lots(share, basis, rewrites)
+            share_creates.append(share)
+
+        for pk, (alloted, available) in balances.items():
+            expected = alloted + cash.get(pk, 0.0)
+            if abs(available - expected) > EPSILON:
+                diff.append(f'account {pk}: available_bp {available} -> '
+                            f'{expected}')
+                account_updates.append(Account(pk=pk, available_bp=expected))
+                corrections.append((pk, available, expected))
+
+        if not dry_run:
+            StockShare.objects.bulk_update(share_updates,
+                                           ['quantity', 'total_value',
+                                            'realized_pnl', 'lots',
+                                            'sold_qty', 'sold_cost'],
+                                           batch_size=chunk_size)
+            # missing shares are rare, their lots need the ids
+            for share in share_creates:
+                share.save()
+            write_lots(rewrites, chunk_size)
+            Account.objects.bulk_update(account_updates, ['available_bp'],
+                                        batch_size=chunk_size)
+            # drop the cached risk snapshots of every worker
+            accounts.update(version=F('version') + 1)
+
+    if not dry_run:
+        for pk, before, after in corrections:
+            audit.record_balance(pk, before, after, 'recompute')
+        # worker processes exit without running atexit hooks
+        audit.audit_log.flush()
+
+    stats.update(accounts=len(balances),
+                 shares=len(share_updates) + len(share_creates),
+                 balances=len(account_updates), diff=diff)
+    return stats
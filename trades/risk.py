@@ -0,0 +1,237 @@
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from functools import lru_cache
+from django.conf import settings
+from django.db.models import OuterRef, Subquery, Sum
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from accounts.models import Account
+from trades.models import Order, StockShare
+from strader.utils import constants
+from strader.utils.metrics import metrics
+
+
+OrderRequest = namedtuple('OrderRequest', ['stock_id', 'stock_code',
+                                           'order_type', 'quantity', 'price',
+                                           'total_value'])
+
+
+class RiskSnapshot:
+    """
+    Everything the pre-trade checks need to know about an account, loaded
+    with two queries whatever the number of checks.
+    """
+
+    __slots__ = ('version', 'day', 'available_bp', 'daily_pnl', 'shares')
+
+    def __init__(self, available_bp, daily_pnl=0.0, shares=None, version=0,
+                 day=None):
+        self.version = version
+        self.day = day
+        self.available_bp = available_bp
+        self.daily_pnl = daily_pnl
+        # stock id -> (quantity, cost basis)
+        self.shares = shares or {}
+
+    @classmethod
+    def load(cls, account_id):
+        start_of_day = timezone.localtime().replace(hour=0, minute=0,
+                                                    second=0, microsecond=0)
+        daily_pnl = (Order.objects
+                     .filter(account_id=OuterRef('pk'),
+                             date__gte=start_of_day)
+                     .values('account_id')
+                     .annotate(pnl=Sum('realized_pnl'))
+                     .values('pnl'))
+        version, available_bp, pnl = (Account.objects
+                                      .filter(pk=account_id)
+                                      .annotate(daily_pnl=Subquery(daily_pnl))
+                                      .values_list('version', 'available_bp',
+                                                   'daily_pnl')
+                                      .get())
+        shares = StockShare.objects.filter(account_id=account_id)
+        return cls(available_bp, pnl or 0.0, {
+            stock_id: (quantity, total_value)
+            for stock_id, quantity, total_value in
+            shares.values_list('stock_id', 'quantity', 'total_value')},
+            version, start_of_day.date())
+
+    def position(self, stock_id):
+        return self.shares.get(stock_id, (0.0, 0.0))
+
+    @property
+    def equity(self):
+        """Buying power plus the cost basis of every position"""
+
+        return self.available_bp + sum(cost for _, cost in
+                                       self.shares.values())
+
+
+class SnapshotCache:
+    """
+    Write-through cache of the risk snapshots of recently active accounts.
+
+    Every write to the balance or shares of an account bumps
+    `Account.version`. A cached snapshot is used while its version matches
+    the account row the request already loaded, so validating an order runs
+    from memory. After a write made elsewhere (another worker, a command or
+    the admin) the versions differ and the snapshot is reloaded. Writes made
+    by this worker update the cached snapshot on commit.
+    """
+
+    def __init__(self, max_entries=None):
+        self._max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    @property
+    def max_entries(self):
+        if self._max_entries is not None:
+            return self._max_entries
+        return getattr(settings, 'ACCOUNT_STATE_CACHE_SIZE', 10000)
+
+    def _remember(self, account_id, snapshot):
+        with self._lock:
+            self._entries[account_id] = snapshot
+            self._entries.move_to_end(account_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get(self, account):
+        """Snapshot of an `Account` as of its loaded version"""
+
+        with self._lock:
+            snapshot = self._entries.get(account.pk)
+            if snapshot is not None:
+                self._entries.move_to_end(account.pk)
+
+        if snapshot is None or snapshot.version != account.version or \
+                snapshot.day != timezone.localdate():
+            metrics.incr('risk.snapshot.misses')
+            snapshot = RiskSnapshot.load(account.pk)
+            self._remember(account.pk, snapshot)
+        return snapshot
+
+    def update(self, account_id, version, available_bp, shares,
+               realized_pnl=0.0):
+        """
+        Apply a committed write that moved an account to `version`, with
+        its new buying power and `{stock id: (quantity, cost)}` of the
+        positions it changed. The cached snapshot is dropped instead if it
+        missed an earlier write.
+        """
+
+        with self._lock:
+            cached = self._entries.get(account_id)
+            if cached is None:
+                return
+            if cached.version != version - 1:
+                del self._entries[account_id]
+                return
+            # snapshots are shared between threads, replace rather than edit
+            self._entries[account_id] = RiskSnapshot(
+                available_bp, cached.daily_pnl + (realized_pnl or 0.0),
+                {**cached.shares, **shares}, version, cached.day)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+snapshot_cache = SnapshotCache()
+
+
+def buying_power(snapshot, order):
+    if order.order_type == constants.BUY and \
+            order.total_value > snapshot.available_bp:
+        return 'Not enough buying power.'
+
+
+def available_shares(snapshot, order):
+    quantity, _ = snapshot.position(order.stock_id)
+    if order.order_type == constants.SELL and order.quantity > quantity:
+        return 'Not enough shares.'
+
+
+def max_order_value(snapshot, order):
+    limit = getattr(settings, 'RISK_MAX_ORDER_VALUE', None)
+    if limit is not None and order.total_value > limit:
+        return f'Order value exceeds the limit of {limit}.'
+
+
+def position_concentration(snapshot, order):
+    """A buy can't grow a position past a share of the account's equity"""
+
+    limit = getattr(settings, 'RISK_MAX_POSITION_SHARE', None)
+    if limit is None or order.order_type != constants.BUY:
+        return None
+    _, cost = snapshot.position(order.stock_id)
+    equity = snapshot.equity
+    if equity > 0 and (cost + order.total_value) / equity > limit:
+        return (f'Position in {order.stock_code} would exceed '
+                f'{limit:.0%} of the account.')
+
+
+def stock_limits(snapshot, order):
+    limits = getattr(settings, 'RISK_STOCK_LIMITS', {}).get(order.stock_code)
+    if not limits:
+        return None
+    max_value = limits.get('max_order_value')
+    if max_value is not None and order.total_value > max_value:
+        return (f'Order value exceeds the limit of {max_value} for '
+                f'{order.stock_code}.')
+    max_quantity = limits.get('max_quantity')
+    quantity, _ = snapshot.position(order.stock_id)
+    if max_quantity is not None and order.order_type == constants.BUY and \
+            quantity + order.quantity > max_quantity:
+        return (f'Position exceeds the limit of {max_quantity} shares for '
+                f'{order.stock_code}.')
+
+
+def daily_loss(snapshot, order):
+    """Once today's realized losses reach the limit only sells go through"""
+
+    limit = getattr(settings, 'RISK_MAX_DAILY_LOSS', None)
+    if limit is not None and order.order_type == constants.BUY and \
+            -snapshot.daily_pnl >= limit:
+        return 'Daily loss limit reached.'
+
+
+@lru_cache(maxsize=None)
+def _load_checks(paths):
+    return [(path.rsplit('.', 1)[-1], import_string(path)) for path in paths]
+
+
+def get_checks():
+    """`(name, check)` of the checks listed in `RISK_CHECKS`"""
+
+    return _load_checks(tuple(getattr(settings, 'RISK_CHECKS', ())))
+
+
+def check_order(account, order):
+    """
+    Run the pre-trade checks against the cached snapshot of an `Account`.
+    Each check returns an error message or None; the first error is
+    returned.
+
+    Time spent per check is counted in `risk.<check>.us`, next to its
+    `risk.<check>.calls` and `risk.<check>.rejected` counters.
+    """
+
+    started = time.perf_counter()
+    snapshot = snapshot_cache.get(account)
+    now = time.perf_counter()
+    metrics.incr('risk.snapshot.calls')
+    metrics.incr('risk.snapshot.us', int((now - started) * 1e6))
+
+    for name, check in get_checks():
+        started = now
+        error = check(snapshot, order)
+        now = time.perf_counter()
+        metrics.incr(f'risk.{name}.calls')
+        metrics.incr(f'risk.{name}.us', int((now - started) * 1e6))
+        if error:
+            metrics.incr(f'risk.{name}.rejected')
+            return error
+    return None
@@ -0,0 +1,150 @@
+import threading
+import time
+from bisect import bisect_left
+from django.conf import settings
+
+
+class StockSearchIndex:
+    """
+    In-memory prefix/trigram index over stock codes and names.
+
+    Prefix lookups are answered with a bisect over a sorted term list and
+    substring lookups by intersecting trigram postings, so neither has to
+    scan the `trades_stock` table. The index is rebuilt lazily on the first
+    lookup after `invalidate()` or once it is older than
+    `STOCK_SEARCH_INDEX_TTL` seconds.
+
+    The index is per process: a Stock change invalidates it in the process
+    that saved it only, other workers see the change once their index is
+    older than the TTL.
+    """
+
+    def __init__(self, loader=None, ttl=None):
+        self._loader = loader or self._load_stocks
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._built_at = None
+        # (stocks, names, terms, term_ids, trigrams), swapped as a whole so
+        # readers never see a half-built index
+        self._data = ([], [], [], [], {})
+
+    @staticmethod
+    def _load_stocks():
+        from trades.models import Stock
+        return Stock.objects.values_list('id', 'code', 'name').iterator()
+
+    @staticmethod
+    def _trigrams_of(text):
+        return {text[i:i + 3] for i in range(len(text) - 2)}
+
+    def build(self, rows):
+        """
+        Build the index from an iterable of `(id, code, name)` tuples.
+        """
+
+        stocks, names, terms, trigrams = [], [], [], {}
+        for pos, (pk, code, name) in enumerate(rows):
+            lname = name.lower()
+            stocks.append({'id': pk, 'code': code, 'name': name})
+            names.append(lname)
+
+            # code, full name and every word of the name are prefix terms
+            words = {code.lower(), lname, *lname.split()}
+            terms.extend((word, pos) for word in words if word)
+            for gram in self._trigrams_of(lname):
+                trigrams.setdefault(gram, []).append(pos)
+
+        terms.sort()
+        self._data = (stocks, names, [term for term, _ in terms],
+                      [pos for _, pos in terms], trigrams)
+        self._built_at = time.monotonic()
+
+    def invalidate(self):
+        """
+        Mark the index stale so the next lookup rebuilds it, in this process
+        only.
+        """
+
+        self._built_at = None
+
+    def _ensure_built(self):
+        ttl = self._ttl
+        if ttl is None:
+            ttl = getattr(settings, 'STOCK_SEARCH_INDEX_TTL', 300)
+
+        def is_stale():
+            built_at = self._built_at
+            return built_at is None or time.monotonic() - built_at > ttl
+
+        if is_stale():
+            with self._lock:
+                if is_stale():
+                    self.build(self._loader())
+        return self._data
+
+    @staticmethod
+    def _prefix_positions(data, query):
+        _, _, terms, term_ids, _ = data
+        start = bisect_left(terms, query)
+        end = bisect_left(terms, query + '\uffff', lo=start)
+        return term_ids[start:end]
+
+    def _contains_positions(self, data, query):
+        _, names, _, _, trigrams = data
+        if len(query) < 3:
+            return [pos for pos, name in enumerate(names) if query in name]
+
+        postings = []
+        for gram in self._trigrams_of(query):
+            posting = trigrams.get(gram)
+            if not posting:
+                return []
+            postings.append(posting)
+        postings.sort(key=len)
+        candidates = set(postings[0])
+        for posting in postings[1:]:
+            candidates.intersection_update(posting)
+            if not candidates:
+                return []
+
+        # trigrams may match out of order, confirm the actual substring
+        return sorted(pos for pos in candidates if query in names[pos])
+
+    def name_contains(self, query):
+        """
+        Return the ids of stocks whose name contains `query`, ignoring case.
+        Same semantics as `stock__name__icontains`.
+        """
+
+        data = self._ensure_built()
+        stocks = data[0]
+        return [stocks[pos]['id']
+                for pos in self._contains_positions(data, query.lower())]
+
+    def search(self, query, limit=20):
+        """
+        Search stocks by code or name. Prefix matches rank before
+        substring matches.
+
+        Return:
+            list of dicts with `id`, `code` and `name`
+        """
+
+        query = query.strip().lower()
+        if not query:
+            return []
+        data = self._ensure_built()
+
+        stocks = data[0]
+        seen, results = set(), []
+        for lookup in (self._prefix_positions, self._contains_positions):
+            for pos in lookup(data, query):
+                if pos not in seen:
+                    seen.add(pos)
+                    results.append(stocks[pos])
+                    if len(results) >= limit:
+                        return results
+        return results
+
+
+stock_index = StockSearchIndex()
@@ -1,14 +1,39 @@
+from django.db import transaction
 from rest_framework import serializers
 from strader.utils import constants
 from trades.models import Order, Stock, OrderType, OrderStatus, StockShare
+from trades import intake
+from trades.risk import OrderRequest, check_order
+
+
+class StockSerializer(serializers.ModelSerializer):
+    """Serializer for stock search results"""
+
+    class Meta:
+        model = Stock
+        fields = ('id', 'code', 'name')
 
 
 class StockShareSerializer(serializers.ModelSerializer):
     """Serializer for user's stock shares"""
 
+    total_value = serializers.FloatField(help_text='Cost basis of the shares')
+    average_cost = serializers.SerializerMethodField()
+    unrealized_pnl = serializers.SerializerMethodField(
+        help_text='Market value at the last traded price minus cost basis')
+
     class Meta:
         model = StockShare
-        fields = '__all__'
+        exclude = ('lots', 'sold_qty', 'sold_cost')
+
+    def get_average_cost(self, share):
+        return share.total_value / share.quantity if share.quantity else 0.0
+
+    def get_unrealized_pnl(self, share):
+        last_price = getattr(share, 'last_price', None)
+        if last_price is None:
+            return None
+        return share.quantity * last_price - share.total_value
 
 
 class OrderListSerializer(serializers.ModelSerializer):
@@ -52,30 +77,27 @@ class OrderSerializer(serializers.ModelSerializer):
         return order['quantity'] * order['price']
 
     def validate(self, data):
-        """Override to check current balance and available shares"""
+        """Override to run the pre-trade risk checks of `trades.risk`"""
 
         ret = super().validate(data)
         total_value = self.compute_total_value(ret)
         account = self.context['request'].user.account
         stock = ret['stock']
-        order_type = ret['order_type'].code
-        quantity = ret['quantity']
-        stock_share, _ = account.shares.get_or_create(stock=stock)
-
-        # check available BP if order type is BUY
-        if order_type == constants.BUY and total_value > account.available_bp:
-            raise serializers.ValidationError({'details':
-                                               'Not enough buying power.'})
-
-        # check if current stock shares is enough for SELL
-        if order_type == constants.SELL and quantity > stock_share.quantity:
-            raise serializers.ValidationError({'details':
-                                               'Not enough shares.'})
+        if stock.halted:
+            raise serializers.ValidationError(
+                {'details': f'Trading in {stock.code} is halted.'})
+        order = OrderRequest(stock_id=stock.pk, stock_code=stock.code,
+                             order_type=ret['order_type'].code,
+                             quantity=ret['quantity'], price=ret['price'],
+                             total_value=total_value)
+
+        error = check_order(account, order)
+        if error:
+            raise serializers.ValidationError({'details': error})
 
         ret.update(total_value=total_value)
         return ret
 
-
     def create(self, data):
         """Perform business logic in posting the order"""
 
@@ -90,4 +112,15 @@ class OrderSerializer(serializers.ModelSerializer):
             status=status
         )
 
-        return super().create(data)
+        try:
+            if self.context.get('batched'):
+                try:
+                    return intake.order_intake.submit(Order(**data))
+                except intake.IntakeTimeout:
+                    # withdrawn from a stalled intake, commit it directly
+                    pass
+            # the insert is rolled back if the post_save checks reject it
+            with transaction.atomic():
+                return super().create(data)
+        except intake.OrderRejected as exc:
+            raise serializers.ValidationError({'details': str(exc)})
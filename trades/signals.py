@@ -1,6 +1,14 @@
-from django.db.models.signals import post_save
+from functools import partial
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
-from trades.models import Order
+from accounts.models import Account
+from trades import audit, costbasis, events, intake, portfolio
+from trades.models import Order, Stock
+from trades.risk import snapshot_cache
+from trades.search import stock_index
+from trades.serializers import OrderListSerializer
 from strader.utils import constants
 
 
@@ -18,21 +26,79 @@ def update_account_balance(sender, instance, created, **kwargs):
         # but for now consider only FILLED.
         # stock share of the user should also be updated.
 
-        account = instance.account
-        stock_code = instance.stock
-        stock_share, _ = instance.account.shares.get_or_create(stock=stock_code)
+        # lock the account so that concurrent orders can't both read and
+        # bump the same balance and version. Bumping the version first takes
+        # the row lock, and on SQLite the write lock before any read, so
+        # concurrent writers wait instead of failing to upgrade their lock
+        with transaction.atomic():
+            accounts = Account.objects.filter(pk=instance.account_id)
+            accounts.update(version=F('version') + 1)
+            account = accounts.select_for_update().get()
+            # a split batch may have committed since the order was
+            # validated, its quantity and price are pre-split
+            if Stock.objects.filter(pk=instance.stock_id,
+                                    halted=True).exists():
+                raise intake.OrderRejected(
+                    f'Trading in {instance.stock.code} is halted.')
+            stock_share, _ = account.shares.get_or_create(
+                stock=instance.stock)
 
-        order_val = instance.total_value
-        order_type = instance.order_type.code
+            order_val = instance.total_value
+            available_bp = account.available_bp
+            order_type = instance.order_type.code
+            basis = costbasis.load_share(stock_share)
 
-        if order_type == constants.BUY:
-            account.available_bp -= order_val
-            stock_share.quantity += instance.quantity
-            stock_share.total_value += order_val
-        elif order_type == constants.SELL:
-            account.available_bp += order_val
-            stock_share.quantity -= instance.quantity
-            stock_share.total_value -= order_val
+            if order_type == constants.BUY:
+                account.available_bp -= order_val
+                basis.buy(instance.quantity, order_val)
+            elif order_type == constants.SELL:
+                account.available_bp += order_val
+                instance.realized_pnl = order_val - basis.sell(
+                    instance.quantity)
+                stock_share.realized_pnl += instance.realized_pnl
+                Order.objects.filter(pk=instance.pk).update(
+                    realized_pnl=instance.realized_pnl)
 
-        account.save()
-        stock_share.save()
+            costbasis.store(stock_share, basis)
+            account.save(update_fields=['available_bp'])
+            stock_share.save()
+            costbasis.write_lots([basis])
+
+        # the request's account reflects the committed row
+        instance.account.available_bp = account.available_bp
+        instance.account.version = account.version
+
+        transaction.on_commit(partial(
+            snapshot_cache.update, account.pk, account.version,
+            account.available_bp,
+            {stock_share.stock_id: (basis.quantity, basis.cost)},
+            instance.realized_pnl))
+
+        transaction.on_commit(lambda: publish_order_events(instance))
+        transaction.on_commit(partial(audit.record_order, instance,
+                                      available_bp))
+        transaction.on_commit(
+            lambda: portfolio.snapshot_if_due(instance.account_id))
+
+
+def publish_order_events(order):
+    """Push the events of a placed order to the account's subscribers"""
+
+    account = order.account
+    data = dict(OrderListSerializer(order).data)
+    events.publish(account.pk, events.ORDER_CREATED, data)
+    if order.status.code == constants.FILLED:
+        events.publish(account.pk, events.ORDER_FILLED, data)
+    events.publish(account.pk, events.BALANCE_CHANGED,
+                   {'available_bp': account.available_bp})
+
+
+@receiver(post_save, sender=Stock, dispatch_uid='stock_index_save')
+@receiver(post_delete, sender=Stock, dispatch_uid='stock_index_delete')
+def invalidate_stock_index(sender, **kwargs):
+    """
+    Rebuild the stock search index of this process on the next lookup,
+    the other workers wait for `STOCK_SEARCH_INDEX_TTL`.
+    """
+
+    stock_index.invalidate()
@@ -0,0 +1,160 @@
+import asyncio
+import json
+from urllib.parse import parse_qs
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.tokens import AccessToken
+from accounts.models import Account
+from trades import events
+
+
+@sync_to_async
+def get_account_id(token):
+    """Return the account id of a valid access token, else None"""
+
+    try:
+        user_id = AccessToken(token)[jwt_settings.USER_ID_CLAIM]
+    except (TokenError, KeyError):
+        return None
+    return (Account.objects
+            .filter(user_id=user_id, user__is_active=True)
+            .values_list('id', flat=True)
+            .first())
+
+
+def parse_request(scope):
+    """
+    Read the access token and resume offset of a stream request. Browsers
+    can't set headers on EventSource or WebSocket, so both may also be
+    passed as `token` and `offset` query parameters.
+    """
+
+    query = parse_qs(scope.get('query_string', b'').decode())
+    headers = {key.decode().lower(): value.decode()
+               for key, value in scope.get('headers', [])}
+
+    token = query.get('token', [None])[0]
+    auth = headers.get('authorization', '')
+    if auth.startswith('Bearer '):
+        token = auth[len('Bearer '):]
+
+    offset = headers.get('last-event-id') or query.get('offset', [None])[0]
+    try:
+        offset = int(offset) if offset is not None else None
+    except ValueError:
+        offset = None
+    return token, offset
+
+
+async def pump(sub, receive, write, disconnect_type):
+    """
+    Forward events of a subscription until the client disconnects or the
+    subscription is closed. `write(None)` is called on idle heartbeats.
+
+    Return:
+        True if the subscription was closed on the server side
+    """
+
+    heartbeat = getattr(settings, 'ORDER_EVENTS_HEARTBEAT', 15)
+    recv = asyncio.ensure_future(receive())
+    get = None
+    try:
+        while True:
+            if get is None:
+                get = asyncio.ensure_future(sub.get())
+            done, _ = await asyncio.wait(
+                {recv, get}, timeout=heartbeat,
+                return_when=asyncio.FIRST_COMPLETED)
+
+            if recv in done:
+                if recv.result()['type'] == disconnect_type:
+                    return False
+                recv = asyncio.ensure_future(receive())
+                continue
+            if get not in done:
+                await write(None)
+                continue
+
+            item, get = get.result(), None
+            if item is None:
+                return True
+            await write(item)
+    finally:
+        recv.cancel()
+        if get is not None:
+            get.cancel()
+        sub.close()
+
+
+async def sse(scope, receive, send):
+    token, offset = parse_request(scope)
+    account_id = await get_account_id(token) if token else None
+    if account_id is None:
+        await send({'type': 'http.response.start', 'status': 401,
+                    'headers': [(b'content-type', b'application/json')]})
+        await send({'type': 'http.response.body',
+                    'body': b'{"detail": "Authentication required.", '
+                            b'"status_code": 401}'})
+        return
+
+    events.get_backend().start()
+    sub = events.broker.subscribe(account_id, asyncio.get_running_loop(),
+                                  offset)
+    await send({'type': 'http.response.start', 'status': 200,
+                'headers': [(b'content-type', b'text/event-stream'),
+                            (b'cache-control', b'no-cache'),
+                            (b'x-accel-buffering', b'no')]})
+
+    async def write(item):
+        if item is None:
+            body = b': ping\n\n'
+        else:
+            offset, kind, data = item
+            body = (f'id: {offset}\nevent: {kind}\n'
+                    f'data: {json.dumps(data)}\n\n').encode()
+        await send({'type': 'http.response.body', 'body': body,
+                    'more_body': True})
+
+    await pump(sub, receive, write, 'http.disconnect')
+    await send({'type': 'http.response.body', 'body': b''})
+
+
+async def websocket(scope, receive, send):
+    message = await receive()
+    if message['type'] != 'websocket.connect':
+        return
+
+    token, offset = parse_request(scope)
+    account_id = await get_account_id(token) if token else None
+    if account_id is None:
+        await send({'type': 'websocket.close', 'code': 4401})
+        return
+
+    events.get_backend().start()
+    sub = events.broker.subscribe(account_id, asyncio.get_running_loop(),
+                                  offset)
+    await send({'type': 'websocket.accept'})
+
+    async def write(item):
+        # websocket servers send protocol level pings themselves
+        if item is not None:
+            offset, kind, data = item
+            text = json.dumps({'offset': offset, 'event': kind, 'data': data})
+            await send({'type': 'websocket.send', 'text': text})
+
+    if await pump(sub, receive, write, 'websocket.disconnect'):
+        await send({'type': 'websocket.close', 'code': 1013})
+
+
+async def order_events(scope, receive, send):
+    """
+    ASGI app streaming the order events of the authenticated account, over
+    Server-Sent Events for HTTP requests or over a WebSocket.
+    """
+
+    if scope['type'] == 'websocket':
+        await websocket(scope, receive, send)
+    else:
+        await sse(scope, receive, send)
@@ -1,34 +1,65 @@
-from django.core.management import call_command
+import asyncio
+import json
+import tempfile
+import types
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from io import StringIO
+from pathlib import Path
+from unittest import mock
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError, connection, reset_queries, transaction
+from django.db.models import F
+from django.test.utils import CaptureQueriesContext
+from django.test import (
+    LiveServerTestCase,
+    SimpleTestCase,
+    override_settings,
+)
+from django.utils import timezone
 from django.contrib.auth.models import User
 from django.urls import reverse
 from rest_framework import status
-from rest_framework.test import APITestCase
-from trades.models import Order, OrderType, Stock, OrderStatus, StockShare
+from rest_framework.test import APITransactionTestCase
+from trades.models import (AuditEvent, CorporateAction, CorporateActionBatch,
+                           Order, OrderType, Stock, OrderStatus,
+                           PortfolioSnapshot, StockShare)
+from trades import actions, audit, events
+from trades.intake import (OrderIntake, OrderRejected, commit_batch,
+                           order_intake)
+from trades.portfolio import take_snapshot
+from trades.risk import snapshot_cache
+from trades.throttling import CacheBucketBackend
 from accounts.models import Account
+from strader import schema
+from strader.testing import SeededTestCase, create_user
+from strader.utils.metrics import metrics
 
 
-class OrderTestCase(APITestCase):
-
-    def setUp(self):
-        for fixture in ['orders', 'status', 'stocks']:
-            call_command('loaddata', fixture, verbosity=0)
+@override_settings(AUDIT_BUFFERED=False)
+class OrderTestCase(SeededTestCase):
 
     def set_auth_token_header(self):
         """Get auth token for api calls"""
 
-        username = 'test-user'
-        passwd = 'testuserpass1234'
-        user = User.objects.create(username=username)
-        user.set_password(passwd)
-        user.save()
+        return self.authenticate(create_user())
+
+    def test_obtain_token(self):
+        """Tokens are issued for valid credentials only"""
 
-        assert Account.objects.get(user=user) is not None
+        create_user(password='testuserpass1234')
         url = reverse('token_obtain_pair')
-        res = self.client.post(url,
-                               data={'username': username, 'password': passwd})
-        self.client.credentials(HTTP_AUTHORIZATION=
-                                f"Bearer {res.data['access']}")
-        return user
+        response = self.client.post(url, data={
+            'username': 'test-user', 'password': 'testuserpass1234'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f"Bearer {response.data['access']}")
+        response = self.client.get(reverse('orders-list'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        response = self.client.post(url, data={
+            'username': 'test-user', 'password': 'wrong'})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
 
     def test_fixtures(self):
         """Test if fixtures are loadded"""
@@ -319,3 +350,993 @@ class OrderTestCase(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
         self.assertEqual(str(response.data['details'][0]),
                          'Not enough shares.')
+
+    def test_get_orders_by_stock_name(self):
+        """Order list filtered by a stock name fragment"""
+
+        user = self.set_auth_token_header()
+        data = [
+            {
+                'stock': Stock.objects.get(code='AAPL'),
+                'order_type': OrderType.objects.get(code='BUY'),
+                'total_value': 18.75,
+                'status': OrderStatus.objects.get(code='FILLED'),
+                'quantity': 15.0,
+                'price': 1.25,
+                'account': user.account
+            },
+            {
+                'stock': Stock.objects.get(code='BRK.A'),
+                'order_type': OrderType.objects.get(code='BUY'),
+                'total_value': 18.75,
+                'status': OrderStatus.objects.get(code='FILLED'),
+                'quantity': 15.0,
+                'price': 1.25,
+                'account': user.account
+            }
+        ]
+        data_obj = [Order(**item) for item in data]
+        _ = Order.objects.bulk_create(data_obj)
+
+        url = reverse('orders-list')
+        response = self.client.get(url, data={'stock_name': 'hathaway'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 1)
+        self.assertEqual(response.data[0]['stock'], 'BRK.A')
+
+        # short fragments still behave like icontains
+        response = self.client.get(url, data={'stock_name': 'In'})
+        self.assertEqual(len(response.data), 2)
+
+        # and so do fragments matching too many stocks for an `IN` list
+        with override_settings(STOCK_NAME_FILTER_MAX_IDS=1):
+            response = self.client.get(url, data={'stock_name': 'In'})
+        self.assertEqual(len(response.data), 2)
+
+    def test_stock_search(self):
+        """Stock search by code prefix or name fragment"""
+
+        _ = self.set_auth_token_header()
+        url = reverse('stock-search-list')
+
+        response = self.client.get(url, data={'q': 'goo'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([s['code'] for s in response.data], ['GOOG'])
+
+        response = self.client.get(url, data={'q': 'berkshire hath'})
+        self.assertEqual([s['code'] for s in response.data], ['BRK.A'])
+
+        # new stocks are searchable right away
+        Stock.objects.create(code='MSFT', name='Microsoft Corporation')
+        response = self.client.get(url, data={'q': 'micro'})
+        self.assertEqual([s['code'] for s in response.data], ['MSFT'])
+
+    def test_idempotent_buy_order(self):
+        """Retried buy order with the same Idempotency-Key is placed once"""
+
+        user = self.set_auth_token_header()
+        account = user.account
+        account.available_bp = 1000
+        account.save()
+
+        data = {
+            'stock': 'GOOG',
+            'quantity': 15,
+            'price': 1.25,
+            'order_type': 'BUY'
+        }
+
+        url = reverse('orders-list')
+        first = self.client.post(url, data=data, HTTP_IDEMPOTENCY_KEY='abc-1')
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+
+        retry = self.client.post(url, data=data, HTTP_IDEMPOTENCY_KEY='abc-1')
+        self.assertEqual(retry.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry.data, first.data)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+
+        # buying power is debited only once
+        self.assertEqual(Order.objects.filter(account=account).count(), 1)
+        acc = Account.objects.get(user=user)
+        self.assertEqual(acc.available_bp, 981.25)
+
+        # the same key cannot be reused for a different order
+        data['quantity'] = 10
+        response = self.client.post(url, data=data,
+                                    HTTP_IDEMPOTENCY_KEY='abc-1')
+        self.assertEqual(response.status_code,
+                         status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+    @override_settings(THROTTLE_BUCKETS={
+        'orders.create': {'rate': '1/m', 'burst': 2}
+    })
+    def test_order_throttle(self):
+        """Order placement is throttled per account"""
+
+        user = self.set_auth_token_header()
+        account = user.account
+        account.available_bp = 1000
+        account.save()
+
+        data = {
+            'stock': 'GOOG',
+            'quantity': 1,
+            'price': 1.25,
+            'order_type': 'BUY'
+        }
+
+        url = reverse('orders-list')
+        for _ in range(2):
+            response = self.client.post(url, data=data)
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        response = self.client.post(url, data=data)
+        self.assertEqual(response.status_code,
+                         status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertIn('Retry-After', response)
+
+        # other endpoints have their own bucket
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_cache_bucket_backend(self):
+        """Cache buckets are consumed under a lock, or without it on timeout"""
+
+        with self.assertLogs('trades.throttling', 'WARNING'):
+            backend = CacheBucketBackend(lock_wait=0)
+        self.addCleanup(backend._cache.clear)
+        self.assertEqual(backend.consume('test', 1, 2), 0)
+        self.assertEqual(backend.consume('test', 1, 2), 0)
+        self.assertGreater(backend.consume('test', 1, 2), 0)
+        self.assertIsNone(backend._cache.get('throttle:test:lock'))
+
+        backend._cache.add('throttle:other:lock', 1)
+        self.assertEqual(backend.consume('other', 1, 1), 0)
+        self.assertGreater(backend.consume('other', 1, 1), 0)
+
+    @override_settings(ADMISSION_MAX_INFLIGHT=0)
+    def test_admission_control(self):
+        """Requests are shed once the in-flight limit is reached"""
+
+        response = self.client.get(reverse('orders-list'))
+        self.assertEqual(response.status_code,
+                         status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response['Retry-After'], '1')
+
+    def test_recompute_portfolios(self):
+        """Shares and buying power are rebuilt from order history"""
+
+        user = self.set_auth_token_header()
+        account = user.account
+        account.alloted_bp = 100
+        account.available_bp = 100
+        account.save()
+        StockShare.objects.create(account=account, quantity=99,
+                                  total_value=99,
+                                  stock=Stock.objects.get(code='GOOG'))
+
+        # bulk_create skips the balance signal
+        data = [
+            {
+                'stock': Stock.objects.get(code=code),
+                'order_type': OrderType.objects.get(code=order_type),
+                'total_value': total_value,
+                'status': OrderStatus.objects.get(code=order_status),
+                'quantity': quantity,
+                'price': 1.25,
+                'account': account
+            }
+            for code, order_type, order_status, quantity, total_value in [
+                ('GOOG', 'BUY', 'FILLED', 15.0, 18.75),
+                ('GOOG', 'SELL', 'FILLED', 5.0, 6.25),
+                ('AAPL', 'BUY', 'FILLED', 4.0, 5.0),
+                ('AAPL', 'BUY', 'FAILED', 4.0, 5.0),
+            ]
+        ]
+        _ = Order.objects.bulk_create([Order(**item) for item in data])
+
+        out = StringIO()
+        call_command('recompute_portfolios', '--dry-run', '--workers', '1',
+                     stdout=out, stderr=StringIO())
+        self.assertIn('Would fix 2 stock shares and 1 account balances',
+                      out.getvalue())
+        self.assertEqual(Account.objects.get(pk=account.pk).available_bp, 100)
+
+        call_command('recompute_portfolios', '--workers', '1',
+                     stdout=StringIO(), stderr=StringIO())
+        self.assertEqual(Account.objects.get(pk=account.pk).available_bp,
+                         82.5)
+        shares = {share.stock.code: (share.quantity, share.total_value)
+                  for share in StockShare.objects.filter(account=account)}
+        self.assertEqual(shares, {'GOOG': (10.0, 12.5), 'AAPL': (4.0, 5.0)})
+
+    def test_portfolio_history(self):
+        """Positions at a point in time and over a range"""
+
+        user = self.set_auth_token_header()
+        account = user.account
+        data = [
+            ('GOOG', 'BUY', 10.0, 10.0, 1),
+            ('AAPL', 'BUY', 5.0, 5.0, 5),
+            ('GOOG', 'SELL', 4.0, 4.0, 10),
+        ]
+        for code, order_type, quantity, total_value, day in data:
+            order = Order.objects.create(
+                stock=Stock.objects.get(code=code),
+                order_type=OrderType.objects.get(code=order_type),
+                status=OrderStatus.objects.get(code='FILLED'),
+                quantity=quantity, price=1.0, total_value=total_value,
+                account=account)
+            date = timezone.make_aware(datetime(2020, 1, day, 12))
+            Order.objects.filter(pk=order.pk).update(date=date)
+
+        until = timezone.make_aware(datetime(2020, 1, 6))
+        snapshot = take_snapshot(account.pk, until=until)
+        self.assertEqual({stock: position[:2] for stock, position
+                          in snapshot.positions.items()},
+                         {'1': [5.0, 5.0], '2': [10.0, 10.0]})
+
+        url = reverse('portfolio-history-list')
+        response = self.client.get(url, data={'at': '2020-01-07'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['total_value'], 15.0)
+
+        response = self.client.get(url, data={'at': '2020-01-10'})
+        self.assertEqual(response.data['positions'], [
+            {'stock': 'AAPL', 'quantity': 5.0, 'total_value': 5.0},
+            {'stock': 'GOOG', 'quantity': 6.0, 'total_value': 6.0},
+        ])
+
+        # Django 4 parses a date alone as a datetime at midnight
+        with mock.patch('trades.views.parse_datetime',
+                        side_effect=datetime.fromisoformat):
+            response = self.client.get(url, data={'at': '2020-01-10'})
+            self.assertEqual(response.data['total_value'], 11.0)
+            response = self.client.get(url,
+                                       data={'at': '2020-01-10T11:00:00'})
+            self.assertEqual(response.data['total_value'], 15.0)
+
+        response = self.client.get(url, data={'start': '2020-01-04',
+                                              'end': '2020-01-06'})
+        self.assertEqual([point['total_value'] for point in response.data],
+                         [10.0, 15.0, 15.0])
+
+        response = self.client.get(url, data={'start': '2020-01-04'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        for at in ('2020-02-31', '2020-01-10T25:00:00', 'tomorrow'):
+            response = self.client.get(url, data={'at': at})
+            self.assertEqual(response.status_code,
+                             status.HTTP_400_BAD_REQUEST)
+            self.assertEqual(str(response.data['details']), 'Invalid `at`.')
+
+    def place_orders(self, orders):
+        """Place `(order_type, quantity, price)` GOOG orders through the API"""
+
+        url = reverse('orders-list')
+        for order_type, quantity, price in orders:
+            data = {
+                'stock': 'GOOG',
+                'quantity': quantity,
+                'price': price,
+                'order_type': order_type
+            }
+            response = self.client.post(url, data=data)
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_fifo_cost_basis(self):
+        """Sales are valued at the cost of the oldest lots first"""
+
+        user = self.set_auth_token_header()
+        account = user.account
+        account.available_bp = 1000
+        account.save()
+
+        self.place_orders([('BUY', 10, 1), ('BUY', 10, 2), ('SELL', 15, 3)])
+
+        sale = Order.objects.get(account=account, order_type__code='SELL')
+        self.assertEqual(sale.realized_pnl, 45 - (10 * 1 + 5 * 2))
+
+        url = reverse('shares-list', args=['all'])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        share = response.data[0]
+        self.assertEqual(share['quantity'], 5.0)
+        self.assertEqual(share['total_value'], 10.0)
+        self.assertEqual(share['average_cost'], 2.0)
+        self.assertEqual(share['realized_pnl'], 25.0)
+        self.assertEqual(share['unrealized_pnl'], 5 * 3 - 10.0)
+        self.assertNotIn('lots', share)
+
+        # the fully sold lot is deleted, the remaining one is a single row
+        stored = StockShare.objects.get(account=account)
+        self.assertEqual(stored.sold_qty, 15.0)
+        self.assertEqual(list(stored.fifo_lots.values_list(
+            'qty_sum', 'cost_sum')), [(20.0, 30.0)])
+
+    @override_settings(COST_BASIS_METHOD='AVERAGE')
+    def test_average_cost_basis(self):
+        """Sales are valued at the average cost"""
+
+        user = self.set_auth_token_header()
+        account = user.account
+        account.available_bp = 1000
+        account.save()
+
+        self.place_orders([('BUY', 10, 1), ('BUY', 10, 2), ('SELL', 15, 3)])
+
+        shares = StockShare.objects.get(account=account)
+        self.assertEqual(shares.quantity, 5.0)
+        self.assertEqual(shares.total_value, 7.5)
+        self.assertEqual(shares.realized_pnl, 45 - 22.5)
+
+    @override_settings(RISK_MAX_ORDER_VALUE=500, RISK_MAX_POSITION_SHARE=0.5,
+                       RISK_STOCK_LIMITS={'GOOG': {'max_quantity': 100}},
+                       RISK_MAX_DAILY_LOSS=10)
+    def test_risk_checks(self):
+        """Orders breaking a risk limit are rejected with the check's error"""
+
+        user = self.set_auth_token_header()
+        account = user.account
+        account.available_bp = 1000
+        account.save()
+
+        url = reverse('orders-list')
+        orders = [
+            ('BUY', 10, 60, 'Order value exceeds the limit of 500.'),
+            ('BUY', 40, 10, None),
+            ('BUY', 20, 10,
+             'Position in GOOG would exceed 50% of the account.'),
+            ('BUY', 70, 1,
+             'Position exceeds the limit of 100 shares for GOOG.'),
+            ('SELL', 40, 9.5, None),
+            ('BUY', 1, 1, 'Daily loss limit reached.'),
+        ]
+        for order_type, quantity, price, error in orders:
+            data = {
+                'stock': 'GOOG',
+                'quantity': quantity,
+                'price': price,
+                'order_type': order_type
+            }
+            response = self.client.post(url, data=data)
+            if error is None:
+                self.assertEqual(response.status_code,
+                                 status.HTTP_201_CREATED)
+            else:
+                self.assertEqual(response.status_code,
+                                 status.HTTP_400_BAD_REQUEST)
+                self.assertEqual(str(response.data['details'][0]), error)
+
+        counters = metrics.snapshot()
+        self.assertGreaterEqual(counters['risk.daily_loss.rejected'], 1)
+        self.assertIn('risk.buying_power.us', counters)
+
+    def test_admin_changelists(self):
+        """Admin changelists don't query per row nor count huge tables"""
+
+        user = self.set_auth_token_header()
+        account = user.account
+        account.available_bp = 1000
+        account.save()
+        self.place_orders([('BUY', 10, 1), ('BUY', 10, 2)])
+        admin = User.objects.create_superuser('admin', password='admin')
+        self.client.force_login(admin)
+
+        url = reverse('admin:trades_order_changelist')
+
+        def count_queries():
+            # the request_started signal clears the queries log
+            reset_queries()
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url, {'stock': 'goog'})
+            return response, len(queries)
+
+        response, queries = count_queries()
+        self.assertEqual(response.context['cl'].result_count, 2)
+        self.place_orders([('SELL', 5, 3)] * 3)
+        response, more_queries = count_queries()
+        self.assertEqual(response.context['cl'].result_count, 5)
+        self.assertEqual(queries, more_queries)
+
+        with override_settings(ADMIN_EXACT_COUNT_LIMIT=2):
+            response = self.client.get(url)
+        self.assertEqual(response.context['cl'].result_count, 2)
+
+        take_snapshot(account.pk)
+        version = Account.objects.get(pk=account.pk).version
+        selected = Order.objects.values_list('pk', flat=True)
+        with override_settings(ADMIN_BATCH_SIZE=2):
+            response = self.client.post(url, {
+                'action': 'mark_failed', 'select_across': 1, 'index': 0,
+                '_selected_action': selected}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_302_FOUND)
+        self.assertFalse(Order.objects.exclude(status__code='FAILED')
+                         .exists())
+        # balances, shares, versions and snapshots follow the new status
+        account.refresh_from_db()
+        self.assertEqual(account.available_bp, account.alloted_bp)
+        self.assertGreater(account.version, version)
+        self.assertEqual(StockShare.objects.get(account=account).quantity, 0)
+        self.assertFalse(account.snapshots.exists())
+
+        response = self.client.get(
+            reverse('admin:trades_stockshare_changelist'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_corporate_actions(self):
+        """Splits rescale positions and orders, renames keep the history"""
+
+        user = self.set_auth_token_header()
+        account = user.account
+        account.available_bp = 1000
+        account.save()
+        self.place_orders([('BUY', 10, 2), ('BUY', 10, 4), ('SELL', 5, 3)])
+        take_snapshot(account.pk)
+        version = Account.objects.get(pk=account.pk).version
+
+        def run(*args):
+            call_command('corporate_action', *args, workers=1, grace=0,
+                         stdout=StringIO(), stderr=StringIO())
+
+        run('split', 'GOOG', '--ratio', '2:1')
+        share = StockShare.objects.get(account=account)
+        self.assertEqual((share.quantity, share.total_value), (30.0, 50.0))
+        self.assertEqual(sorted(Order.objects.values_list('quantity',
+                                                          'price')),
+                         [(10.0, 1.5), (20.0, 1.0), (20.0, 2.0)])
+        self.assertGreater(Account.objects.get(pk=account.pk).version,
+                           version)
+        self.assertFalse(Stock.objects.get(code='GOOG').halted)
+        snapshot = PortfolioSnapshot.objects.get(account=account)
+        self.assertEqual(snapshot.positions[str(share.stock_id)][0], 30.0)
+        *_, payload = audit.history(
+            account.pk, kinds=[AuditEvent.CORPORATE_ACTION])[0]
+        self.assertEqual(payload['quantity'], [15.0, 30.0])
+
+        # the rest of the first lot was bought at 2, 1 after the split
+        self.authenticate(user)
+        self.place_orders([('SELL', 10, 3)])
+        self.assertEqual(Order.objects.latest('id').realized_pnl, 20.0)
+        out = StringIO()
+        call_command('recompute_portfolios', '--dry-run', '--workers', '1',
+                     stdout=out, stderr=StringIO())
+        self.assertIn('Would fix 0 stock shares', out.getvalue())
+
+        # batches applied before an interruption aren't applied again
+        action = actions.create_action(Stock.objects.get(code='GOOG'),
+                                       CorporateAction.REVERSE_SPLIT, 0.5)
+        CorporateActionBatch.objects.create(
+            action=action, first_account_id=account.pk,
+            last_account_id=account.pk)
+        run('--resume', str(action.pk))
+        self.assertEqual(StockShare.objects.get(account=account).quantity,
+                         20.0)
+        action.refresh_from_db()
+        self.assertIsNotNone(action.applied)
+
+        Stock.objects.filter(code='GOOG').update(halted=True)
+        response = self.client.post(reverse('orders-list'), data={
+            'stock': 'GOOG', 'quantity': 1, 'price': 1,
+            'order_type': 'BUY'})
+        self.assertEqual(str(response.data['details'][0]),
+                         'Trading in GOOG is halted.')
+
+        # orders validated before the halt are rejected under the lock
+        order = Order(account=account, stock=Stock.objects.get(code='GOOG'),
+                      order_type=OrderType.objects.get(code='BUY'),
+                      status=OrderStatus.objects.get(code='FILLED'),
+                      quantity=1, price=1, total_value=1)
+        self.assertEqual(commit_batch([order])[0],
+                         ['Trading in GOOG is halted.'])
+        orders = Order.objects.count()
+        with self.assertRaises(OrderRejected):
+            with transaction.atomic():
+                Order.objects.create(
+                    account=account, stock=order.stock,
+                    order_type=order.order_type, status=order.status,
+                    quantity=1, price=1, total_value=1)
+        self.assertEqual(Order.objects.count(), orders)
+
+        # codes are looked up with get(), they can't be renamed onto
+        with self.assertRaisesMessage(CommandError,
+                                      'Stock code AAPL is taken.'):
+            run('rename', 'GOOG', '--code', 'AAPL')
+        self.assertEqual(Stock.objects.filter(code='AAPL').count(), 1)
+        run('rename', 'GOOG', '--code', 'GOOGL')
+        response = self.client.get(reverse('orders-list'),
+                                   data={'stock': 'GOOGL'})
+        self.assertEqual(len(response.data), 4)
+
+    def test_resume_corporate_action(self):
+        """Resuming with another batch size skips the applied accounts"""
+
+        stock = Stock.objects.get(code='GOOG')
+        accounts = []
+        for i in range(3):
+            account = create_user(f'holder-{i}').account
+            StockShare.objects.create(account=account, stock=stock,
+                                      quantity=10, total_value=10)
+            accounts.append(account.pk)
+        action = actions.create_action(stock, CorporateAction.SPLIT, 2.0)
+        # interrupted after its first batch of two accounts
+        actions.split_batch(action.pk, accounts[:2])
+        self.assertEqual(actions.split_batch(action.pk, accounts[1:]), None)
+
+        call_command('corporate_action', resume=action.pk, batch_size=1,
+                     workers=1, grace=0, stdout=StringIO(),
+                     stderr=StringIO())
+        self.assertEqual(list(StockShare.objects.filter(stock=stock)
+                              .order_by('account_id')
+                              .values_list('quantity', flat=True)),
+                         [20.0, 20.0, 20.0])
+
+        for ratio in ('2:0', '0:1', 'x'):
+            with self.assertRaises(ValueError):
+                actions.parse_ratio(ratio)
+
+
+class OrderEventsTestCase(SimpleTestCase):
+
+    def test_publish_and_resume(self):
+        """Subscribers get their account's events and can resume"""
+
+        async def run():
+            loop = asyncio.get_running_loop()
+            broker = events.EventBroker(buffer_size=3, queue_size=10)
+            backend = events.InProcessBackend(broker)
+
+            sub = broker.subscribe(1, loop)
+            backend.publish(2, events.ORDER_CREATED, {'id': 1})
+            backend.publish(1, events.ORDER_CREATED, {'id': 2})
+            item = await asyncio.wait_for(sub.get(), 1)
+            self.assertEqual(item, (1, events.ORDER_CREATED, {'id': 2}))
+            sub.close()
+
+            for pk in range(3, 6):
+                backend.publish(1, events.ORDER_FILLED, {'id': pk})
+
+            # resume after offset 2
+            sub = broker.subscribe(1, loop, last_offset=2)
+            offsets = [(await sub.get())[0] for _ in range(2)]
+            self.assertEqual(offsets, [3, 4])
+            sub.close()
+
+            # offset 1 is no longer buffered
+            sub = broker.subscribe(1, loop, last_offset=0)
+            self.assertEqual(await sub.get(), (4, events.RESET, {}))
+            sub.close()
+            self.assertEqual(broker.subscriber_count(), 0)
+
+        asyncio.run(run())
+
+    def test_buffered_accounts(self):
+        """Only the accounts with recent events or subscribers are buffered"""
+
+        async def run():
+            loop = asyncio.get_running_loop()
+            broker = events.EventBroker(max_accounts=2)
+            backend = events.InProcessBackend(broker)
+
+            sub = broker.subscribe(1, loop)
+            for account_id in (1, 2, 3, 4):
+                backend.publish(account_id, events.ORDER_CREATED, {})
+            self.assertEqual(list(broker._streams), [1, 4])
+            sub.close()
+
+            # offsets of an evicted account go on after the evicted ones
+            backend.publish(2, events.ORDER_CREATED, {})
+            self.assertEqual(list(broker._streams), [4, 2])
+            sub = broker.subscribe(2, loop, last_offset=1)
+            self.assertEqual(await sub.get(), (2, events.ORDER_CREATED, {}))
+            sub.close()
+            sub = broker.subscribe(2, loop, last_offset=0)
+            self.assertEqual(await sub.get(), (2, events.RESET, {}))
+            sub.close()
+
+        asyncio.run(run())
+
+    def test_slow_subscriber(self):
+        """Subscribers that fall behind are disconnected"""
+
+        async def run():
+            loop = asyncio.get_running_loop()
+            broker = events.EventBroker(queue_size=2)
+            backend = events.InProcessBackend(broker)
+
+            sub = broker.subscribe(1, loop)
+            for pk in range(3):
+                backend.publish(1, events.ORDER_CREATED, {'id': pk})
+            await asyncio.sleep(0)
+
+            self.assertTrue(sub.closed)
+            self.assertEqual((await sub.get())[0], 2)
+            self.assertIsNone(await sub.get())
+            self.assertEqual(broker.subscriber_count(), 0)
+
+        asyncio.run(run())
+
+    def test_closed_loop(self):
+        """Subscribers whose event loop is closed are dropped on publish"""
+
+        loop = asyncio.new_event_loop()
+        broker = events.EventBroker()
+        broker.subscribe(1, loop)
+        loop.close()
+        events.InProcessBackend(broker).publish(1, events.ORDER_CREATED, {})
+        self.assertEqual(broker.subscriber_count(), 0)
+
+    def test_redis_reconnect(self):
+        """The Redis listener reconnects and resets the subscribers"""
+
+        redis = types.SimpleNamespace(RedisError=type('RedisError',
+                                                      (Exception, ), {}))
+        backend = events.RedisBackend.__new__(events.RedisBackend)
+        backend.broker = mock.Mock()
+        backend.client = mock.Mock()
+        pubsub = backend.client.pubsub.return_value
+
+        def messages():
+            yield {'data': '[1, 5, "order-created", {}]'}
+            raise SystemExit
+
+        pubsub.listen.side_effect = [redis.RedisError(), messages()]
+        with mock.patch.dict('sys.modules', redis=redis), \
+                mock.patch('trades.events.time.sleep') as sleep, \
+                self.assertLogs('trades.events', 'WARNING'), \
+                self.assertRaises(SystemExit):
+            backend.listen()
+        sleep.assert_called_once_with(1)
+        backend.broker.reset_subscribers.assert_called_once_with()
+        backend.broker.deliver.assert_called_once_with(
+            1, 5, events.ORDER_CREATED, {})
+
+
+class SchemaTestCase(SimpleTestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = Path(directory.name) / 'openapi.json'
+        settings = override_settings(OPENAPI_SCHEMA_PATH=self.path)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        schema.schema_cache.clear()
+        self.addCleanup(schema.schema_cache.clear)
+
+    def test_cached_schema(self):
+        """The schema is rendered once and revalidated with its ETag"""
+
+        with mock.patch('strader.schema.render_schema',
+                        wraps=schema.render_schema) as render:
+            response = self.client.get(reverse('schema-json'))
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertIn('/trade/orders/', response.json()['paths'])
+            etag = response['ETag']
+
+            response = self.client.get(reverse('schema-json'),
+                                       HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code,
+                             status.HTTP_304_NOT_MODIFIED)
+
+            response = self.client.get(reverse('schema-swagger-ui'),
+                                       {'format': 'openapi'})
+            self.assertEqual(response['ETag'], etag)
+
+            response = self.client.get(reverse('schema-redoc'))
+            self.assertContains(response, reverse('schema-json'))
+        self.assertEqual(render.call_count, 1)
+
+    def test_build_schema(self):
+        """Built schemas are served while the sources are unchanged"""
+
+        call_command('build_schema', stdout=StringIO())
+        version = schema.code_version()
+        self.assertIn(version, self.path.read_text())
+
+        with mock.patch('strader.schema.render_schema') as render:
+            response = self.client.get(reverse('schema-json'))
+            self.assertEqual(response.json()['x-code-version'], version)
+            render.assert_not_called()
+
+    def test_lean_worker_schema(self):
+        """Workers without the docs never render, they serve what was built"""
+
+        with mock.patch('strader.schema.apps.is_installed',
+                        return_value=False), \
+                mock.patch('strader.schema.render_schema') as render:
+            schema.code_version.cache_clear()
+            for _ in range(2):
+                response = self.client.get(reverse('schema-json'))
+                self.assertEqual(response.status_code,
+                                 status.HTTP_404_NOT_FOUND)
+            # the sources are hashed once, not on every 404
+            self.assertEqual(schema.code_version.cache_info().misses, 1)
+
+            self.path.write_text('{"x-code-version": "stale"}')
+            with self.assertLogs('strader.schema', 'WARNING'):
+                response = self.client.get(reverse('schema-json'))
+            self.assertEqual(response.json()['x-code-version'], 'stale')
+            render.assert_not_called()
+
+
+@override_settings(ORDER_INTAKE_BATCHED=True, AUDIT_BUFFERED=False)
+class OrderIntakeTestCase(APITransactionTestCase):
+    fixtures = ['orders', 'status', 'stocks']
+
+    def setUp(self):
+        self.user = User.objects.create(username='test-user')
+        self.account = self.user.account
+        self.account.available_bp = 1000
+        self.account.save()
+        self.client.force_authenticate(self.user)
+        self.addCleanup(order_intake.stop)
+        snapshot_cache.clear()
+
+    def test_batched_orders(self):
+        """Orders committed in batches update shares like direct ones"""
+
+        url = reverse('orders-list')
+        for order_type, quantity, price in [('BUY', 10, 1), ('BUY', 10, 2),
+                                            ('SELL', 15, 3)]:
+            response = self.client.post(url, data={
+                'stock': 'GOOG', 'quantity': quantity, 'price': price,
+                'order_type': order_type})
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            self.assertTrue(Order.objects.filter(pk=response.data['id'])
+                            .exists())
+
+        response = self.client.post(url, data={
+            'stock': 'GOOG', 'quantity': 10, 'price': 3,
+            'order_type': 'SELL'})
+        self.assertEqual(str(response.data['details'][0]),
+                         'Not enough shares.')
+
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.available_bp, 1000 - 30 + 45)
+        shares = StockShare.objects.get(account=self.account)
+        self.assertEqual(shares.quantity, 5.0)
+        self.assertEqual(shares.total_value, 10.0)
+        self.assertEqual(shares.realized_pnl, 45 - 20)
+        self.assertEqual(Order.objects.get(order_type__code='SELL')
+                         .realized_pnl, 25)
+
+    def test_insert_without_returned_ids(self):
+        """Backends without returned ids nor a single writer insert rows
+        one by one"""
+
+        stock = Stock.objects.get(code='GOOG')
+        buy = OrderType.objects.get(code='BUY')
+        filled = OrderStatus.objects.get(code='FILLED')
+        orders = [Order(account=self.account, stock=stock, order_type=buy,
+                        status=filled, quantity=quantity, price=1,
+                        total_value=quantity) for quantity in (1, 2, 3)]
+        with mock.patch.object(connection, 'vendor', 'mysql'):
+            commit_batch(orders)
+        self.assertEqual({order.pk: order.quantity for order in orders},
+                         dict(Order.objects.values_list('pk', 'quantity')))
+
+    @override_settings(ORDER_INTAKE_TIMEOUT=0.01)
+    def test_stalled_intake(self):
+        """Orders are withdrawn from a stalled intake and saved directly"""
+
+        with mock.patch.object(OrderIntake, 'start'):
+            response = self.client.post(reverse('orders-list'), data={
+                'stock': 'GOOG', 'quantity': 1, 'price': 1,
+                'order_type': 'BUY'})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        # the withdrawn order is skipped once the intake runs again
+        batch = order_intake.next_batch()
+        order_intake.commit(batch)
+        self.assertTrue(batch[0][1].cancelled())
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_concurrent_batch(self):
+        """Orders of one account sharing a batch are checked in order"""
+
+        intake = OrderIntake(max_batch=5, max_delay=1)
+        self.addCleanup(intake.stop)
+        stock = Stock.objects.get(code='GOOG')
+        buy = OrderType.objects.get(code='BUY')
+        filled = OrderStatus.objects.get(code='FILLED')
+
+        def submit(_):
+            order = Order(account=self.account, stock=stock, order_type=buy,
+                          status=filled, quantity=100, price=3,
+                          total_value=300)
+            try:
+                return intake.submit(order).pk
+            except OrderRejected as exc:
+                return str(exc)
+
+        batches = metrics.snapshot().get('intake.batches', 0)
+        with ThreadPoolExecutor(5) as pool:
+            results = list(pool.map(submit, range(5)))
+
+        self.assertEqual(metrics.snapshot()['intake.batches'], batches + 1)
+        self.assertEqual(results.count('Not enough buying power.'), 2)
+        ids = [result for result in results if isinstance(result, int)]
+        self.assertEqual(sorted(ids), sorted(Order.objects.values_list(
+            'pk', flat=True)))
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.available_bp, 100)
+        self.assertEqual(StockShare.objects.get().quantity, 300)
+
+    def test_concurrent_balance_update(self):
+        """Orders apply to the locked account row, not a stale copy"""
+
+        stale = Account.objects.get(pk=self.account.pk)
+        # another worker placed an order meanwhile
+        Account.objects.filter(pk=self.account.pk).update(
+            available_bp=500, version=F('version') + 1)
+        Order.objects.create(
+            account=stale, stock=Stock.objects.get(code='GOOG'),
+            order_type=OrderType.objects.get(code='BUY'),
+            status=OrderStatus.objects.get(code='FILLED'), quantity=10,
+            price=1, total_value=10)
+
+        account = Account.objects.get(pk=self.account.pk)
+        self.assertEqual(account.available_bp, 490)
+        self.assertEqual(account.version, self.account.version + 2)
+        self.assertEqual((stale.available_bp, stale.version),
+                         (490, account.version))
+
+    @override_settings(ORDER_INTAKE_BATCHED=False)
+    def test_snapshot_cache(self):
+        """Validation runs from the cached snapshot until the version moves"""
+
+        url = reverse('orders-list')
+        data = {'stock': 'GOOG', 'quantity': 10, 'price': 20,
+                'order_type': 'BUY'}
+
+        def misses():
+            return metrics.snapshot().get('risk.snapshot.misses', 0)
+
+        self.client.post(url, data=data)
+        before = misses()
+        for _ in range(3):
+            response = self.client.post(url, data=data)
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(misses(), before)
+
+        # a write from another worker bumps the version
+        Account.objects.filter(pk=self.account.pk).update(
+            available_bp=100, version=F('version') + 1)
+        # real requests load the user and its account row each time
+        self.client.force_authenticate(User.objects.get(pk=self.user.pk))
+        response = self.client.post(url, data=data)
+        self.assertEqual(str(response.data['details'][0]),
+                         'Not enough buying power.')
+        self.assertEqual(misses(), before + 1)
+
+
+@override_settings(AUDIT_BUFFERED=False)
+class AuditLogTestCase(APITransactionTestCase):
+    fixtures = ['orders', 'status', 'stocks']
+
+    def setUp(self):
+        self.user = User.objects.create(username='test-user')
+        self.account = self.user.account
+        self.account.available_bp = 1000
+        self.account.save()
+        snapshot_cache.clear()
+
+    def test_order_and_admin_events(self):
+        """Orders, balance corrections and admin changes are audited"""
+
+        self.client.force_authenticate(self.user)
+        response = self.client.post(reverse('orders-list'), data={
+            'stock': 'GOOG', 'quantity': 10, 'price': 2,
+            'order_type': 'BUY'})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        admin = User.objects.create_superuser('admin', password='admin')
+        self.client.force_login(admin)
+        self.client.post(reverse('admin:accounts_account_change',
+                                 args=[self.account.pk]),
+                         {'user': self.user.pk, 'available_bp': 5000,
+                          'alloted_bp': 1000}, format='multipart')
+        call_command('recompute_portfolios', workers=1, stdout=StringIO(),
+                     stderr=StringIO())
+
+        events = audit.history(self.account.pk)
+        self.assertEqual([kind for _, kind, _, _, _ in events],
+                         [AuditEvent.ORDER, AuditEvent.ADMIN,
+                          AuditEvent.BALANCE])
+        order, change, correction = [payload for *_, payload in events]
+        self.assertEqual(order['order'], response.data['id'])
+        self.assertEqual(order['available_bp'], [1000, 980])
+        self.assertEqual(events[1][3], admin.pk)
+        self.assertEqual(change['fields']['available_bp'], 5000)
+        self.assertEqual(correction, {'available_bp': [5000, 980],
+                                      'reason': 'recompute'})
+
+        self.assertEqual(len(audit.history(self.account.pk,
+                                           kinds=[AuditEvent.ORDER])), 1)
+        self.assertEqual(audit.history(self.account.pk,
+                                       after_id=events[-1][0]), [])
+
+        out = StringIO()
+        call_command('audit_log', self.account.pk, kind=['order'],
+                     stdout=out)
+        self.assertEqual(json.loads(out.getvalue())['stock'], 'GOOG')
+
+    @override_settings(AUDIT_BUFFERED=True, AUDIT_FLUSH_INTERVAL=60)
+    def test_buffered_events(self):
+        """Buffered events are only written when flushed"""
+
+        audit.record_balance(self.account.pk, 1, 2, 'test')
+        self.assertEqual(audit.history(self.account.pk), [])
+        self.assertEqual(audit.audit_log.flush(), 1)
+        self.assertEqual(len(audit.history(self.account.pk)), 1)
+
+    @override_settings(AUDIT_BUFFERED=True, AUDIT_FLUSH_INTERVAL=60,
+                       AUDIT_MAX_BUFFER=2)
+    def test_audit_buffer_bound(self):
+        """Failed flushes keep the newest events up to the bound"""
+
+        def fail(events):
+            # an event recorded while the insert hangs
+            audit.record_balance(self.account.pk, 2, 0, 'test')
+            raise DatabaseError
+
+        for before in range(2):
+            audit.record_balance(self.account.pk, before, 0, 'test')
+        with mock.patch.object(audit.audit_log, 'write', side_effect=fail), \
+                self.assertLogs('trades.audit', 'ERROR'):
+            with self.assertRaises(DatabaseError):
+                audit.audit_log.flush()
+        self.assertEqual(audit.audit_log.flush(), 2)
+        self.assertEqual([payload['available_bp'][0] for *_, payload in
+                          audit.history(self.account.pk)], [1, 2])
+
+
+@override_settings(AUDIT_BUFFERED=False)
+class LoadTestCase(LiveServerTestCase):
+
+    def test_load_test(self):
+        """Virtual users log in and hit every endpoint of the mix"""
+
+        call_command('loaddata', 'orders', 'status', 'stocks', verbosity=0)
+        out = StringIO()
+        call_command('load_test', url=self.live_server_url, users=5,
+                     duration=1, ramp=0.2, think=0.05, create_users=True,
+                     connections=4, seed=1, stdout=out, stderr=StringIO())
+
+        report = out.getvalue().splitlines()
+        self.assertEqual(sorted(line.split()[0] for line in report[1:]),
+                         ['order', 'orders', 'shares', 'summary', 'token'])
+        token = next(line for line in report if line.startswith('token'))
+        self.assertEqual(token.split()[1], '5')
+        self.assertIn('200:5', token)
+
+
+class QueryPlanTestCase(SeededTestCase):
+
+    def test_golden_plans(self):
+        """Trade endpoints match the committed query plans"""
+
+        out = StringIO()
+        call_command('query_plans', stdout=out, stderr=StringIO())
+        self.assertIn('No query plan regressions.', out.getvalue())
+
+    def test_regressions(self):
+        """More queries and new full scans are reported"""
+
+        golden = Path(tempfile.mkdtemp()) / 'plans.json'
+        options = {'golden': golden, 'accounts': 5, 'orders': 10,
+                   'stocks': 10, 'stdout': StringIO()}
+        call_command('query_plans', update=True, **options)
+        plans = json.loads(golden.read_text())
+        self.assertEqual(plans['orders']['queries'], 3)
+        self.assertIn('trades_order_type', plans['summary']['full_scans'])
+
+        plans['orders']['queries'] = 2
+        plans['summary']['full_scans'].remove('trades_order_type')
+        golden.write_text(json.dumps(plans))
+        with self.assertRaisesMessage(CommandError, 'orders: 2 -> 3 queries'):
+            call_command('query_plans', **options)
+        with self.assertRaisesMessage(
+                CommandError, 'summary: new full scan of trades_order_type'):
+            call_command('query_plans', **options)
@@ -0,0 +1,152 @@
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.utils.module_loading import import_string
+from rest_framework.throttling import BaseThrottle
+from strader.utils.metrics import metrics
+
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+logger = logging.getLogger(__name__)
+
+
+def parse_bucket(bucket):
+    """
+    Parse a bucket config like `{'rate': '10/s', 'burst': 20}`.
+
+    Return:
+        tuple of (tokens per second, bucket capacity)
+    """
+
+    num, period = bucket['rate'].split('/')
+    rate = int(num) / PERIODS[period[0]]
+    return rate, bucket.get('burst', int(num))
+
+
+class LocalBucketBackend:
+    """Token buckets kept in this process, bounded by LRU eviction"""
+
+    def __init__(self, max_buckets=100000):
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()
+        self._max_buckets = max_buckets
+
+    def consume(self, key, rate, capacity):
+        """
+        Take one token from the bucket.
+
+        Return:
+            0 if a token was taken, else seconds until one is available
+        """
+
+        now = time.monotonic()
+        with self._lock:
+            tokens, stamp = self._buckets.pop(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - stamp) * rate)
+            wait = 0 if tokens >= 1 else (1 - tokens) / rate
+            if not wait:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self._max_buckets:
+                self._buckets.popitem(last=False)
+        return wait
+
+    def reset(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+class CacheBucketBackend:
+    """
+    Token buckets shared between workers through a Django cache, using
+    GCRA so each bucket is a single timestamp.
+
+    The cache must be shared by the workers (Redis, Memcached or the
+    database cache): `LocMemCache` is per process and only gives every
+    worker its own buckets. The timestamp is read and written under a lock
+    taken with `cache.add`, which is atomic on the shared backends. A
+    request that can't get the lock within `lock_wait` seconds goes on
+    without it, so under heavy contention on one key a few requests can be
+    admitted over the limit.
+    """
+
+    def __init__(self, alias='default', lock_wait=0.05):
+        self._cache = caches[alias]
+        self._lock_wait = lock_wait
+        if isinstance(self._cache, LocMemCache):
+            logger.warning('Throttle buckets in LocMemCache are not shared '
+                           'between workers.')
+
+    def consume(self, key, rate, capacity):
+        key = f'throttle:{key}'
+        lock = f'{key}:lock'
+        deadline = time.monotonic() + self._lock_wait
+        while not self._cache.add(lock, 1, timeout=1):
+            if time.monotonic() > deadline:
+                metrics.incr('throttle.lock_timeout')
+                return self._consume(key, rate, capacity)
+            time.sleep(0.001)
+        try:
+            return self._consume(key, rate, capacity)
+        finally:
+            self._cache.delete(lock)
+
+    def _consume(self, key, rate, capacity):
+        now = time.time()
+        interval = 1 / rate
+        tat = max(self._cache.get(key, now), now) + interval
+        wait = tat - capacity * interval - now
+        if wait > 0:
+            return wait
+        self._cache.set(key, tat, timeout=math.ceil(tat - now) + 1)
+        return 0
+
+
+_backend = None
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        path = getattr(settings, 'THROTTLE_BACKEND',
+                       'trades.throttling.LocalBucketBackend')
+        _backend = import_string(path)()
+    return _backend
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """
+    Token bucket throttle per account and endpoint.
+
+    The bucket is picked by the view's `throttle_scope` and configured in
+    `THROTTLE_BUCKETS`; scopes without a bucket are not throttled.
+    """
+
+    def __init__(self):
+        self.wait_time = 0
+
+    def allow_request(self, request, view):
+        scope = getattr(view, 'throttle_scope', None)
+        bucket = getattr(settings, 'THROTTLE_BUCKETS', {}).get(scope)
+        if bucket is None:
+            return True
+
+        user = request.user
+        ident = user.pk if user.is_authenticated else self.get_ident(request)
+        rate, capacity = parse_bucket(bucket)
+        self.wait_time = get_backend().consume(f'{scope}:{ident}', rate,
+                                               capacity)
+        if self.wait_time:
+            metrics.incr(f'throttle.{scope}.rejected')
+            return False
+        metrics.incr(f'throttle.{scope}.accepted')
+        return True
+
+    def wait(self):
+        return self.wait_time
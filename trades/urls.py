@@ -6,6 +6,10 @@ from trades import views as trades
 router = routers.DefaultRouter()
 router.register('orders', trades.OrderViewSet, basename='orders')
 router.register('summary', trades.OrderSummaryViewSet, basename='order-summary')
+router.register('stocks/search', trades.StockSearchViewSet,
+                basename='stock-search')
+router.register('portfolio/history', trades.PortfolioHistoryViewSet,
+                basename='portfolio-history')
 router.register(r'shares/(?P<scope>\w+)', trades.StockShareSummaryViewSet,
                 basename='shares')
 
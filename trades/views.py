@@ -1,5 +1,11 @@
-from django.db.models import Sum
+from datetime import datetime, time, timedelta
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import OuterRef, Subquery, Sum
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
 from rest_framework import status
+from rest_framework.exceptions import ValidationError
 from rest_framework import mixins, viewsets
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
@@ -7,8 +13,12 @@ from rest_framework.renderers import JSONRenderer
 from trades.models import Stock, Order, StockShare
 from trades.serializers import (OrderSerializer,
                                 OrderListSerializer,
+                                StockSerializer,
                                 StockShareSerializer)
 from trades.filters import OrderFilter
+from trades.idempotency import idempotency_store, hash_request
+from trades import intake, portfolio
+from trades.search import stock_index
 from strader.utils import constants
 
 
@@ -30,6 +40,8 @@ class OrderViewSet(mixins.ListModelMixin, mixins.CreateModelMixin,
                 - `quantity` float (required) number of shares
                 - `price` float (required) desired price for the order
                 - `order_type` str (required) BUY or SELL
+            `Idempotency-Key` header (optional) retries with the same key
+                return the original response instead of placing a new order
     """
 
     model = Order
@@ -39,6 +51,10 @@ class OrderViewSet(mixins.ListModelMixin, mixins.CreateModelMixin,
     filter_class = OrderFilter
     renderer_classes = [JSONRenderer]
 
+    @property
+    def throttle_scope(self):
+        return 'orders.create' if self.action == 'create' else 'orders'
+
     def get_queryset(self):
         """Override to get corresponding order of a user"""
 
@@ -46,7 +62,8 @@ class OrderViewSet(mixins.ListModelMixin, mixins.CreateModelMixin,
             return Order.objects.none()
 
         account = self.request.user.account
-        return Order.objects.filter(account=account)
+        return Order.objects.filter(account=account).select_related(
+            'stock', 'status', 'order_type')
 
     def get_serializer_class(self):
         """Override to get appropriate serializer based on request method"""
@@ -56,6 +73,58 @@ class OrderViewSet(mixins.ListModelMixin, mixins.CreateModelMixin,
         else:
             return OrderSerializer
 
+    def get_serializer_context(self):
+        """
+        Override to commit new orders through the batched intake when
+        enabled. Orders sent with an Idempotency-Key are committed directly,
+        in the transaction that stores their key.
+        """
+
+        context = super().get_serializer_context()
+        context['batched'] = (intake.enabled() and
+                              not self.request.headers.get('Idempotency-Key'))
+        return context
+
+    def replay(self, stored, request_hash):
+        """Build the response of a retried request from the stored one"""
+
+        stored_hash, status_code, data = stored
+        if stored_hash != request_hash:
+            return Response({'details': 'Idempotency-Key was already used '
+                                        'for a different request.'},
+                            status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+        return Response(data, status=status_code,
+                        headers={'Idempotent-Replayed': 'true'})
+
+    def create(self, request, *args, **kwargs):
+        """Override to support the `Idempotency-Key` header"""
+
+        key = request.headers.get('Idempotency-Key')
+        if not key:
+            return super().create(request, *args, **kwargs)
+        if len(key) > 64:
+            raise ValidationError({'details': 'Idempotency-Key is too long.'})
+
+        # cheap duplicate check before validation and DB writes
+        account_id = request.user.account.pk
+        request_hash = hash_request(request.data)
+        stored = idempotency_store.get(account_id, key)
+        if stored is not None:
+            return self.replay(stored, request_hash)
+
+        try:
+            with transaction.atomic():
+                response = super().create(request, *args, **kwargs)
+                idempotency_store.save(account_id, key, request_hash,
+                                       response.status_code, response.data)
+        except IntegrityError:
+            # a concurrent request with the same key committed first
+            stored = idempotency_store.get(account_id, key)
+            if stored is None:
+                raise
+            return self.replay(stored, request_hash)
+        return response
+
 
 class OrderSummaryViewSet(viewsets.GenericViewSet):
     """
@@ -68,6 +137,7 @@ class OrderSummaryViewSet(viewsets.GenericViewSet):
     serializer_class = OrderListSerializer
     permission_classes = [IsAuthenticated]
     renderer_classes = [JSONRenderer]
+    throttle_scope = 'summary'
 
     def compute_total_value(self, order_type, stock=None):
         """
@@ -120,6 +190,7 @@ class StockShareSummaryViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
     queryset = StockShare.objects.all()
     serializer_class = StockShareSerializer
     permission_classes = [IsAuthenticated]
+    throttle_scope = 'shares'
 
     def get_queryset(self):
         """Override to get corresponding shares of a user"""
@@ -130,6 +201,13 @@ class StockShareSummaryViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
         account = self.request.user.account
         return StockShare.objects.filter(account=account, total_value__gt=0)
 
+    def get_list_queryset(self):
+        """Shares annotated with the last traded price of their stock"""
+
+        last_price = (Order.objects.filter(stock=OuterRef('stock'))
+                      .order_by('-id').values('price')[:1])
+        return self.get_queryset().annotate(last_price=Subquery(last_price))
+
     def list(self, request, scope=None):
         """
         API for the total value a user in their portfolio.
@@ -137,7 +215,8 @@ class StockShareSummaryViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
         - Parameters
             - `scope` str Possible values: `summary` or `all`
             If scope == summary, return the total value in user's portfolio,
-            If scope == all, return the list of stocks shares the user own.
+            If scope == all, return the list of stocks shares the user own
+            with their cost basis, realized and unrealized P&L.
         """
 
         qs = self.get_queryset()
@@ -145,5 +224,112 @@ class StockShareSummaryViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
             total = qs.aggregate(total=Sum('total_value'))['total'] or 0.0
             return Response({'total_investment': total}, status=200)
         else:
-            serializer = self.get_serializer(qs, many=True)
+            serializer = self.get_serializer(self.get_list_queryset(),
+                                             many=True)
             return Response(serializer.data, status=status.HTTP_200_OK)
+
+
+class StockSearchViewSet(viewsets.GenericViewSet):
+    """
+        API for searching stocks by code or name.
+    """
+
+    model = Stock
+    queryset = Stock.objects.all()
+    serializer_class = StockSerializer
+    permission_classes = [IsAuthenticated]
+    renderer_classes = [JSONRenderer]
+    throttle_scope = 'stock-search'
+
+    def list(self, request, *args, **kwargs):
+        """
+        API for searching stocks by code or name. Results are served from
+        the in-memory stock index, prefix matches first.
+
+        - Parameters:
+            - `q` str (required) code or name fragment to search for
+            - `limit` int (optional) max number of results (default: 20)
+        """
+
+        query = request.GET.get('q', '')
+        try:
+            limit = max(1, min(int(request.GET.get('limit', 20)), 100))
+        except ValueError:
+            limit = 20
+
+        stocks = stock_index.search(query, limit=limit)
+        serializer = self.get_serializer(stocks, many=True)
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+
+class PortfolioHistoryViewSet(viewsets.GenericViewSet):
+    """
+        API for the positions of a user at a point in time or over a range.
+    """
+
+    model = Order
+    queryset = Order.objects.all()
+    serializer_class = OrderListSerializer
+    permission_classes = [IsAuthenticated]
+    renderer_classes = [JSONRenderer]
+    throttle_scope = 'portfolio-history'
+
+    def parse_date(self, name, required=True):
+        """
+        Parse a datetime query parameter. A date alone means the end of
+        that day.
+        """
+
+        value = self.request.GET.get(name)
+        if not value:
+            if required:
+                raise ValidationError({'details': f'`{name}` is required.'})
+            return None
+
+        # a date first: since Django 4.0 `parse_datetime` also accepts one,
+        # as its midnight
+        try:
+            day = parse_date(value)
+            date = parse_datetime(value) if day is None else None
+        except ValueError:
+            # well formed but impossible, e.g. 2020-02-31
+            date = day = None
+        if day is not None:
+            date = datetime.combine(day + timedelta(days=1), time.min) - \
+                timedelta(microseconds=1)
+        elif date is None:
+            raise ValidationError({'details': f'Invalid `{name}`.'})
+        if timezone.is_naive(date):
+            date = timezone.make_aware(date)
+        return date
+
+    def list(self, request, *args, **kwargs):
+        """
+        API for the positions of a user at a point in time or, with `start`
+        and `end`, at the end of every day in between.
+
+        - Parameters:
+            - `at` str (optional) ISO date or datetime, defaults to now
+            - `start` str (optional) ISO date or datetime of the range start
+            - `end` str (optional) ISO date or datetime of the range end
+        """
+
+        account_id = request.user.account.pk
+        start = self.parse_date('start', required=False)
+        if start is None:
+            at = self.parse_date('at', required=False) or timezone.now()
+            positions = portfolio.positions_at(account_id, at)
+            codes = portfolio.stock_codes(positions)
+            return Response(portfolio.describe(at, positions, codes),
+                            status=status.HTTP_200_OK)
+
+        end = self.parse_date('end')
+        max_points = getattr(settings, 'PORTFOLIO_HISTORY_MAX_POINTS', 366)
+        if end < start or (end - start).days >= max_points:
+            raise ValidationError({'details': 'Invalid date range.'})
+
+        points = portfolio.positions_between(account_id, start, end)
+        codes = portfolio.stock_codes(*(item for _, item in points))
+        data = [portfolio.describe(date, item, codes)
+                for date, item in points]
+        return Response(data, status=status.HTTP_200_OK)